@@ -0,0 +1,285 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+from docopt import docopt
+
+from . import config
+from . import db
+from . import jobs
+from . import thumbnail_store
+from .thumbnail_store import DISPLAY_LEVEL, LEVELS, thumbnail_keys
+from .helper import logger, message_level
+from .tasks import TaskManager
+
+USAGE = """
+Usage:
+    TagOrganizer [options]
+    TagOrganizer task <task> [options]
+    TagOrganizer import <directory> [options]
+    TagOrganizer scan [options]
+    TagOrganizer thumbnails [options]
+    TagOrganizer vacuum [options]
+    TagOrganizer queue <kind>... [options]
+    TagOrganizer worker [options]
+
+--config=<file>                 Use this config file
+--profile=<profile>             Use this profile
+--import-from-f-spot=<f-spot>   Try to load data from this f-spot database
+--json                          Print a summary as JSON (only for commands)
+--workers=<n>                   Number of worker processes [default: 1]
+--batch=<n>                     Jobs a worker claims at once [default: 20]
+--kinds=<kinds>                 Jobs a worker runs [default: hash,metadata,thumbnail]
+--wait                          Workers wait for new jobs instead of stopping
+
+Without a command the GUI starts. Commands run without a GUI:
+
+task <task>        Run a task: update-timestamps, update-locations,
+                   update-hashes, find-duplicates, update-similarity,
+                   create-thumbnails, probe-videos, move-files,
+                   fix-no-date-files
+import <directory> Add all photos and videos in a directory
+scan               Compare the photo and video dirs with the db
+thumbnails         Create missing thumbnails
+vacuum             Compact the db
+queue <kind>...    Queue jobs (hash, metadata, thumbnail) for the workers
+worker             Run jobs from the queue in --workers processes, on
+                   this or other machines that can access the library
+
+"""
+
+COMMANDS = ["task", "import", "scan", "thumbnails", "vacuum", "queue", "worker"]
+
+# tasks that can be started with 'task <task>'
+TASKS = [
+    "update_timestamps",
+    "update_locations",
+    "update_hashes",
+    "find_duplicates",
+    "update_similarity",
+    "create_thumbnails",
+    "probe_videos",
+    "move_files",
+    "fix_no_date_files",
+]
+
+
+class ConsoleMessages:
+    """Print messages, or collect them if we print JSON at the end."""
+
+    def __init__(self, json_output: bool):
+        self.json_output = json_output
+        self.lines = []
+        # only draw a progress line if someone is watching
+        self.show_progress = not json_output and sys.stderr.isatty()
+
+    def add(self, text: str):
+        self.lines.append(text)
+        logger.log(message_level(text), text)
+        if self.json_output:
+            return
+        self.clear_progress()
+        print(text, flush=True)
+
+    def progress(self, text: str):
+        if self.show_progress:
+            print(f"\r\033[K{text}", end="", file=sys.stderr, flush=True)
+
+    def clear_progress(self):
+        if self.show_progress:
+            print("\r\033[K", end="", file=sys.stderr, flush=True)
+
+
+class Headless:
+    """Stand-in for the main window when running tasks without a GUI."""
+
+    def __init__(self, config: config.ConfigManager, messages: ConsoleMessages):
+        self.config = config
+        self.messages = messages
+
+    def update_items(self):
+        pass
+
+
+class ConsoleTaskManager(TaskManager):
+    """Show the progress of the running task in the terminal."""
+
+    def __init__(self, main: Headless):
+        # we do not need to return to an event loop, so use larger steps
+        super().__init__(main, budget=0.5)
+        self.pool_timeout = 0.1
+        self.last_update = 0.0
+
+    def update_progress(self):
+        running = self.scheduler.runnable()
+        if not running or time.monotonic() - self.last_update < 0.5:
+            return
+        self.last_update = time.monotonic()
+
+        task = running[0]
+        progress = f"{task.current}/{task.total}" if task.total else task.current
+        self.main.messages.progress(f"{task.name}: {progress}, {task.status()}")
+
+
+def history_to_dict(entry) -> dict:
+    return {
+        "name": entry.name,
+        "kind": entry.kind,
+        "status": entry.status,
+        "started": entry.started.isoformat(),
+        "wall_time": entry.wall_time,
+        "total": entry.total,
+        "items": entry.items,
+        "bytes": entry.bytes,
+        "errors": entry.errors,
+    }
+
+
+def run(commands: dict) -> int:
+    """Run a command without the GUI, returns the exit code."""
+    configfile = None
+    if commands["--config"]:
+        configfile = Path(commands["--config"]).expanduser()
+        if not configfile.is_file():
+            print(f"[Error] config file {configfile} cannot be opened", file=sys.stderr)
+            return 1
+    profile = commands["--profile"] or "default"
+    settings = config.ConfigManager(configfile, profile)
+
+    messages = ConsoleMessages(commands["--json"])
+    tasks = ConsoleTaskManager(Headless(settings, messages))
+
+    last_id = db.get_last_task_history_id()
+
+    if commands["task"]:
+        kind = commands["<task>"].replace("-", "_")
+        if kind not in TASKS:
+            print(f"[Error] unknown task {commands['<task>']}", file=sys.stderr)
+            return 2
+        tasks.submit_resumable(kind)
+    elif commands["import"]:
+        directory = Path(commands["<directory>"]).expanduser().resolve()
+        if not directory.is_dir():
+            print(f"[Error] {directory} is not a directory", file=sys.stderr)
+            return 2
+        tasks.add_directory(directory)
+    elif commands["scan"]:
+        tasks.list_files_not_in_db()
+    elif commands["thumbnails"]:
+        # QPixmap needs a QGuiApplication, the offscreen platform works
+        # without a display
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        # the other commands do not load Qt at all
+        from qtpy.QtGui import QGuiApplication
+
+        app = QGuiApplication(sys.argv)  # noqa: F841
+        tasks.create_thumbnails()
+    elif commands["vacuum"]:
+        before, after = db.vacuum()
+        messages.add(f"db size: {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+        # remove thumbnails of items that are not in the db anymore, older
+        # keys are only needed until the thumbnail is stored under the
+        # current key
+        stored = thumbnail_store.store.keys(LEVELS[0])
+        keep = set()
+        for item in db.get_all_items():
+            keys = thumbnail_keys(item)
+            keep.update(keys[:1] if keys and keys[0] in stored else keys)
+        deleted = thumbnail_store.store.prune(keep)
+        thumbnail_store.store.trim(DISPLAY_LEVEL, thumbnail_store.store.display_budget)
+        before, after = thumbnail_store.store.compact()
+        messages.add(
+            f"removed {deleted} unused thumbnails, thumbnail size:"
+            f" {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB"
+        )
+    elif commands["queue"]:
+        for kind in commands["<kind>"]:
+            if kind not in jobs.JOB_KINDS:
+                print(f"[Error] unknown kind of job {kind}", file=sys.stderr)
+                return 2
+        for kind in commands["<kind>"]:
+            added = jobs.queue_jobs(kind, settings.photos, settings.verify_hashes)
+            messages.add(f"queued {added} {kind} jobs")
+    elif commands["worker"]:
+        kinds = commands["--kinds"].split(",")
+        for kind in kinds:
+            if kind not in jobs.JOB_KINDS:
+                print(f"[Error] unknown kind of job {kind}", file=sys.stderr)
+                return 2
+        worker_config = jobs.WorkerConfig(
+            db=settings.db,
+            wal=settings.wal,
+            photos=settings.photos,
+            thumbnails=settings.thumbnails,
+            verify_hashes=settings.verify_hashes,
+            kinds=kinds,
+            batch=int(commands["--batch"]),
+            wait=commands["--wait"],
+        )
+
+    exit_code = 0
+    try:
+        if commands["worker"]:
+            done, failed = jobs.run_workers(
+                worker_config, int(commands["--workers"]), messages.progress
+            )
+            messages.add(f"finished {done} jobs, {failed} jobs failed")
+        tasks.run_all()
+    except KeyboardInterrupt:
+        # keep the checkpoints, so that the tasks can continue next time
+        tasks.suspend()
+        exit_code = 130
+    messages.clear_progress()
+
+    history = [
+        history_to_dict(entry)
+        for entry in reversed(db.get_task_history(limit=None, after_id=last_id))
+    ]
+    if any(entry["status"] == "failed" for entry in history) and not exit_code:
+        exit_code = 1
+
+    if commands["--json"]:
+        summary = {
+            "command": next(c for c in COMMANDS if commands[c]),
+            "profile": settings.profile,
+            "tasks": history,
+            "jobs": db.get_job_counts(),
+            "messages": messages.lines,
+            "exit_code": exit_code,
+        }
+        print(json.dumps(summary, indent=2))
+    return exit_code
+
+
+def main():
+    commands = docopt(USAGE)
+
+    if not any(commands[c] for c in COMMANDS):
+        # only import Qt widgets and WebEngine if we start the GUI
+        from . import main as gui
+
+        gui.main(commands)
+
+    sys.exit(run(commands))
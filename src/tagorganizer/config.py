@@ -25,6 +25,9 @@ import sys
 import os
 
 from . import db
+from . import image_cache
+from . import thumbnail_store
+from .helper import set_log_file
 from .migrations import upgrade_db
 
 # Define the application name and author
@@ -34,6 +37,7 @@ APP_AUTHOR = "TagOrganizer"
 # Define the path to the config file
 config_dir = Path(platformdirs.user_config_dir(APP_NAME, APP_AUTHOR))
 default_config_file_path = config_dir / "config.ini"
+cache_dir = Path(platformdirs.user_cache_dir(APP_NAME, APP_AUTHOR))
 
 PHOTO_SUFFIX = [
     ".jpg",
@@ -49,20 +53,38 @@ PHOTO_SUFFIX = [
 ]
 VIDEO_SUFFIX = [".avi", ".mp4", ".mkv", ".mov", ".wmv", ".flv", ".webm"]
 ALL_SUFFIX = PHOTO_SUFFIX + VIDEO_SUFFIX
+# for fast lookups of (lower case) suffixes
+ALL_SUFFIX_SET = frozenset(ALL_SUFFIX)
+
+# default size of the thumbnails in the grid in pixels
+GRID_SIZE = 200
 
 
 class ConfigManager:
-    def __init__(self):
+    def __init__(self, config_file: Path | None = None, profile: str = "default"):
         self.config = None
 
-        self.profile = "default"
-        self.config_file = default_config_file_path
+        self.profile = profile
+        self.config_file = config_file or default_config_file_path
 
         # locations needed in app
         self.db = None
         self.photos = None
         self.videos = None
 
+        # options
+        self.verify_hashes = False
+        self.similarity_threshold = 6
+        self.watch = False
+        self.wal = True
+        self.log_file = None
+        self.thumbnails = None
+        self.thumbnail_cache_size = image_cache.THUMBNAIL_CACHE_SIZE
+        self.image_cache_size = image_cache.IMAGE_CACHE_SIZE
+        self.tile_cache_size = image_cache.TILE_CACHE_SIZE
+        self.display_cache_size = thumbnail_store.DISPLAY_CACHE_SIZE
+        self.grid_size = GRID_SIZE
+
         self.read_config()
 
     def read_config(self):
@@ -82,8 +104,58 @@ class ConfigManager:
         self.videos = (
             Path(self.config[self.profile]["video_path"]).expanduser().resolve()
         )
+        # always recalculate hashes, even if the stat fingerprint of a
+        # file did not change
+        self.verify_hashes = self.config[self.profile].getboolean(
+            "verify_hashes", fallback=False
+        )
+        # max number of different bits in the perceptual hash of near duplicates
+        self.similarity_threshold = self.config[self.profile].getint(
+            "similarity_threshold", fallback=6
+        )
+        # watch photo_path and video_path for new or removed files
+        self.watch = self.config[self.profile].getboolean("watch", fallback=False)
+        # use sqlite's WAL mode, turn off if workers on other machines
+        # share the db over a network filesystem
+        self.wal = self.config[self.profile].getboolean("wal", fallback=True)
+        # also write the messages to this file
+        log_file = self.config[self.profile].get("log_file", fallback=None)
+        self.log_file = Path(log_file).expanduser() if log_file else None
+        set_log_file(self.log_file)
+
+        # sqlite file with the thumbnails
+        self.thumbnails = Path(
+            self.config[self.profile].get(
+                "thumbnails",
+                fallback=str(cache_dir / f"{Path(self.db).stem}-thumbnails.db"),
+            )
+        ).expanduser()
+        # memory used for decoded thumbnails, photos and zoom tiles in MiB
+        self.thumbnail_cache_size = self.config[self.profile].getint(
+            "thumbnail_cache_size", fallback=image_cache.THUMBNAIL_CACHE_SIZE
+        )
+        self.image_cache_size = self.config[self.profile].getint(
+            "image_cache_size", fallback=image_cache.IMAGE_CACHE_SIZE
+        )
+        self.tile_cache_size = self.config[self.profile].getint(
+            "tile_cache_size", fallback=image_cache.TILE_CACHE_SIZE
+        )
+        image_cache.set_budgets(
+            self.thumbnail_cache_size, self.image_cache_size, self.tile_cache_size
+        )
+        # disk space used for display images in the thumbnail store in MiB
+        self.display_cache_size = self.config[self.profile].getint(
+            "display_cache_size", fallback=thumbnail_store.DISPLAY_CACHE_SIZE
+        )
+
+        # size of the thumbnails in the grid, the tiles get stretched
+        # to fill the width of the window
+        self.grid_size = self.config[self.profile].getint(
+            "grid_size", fallback=GRID_SIZE
+        )
 
-        db.set_engine(self.db)
+        db.set_engine(self.db, self.wal)
+        thumbnail_store.set_store(self.thumbnails, self.wal, self.display_cache_size)
         os.environ["TAGORGANIZER_DB_URL"] = f"sqlite:///{self.db}"
 
         # ensure we are using the latest version
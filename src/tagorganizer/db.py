@@ -18,22 +18,54 @@ along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
 
 """
 
+from datetime import datetime, timedelta, timezone
+import os
 from pathlib import Path
 
 from sqlmodel import SQLModel, create_engine, select, Session, func, delete
 from sqlalchemy.orm import selectinload
 import sqlalchemy as sa
-from sqlalchemy import or_
-
-from .models import Tag, Item, ItemTagLink
-from .widgets.tag_bar import Filters
+from sqlalchemy import event, or_
+from more_itertools import chunked
+
+from .models import (
+    Filters,
+    Tag,
+    Item,
+    ItemTagLink,
+    Job,
+    MoveJournal,
+    TaskCheckpoint,
+    TaskHistory,
+)
+from .similarity import HammingIndex
 
 engine = None
 
+# index of all perceptual hashes, created when needed
+similarity_index = None
+
+
+def set_engine(db_dir: str, wal: bool = True):
+    """Open the db, in WAL mode so that workers and the GUI can share it.
 
-def set_engine(db_dir: str):
+    WAL needs shared memory between the processes, so it does not
+    work for a db on a network filesystem that is used from several
+    machines, use wal=False in that case.
+    """
     global engine
-    engine = create_engine(f"sqlite:///{db_dir}")
+    # the index belongs to the previous db
+    reset_similarity_index()
+    # wait for other processes that are writing
+    engine = create_engine(f"sqlite:///{db_dir}", connect_args={"timeout": 30})
+
+    journal_mode = "WAL" if wal else "DELETE"
+
+    @event.listens_for(engine, "connect")
+    def set_journal_mode(connection, record):
+        cursor = connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.close()
 
 
 def create_db():
@@ -128,15 +160,27 @@ def set_parent_tag_by_id(child_id: int, parent_id: int):
         session.commit()
 
 
-def add_images(files):
+def add_images(files) -> int:
+    """Add files to the db, returns the number of new items."""
     with Session(engine) as session:
-        for f in files:
-            if check_item_in_db(str(f)) is not None:
-                print(f"Item with uri '{f}' already exists in DB.")
+        uris = list(dict.fromkeys(str(f) for f in files))
+        existing = set(session.exec(select(Item.uri).where(Item.uri.in_(uris))))
+        # files that reappeared
+        session.exec(
+            sa.update(Item)
+            .where(Item.uri.in_(existing), Item.missing == sa.true())
+            .values(missing=False)
+        )
+        added = 0
+        for uri in uris:
+            if uri in existing:
+                print(f"Item with uri '{uri}' already exists in DB.")
                 continue
-            tmp = Item(uri=str(f))
+            tmp = Item(uri=uri)
             session.add(tmp)
+            added += 1
         session.commit()
+        return added
 
 
 def add_image(filename):
@@ -164,10 +208,9 @@ def get_items_without_location() -> list[Item]:
         return results.all()
 
 
-def get_all_items_with_location():
+def get_all_items(after_id: int = 0) -> list[Item]:
     with Session(engine) as session:
-        statement = select(Item).where(Item.longitude != sa.null())
-        results = session.exec(statement)
+        results = session.exec(select(Item).where(Item.id > after_id).order_by(Item.id))
         return results.all()
 
 
@@ -177,12 +220,410 @@ def get_items_without_hashes() -> list[Item]:
         conditions = [
             Item.uri_md5 == "",
             Item.data_xxhash == "",
+            Item.size == sa.null(),
         ]
         query = query.where(or_(*conditions))
         results = session.exec(query)
         return results.all()
 
 
+def get_items_without_size() -> list[Item]:
+    with Session(engine) as session:
+        statement = select(Item).where(Item.size == sa.null())
+        results = session.exec(statement)
+        return results.all()
+
+
+def get_items_with_same_size() -> list[Item]:
+    """Return items that share their size with others, sorted by size.
+
+    Only sizes where at least one of the items has no hash yet are
+    included, since all other duplicates are already known.
+    """
+    with Session(engine) as session:
+        not_hashed = sa.case((Item.data_xxhash == "", 1), else_=0)
+        sizes = (
+            select(Item.size)
+            .where(Item.size != sa.null())
+            .group_by(Item.size)
+            .having(func.count(Item.id) > 1)
+            .having(func.sum(not_hashed) > 0)
+        )
+        statement = select(Item).where(Item.size.in_(sizes)).order_by(Item.size)
+        results = session.exec(statement)
+        return results.all()
+
+
+def duplicates_query():
+    """Select (size, data_xxhash) of all content that exists more than once."""
+    return (
+        select(Item.size, Item.data_xxhash)
+        .where(Item.data_xxhash != "")
+        .group_by(Item.size, Item.data_xxhash)
+        .having(func.count(Item.id) > 1)
+    )
+
+
+def get_number_of_duplicates() -> tuple[int, int]:
+    """Return the number of groups of duplicates and the number of items in them."""
+    with Session(engine) as session:
+        groups = session.exec(
+            select(func.count()).select_from(duplicates_query().subquery())
+        ).one()
+        items = session.exec(
+            select(func.count(Item.id)).where(
+                sa.tuple_(Item.size, Item.data_xxhash).in_(duplicates_query())
+            )
+        ).one()
+        return groups, items
+
+
+def get_items_without_phash() -> list[Item]:
+    with Session(engine) as session:
+        statement = select(Item).where(
+            Item.phash == sa.null(), Item.phash_failed == sa.false()
+        )
+        results = session.exec(statement)
+        return results.all()
+
+
+def get_phashes() -> tuple[list[int], list[int]]:
+    with Session(engine) as session:
+        statement = (
+            select(Item.id, Item.phash).where(Item.phash != sa.null()).order_by(Item.id)
+        )
+        results = session.exec(statement).all()
+        ids = [i for i, _ in results]
+        hashes = [h for _, h in results]
+        return ids, hashes
+
+
+def set_phash_groups(groups: dict[int, int]) -> None:
+    """Store the groups of near duplicates, all other items get no group."""
+    with Session(engine) as session:
+        session.exec(
+            sa.update(Item)
+            .where(Item.phash_group != sa.null())
+            .values(phash_group=sa.null())
+        )
+        if groups:
+            session.execute(
+                sa.update(Item),
+                [{"id": i, "phash_group": g} for i, g in groups.items()],
+            )
+        session.commit()
+
+
+def get_similarity_index() -> HammingIndex:
+    global similarity_index
+    if similarity_index is None:
+        similarity_index = HammingIndex(*get_phashes())
+    return similarity_index
+
+
+def reset_similarity_index() -> None:
+    global similarity_index
+    similarity_index = None
+
+
+def get_similar_item_ids(item_id: int, max_distance: int) -> list[int]:
+    index = get_similarity_index()
+    value = index.get_hash(item_id)
+    if value is None:
+        return [item_id]
+    ids, _ = index.query(value, max_distance)
+    return ids.tolist()
+
+
+def get_known_files(directory: Path) -> dict[str, tuple[int | None, int | None]]:
+    """Return (size, mtime_ns) for the uris of all items inside a directory."""
+    with Session(engine) as session:
+        query = select(Item.uri, Item.size, Item.mtime_ns).where(uri_in_dir(directory))
+        return {uri: (size, mtime_ns) for uri, size, mtime_ns in session.exec(query)}
+
+
+def uri_in_dir(directory: str | Path):
+    """Condition for items below a directory.
+
+    This is a range on the uri instead of a LIKE, since sqlite can only
+    use the index on uri for a LIKE if it is case sensitive.
+    """
+    prefix = os.path.join(str(directory), "")
+    # the first string after all strings that start with prefix
+    end = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return sa.and_(Item.uri >= prefix, Item.uri < end)
+
+
+def get_items_in_dir(directory: str) -> list[Item]:
+    with Session(engine) as session:
+        query = select(Item).where(uri_in_dir(directory))
+        return session.exec(query).all()
+
+
+def get_dated_items_in_dir(
+    directory: Path, after_uri: str = "", limit: int = 500
+) -> list[Item]:
+    """Return the next batch of items below a directory that have a date.
+
+    Items are ordered by uri, pass the uri of the last item to get the
+    next batch. Missing items are skipped.
+    """
+    with Session(engine) as session:
+        query = (
+            select(Item)
+            .where(uri_in_dir(directory))
+            .where(Item.uri > after_uri)
+            .where(Item.date != sa.null())
+            .where(Item.missing == sa.false())
+            .order_by(Item.uri)
+            .limit(limit)
+        )
+        return session.exec(query).all()
+
+
+def count_items_in_dir(directory: Path, dated: bool) -> int:
+    """Number of items below a directory with (or without) a date."""
+    with Session(engine) as session:
+        date = Item.date != sa.null() if dated else Item.date == sa.null()
+        query = (
+            select(func.count(Item.id))
+            .where(uri_in_dir(directory))
+            .where(date)
+            .where(Item.missing == sa.false())
+        )
+        return session.exec(query).one()
+
+
+def get_items_by_uris(uris: list[str]) -> list[Item]:
+    with Session(engine) as session:
+        items = []
+        for chunk in chunked(uris, 500):
+            items.extend(session.exec(select(Item).where(Item.uri.in_(chunk))))
+        return items
+
+
+def set_missing(uris: list[str]) -> int:
+    """Mark items whose files vanished from disk, returns the number of new ones."""
+    with Session(engine) as session:
+        marked = 0
+        for chunk in chunked(uris, 500):
+            result = session.exec(
+                sa.update(Item)
+                .where(Item.uri.in_(chunk), Item.missing == sa.false())
+                .values(missing=True)
+            )
+            marked += result.rowcount
+        session.commit()
+        return marked
+
+
+def get_items_by_ids(ids: list[int]) -> list[Item]:
+    with Session(engine) as session:
+        items = []
+        for chunk in chunked(ids, 500):
+            items.extend(session.exec(select(Item).where(Item.id.in_(chunk))))
+        return items
+
+
+def add_move_journal(entries: list[MoveJournal]) -> None:
+    """Store planned moves, sets the ids of the entries."""
+    with Session(engine, expire_on_commit=False) as session:
+        session.add_all(entries)
+        session.commit()
+
+
+def get_move_journal() -> list[MoveJournal]:
+    with Session(engine) as session:
+        return session.exec(select(MoveJournal).order_by(MoveJournal.id)).all()
+
+
+def set_move_state(entry: MoveJournal, state: str) -> None:
+    with Session(engine) as session:
+        session.exec(
+            sa.update(MoveJournal).where(MoveJournal.id == entry.id).values(state=state)
+        )
+        session.commit()
+    entry.state = state
+
+
+def finish_moves(items: list[Item], entries: list[MoveJournal]) -> None:
+    """Update the moved items and remove their journal entries in one go."""
+    with Session(engine, expire_on_commit=False) as session:
+        session.add_all(items)
+        for chunk in chunked([e.id for e in entries], 500):
+            session.exec(delete(MoveJournal).where(MoveJournal.id.in_(chunk)))
+        session.commit()
+
+
+def enqueue_jobs(kind: str, item_ids: list[int]) -> int:
+    """Add jobs for items that do not have a queued or running job of this kind.
+
+    Failed jobs of these items get replaced. Returns the number of new jobs.
+    """
+    added = 0
+    with Session(engine) as session:
+        for chunk in chunked(item_ids, 500):
+            session.exec(
+                delete(Job)
+                .where(Job.kind == kind)
+                .where(Job.state == "failed")
+                .where(Job.item_id.in_(chunk))
+            )
+            pending = set(
+                session.exec(
+                    select(Job.item_id)
+                    .where(Job.kind == kind)
+                    .where(Job.item_id.in_(chunk))
+                )
+            )
+            new = [Job(kind=kind, item_id=i) for i in chunk if i not in pending]
+            session.add_all(new)
+            added += len(new)
+        session.commit()
+    return added
+
+
+def utcnow() -> datetime:
+    """The current time in UTC, without tzinfo like all dates in the db."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def claim_jobs(worker: str, kinds: list[str], n: int, timeout: float) -> list[Job]:
+    """Mark up to n queued jobs as running for this worker and return them.
+
+    This is a single UPDATE ... RETURNING, so several workers never
+    claim the same job. Jobs whose worker did not finish them within
+    `timeout` seconds (e.g. it crashed) get claimed again, see
+    `renew_jobs` for jobs that take longer. The times are in UTC, so
+    workers on machines in other time zones agree on them.
+    """
+    now = utcnow()
+    claimable = or_(
+        Job.state == "queued",
+        sa.and_(Job.state == "running", Job.claimed < now - timedelta(seconds=timeout)),
+    )
+    ids = (
+        select(Job.id)
+        .where(Job.kind.in_(kinds))
+        .where(claimable)
+        .order_by(Job.id)
+        .limit(n)
+    )
+    statement = (
+        sa.update(Job)
+        .where(Job.id.in_(ids.scalar_subquery()))
+        .values(state="running", worker=worker, claimed=now)
+        .returning(Job)
+    )
+    with Session(engine, expire_on_commit=False) as session:
+        jobs = session.exec(statement).scalars().all()
+        session.commit()
+    return jobs
+
+
+def renew_jobs(worker: str, jobs: list[Job]) -> None:
+    """Tell other workers that we are still working on these jobs.
+
+    Only jobs that are still claimed by this worker get renewed.
+    """
+    with Session(engine) as session:
+        for chunk in chunked([job.id for job in jobs], 500):
+            session.exec(
+                sa.update(Job)
+                .where(Job.id.in_(chunk))
+                .where(Job.state == "running")
+                .where(Job.worker == worker)
+                .values(claimed=utcnow())
+            )
+        session.commit()
+
+
+def finish_jobs(items: list[Item], done: list[Job], failed: list[Job]) -> None:
+    """Update the items, remove the finished jobs and keep the failed ones."""
+    with Session(engine, expire_on_commit=False) as session:
+        session.add_all(items)
+        for chunk in chunked([job.id for job in done], 500):
+            session.exec(delete(Job).where(Job.id.in_(chunk)))
+        for job in failed:
+            session.exec(
+                sa.update(Job)
+                .where(Job.id == job.id)
+                .values(state="failed", error=job.error)
+            )
+        session.commit()
+
+
+def release_jobs(jobs: list[Job]) -> None:
+    """Put claimed jobs back into the queue, e.g. if a worker gets stopped."""
+    with Session(engine) as session:
+        for chunk in chunked([job.id for job in jobs], 500):
+            session.exec(
+                sa.update(Job)
+                .where(Job.id.in_(chunk))
+                .values(state="queued", worker=None, claimed=None)
+            )
+        session.commit()
+
+
+def get_job_counts() -> dict[str, int]:
+    """Number of jobs by state."""
+    with Session(engine) as session:
+        query = select(Job.state, func.count(Job.id)).group_by(Job.state)
+        return dict(session.exec(query).all())
+
+
+def get_task_checkpoints() -> list[TaskCheckpoint]:
+    with Session(engine) as session:
+        return session.exec(select(TaskCheckpoint).order_by(TaskCheckpoint.id)).all()
+
+
+def save_task_checkpoint(checkpoint: TaskCheckpoint) -> None:
+    with Session(engine, expire_on_commit=False) as session:
+        session.add(checkpoint)
+        session.commit()
+
+
+def delete_task_checkpoint(id: int) -> None:
+    with Session(engine) as session:
+        session.exec(delete(TaskCheckpoint).where(TaskCheckpoint.id == id))
+        session.commit()
+
+
+def add_task_history(entry: TaskHistory) -> None:
+    with Session(engine) as session:
+        session.add(entry)
+        session.commit()
+
+
+def get_task_history(limit: int | None = 20, after_id: int = 0) -> list[TaskHistory]:
+    with Session(engine) as session:
+        query = (
+            select(TaskHistory)
+            .where(TaskHistory.id > after_id)
+            .order_by(TaskHistory.id.desc())
+            .limit(limit)
+        )
+        return session.exec(query).all()
+
+
+def get_last_task_history_id() -> int:
+    with Session(engine) as session:
+        return session.exec(select(func.max(TaskHistory.id))).one() or 0
+
+
+def vacuum() -> tuple[int, int]:
+    """Rebuild the db file and update the statistics of the query planner.
+
+    Returns the size of the db file before and after.
+    """
+    before = os.path.getsize(engine.url.database)
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM")
+        connection.exec_driver_sql("ANALYZE")
+    return before, os.path.getsize(engine.url.database)
+
+
 def get_all_items_not_in_dir(directories: list[Path], suffix: list[str]):
     with Session(engine) as session:
         all_suffixes = []
@@ -203,7 +644,8 @@ def get_all_items_not_in_dir(directories: list[Path], suffix: list[str]):
 
 
 def update_items_in_db(items: list[Item]) -> None:
-    with Session(engine) as session:
+    # keep the items usable after the commit, e.g. for the next task
+    with Session(engine, expire_on_commit=False) as session:
         for i in items:
             session.add(i)
         session.commit()
@@ -262,6 +704,20 @@ def filter_query(query, filter: Filters):
         query = query.where(Item.date == sa.null())
     if filter.no_gps:
         query = query.where(Item.latitude == sa.null())
+    if filter.missing:
+        query = query.where(Item.missing == sa.true())
+
+    if filter.duplicates:
+        query = query.where(
+            sa.tuple_(Item.size, Item.data_xxhash).in_(duplicates_query())
+        )
+
+    if filter.near_duplicates:
+        query = query.where(Item.phash_group != sa.null())
+
+    if filter.similar_to is not None:
+        ids = get_similar_item_ids(filter.similar_to, filter.similarity_threshold)
+        query = query.where(Item.id.in_(ids))
 
     if filter.wrong_dir and filter.directories:
         for directory in filter.directories:
@@ -270,20 +726,28 @@ def filter_query(query, filter: Filters):
     return query
 
 
-def get_images(page: int = 0, filters: Filters | None = None) -> list[Item]:
+def get_item_ids(filters: Filters | None = None) -> list[int]:
+    """Ids of all items in the view, in the order they are shown.
+
+    The grid keeps this as a snapshot and loads the items it shows
+    with `get_items_by_ids`.
+    """
     with Session(engine) as session:
-        query = select(Item)
+        query = select(Item.id)
         if filters:
             query = filter_query(query, filters)
 
-        # Sort by date in descending order
-        query = query.order_by(Item.date.desc())
-
-        # Pagination
-        query = query.offset(25 * page).limit(25)
+        # Sort by date in descending order, keep (near) duplicates together
+        if filters and filters.duplicates:
+            query = query.order_by(Item.data_xxhash, Item.date.desc())
+        elif filters and filters.near_duplicates:
+            query = query.order_by(Item.phash_group, Item.date.desc())
+        else:
+            query = query.order_by(Item.date.desc())
+        # keep the order of items with the same date stable
+        query = query.order_by(Item.id)
 
-        items = session.exec(query).all()
-        return items
+        return list(session.exec(query).all())
 
 
 def get_number_of_items(filters: Filters | None = None):
@@ -317,16 +781,6 @@ def get_times_and_location_from_images(filters: Filters = None) -> list:
         return dates, coords
 
 
-def get_current_image(number, filters: Filters | None = None):
-    with Session(engine) as session:
-        query = select(Item)
-        if filters:
-            query = filter_query(query, filters)
-
-        results = session.exec(query.offset(number).limit(1))
-        return results.first()
-
-
 def get_common_tags(items: list[Item]) -> list[Tag]:
     with Session(engine) as session:
         # Load items and their tags
@@ -0,0 +1,313 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import hashlib
+import logging
+from logging.handlers import RotatingFileHandler
+import os
+from pathlib import Path
+import struct
+
+import exifread as exif
+import xxhash
+
+from .models import Item
+
+# messages for the user also go to this logger, see set_log_file
+logger = logging.getLogger("tagorganizer")
+logger.setLevel(logging.INFO)
+# alembic configures the root logger, we do not want to end up there
+logger.propagate = False
+
+# max size of the log file and how many old ones we keep
+LOG_SIZE = 5_000_000
+LOG_BACKUPS = 3
+
+# boxes MP4 and (older) MOV files start with
+FIRST_BOXES = {b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip"}
+
+
+@lru_cache(1_000)
+def load_exif(file):
+    file = Path(file)
+    if not file.is_file():
+        return {}
+    with file.open("rb") as f:
+        tags = exif.process_file(f)
+        return tags
+
+
+def get_orientation(file):
+    tags = load_exif(file)
+    orientation_tag = "Image Orientation"
+    if orientation_tag in tags:
+        orientation = tags[orientation_tag].values[0]
+    else:
+        orientation = 1  # Default to normal orientation if tag is not found
+    return orientation
+
+
+def calculate_md5(input_string: str) -> str:
+    md5_hash = hashlib.md5()
+    md5_hash.update(input_string.encode("utf-8"))
+    md5_hex = md5_hash.hexdigest()
+
+    return md5_hex
+
+
+def calculate_xxhash(file_path: Path) -> str:
+    hasher = xxhash.xxh128()
+
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(4096), b""):
+            hasher.update(chunk)
+
+    xxhash_hex = hasher.hexdigest()
+
+    return xxhash_hex
+
+
+def calculate_partial_xxhash(file_path: Path, size: int, block: int = 65536) -> str:
+    """Hash the first and last block of a file.
+
+    This is a cheap prefilter for finding duplicates: only files whose
+    partial hashes match need to be read completely.
+    """
+    hasher = xxhash.xxh128()
+
+    with open(file_path, "rb") as file:
+        hasher.update(file.read(block))
+        if size > block:
+            file.seek(max(size - block, block))
+            hasher.update(file.read(block))
+
+    return hasher.hexdigest()
+
+
+def get_fingerprint(file_path: Path) -> tuple[int, int, int, int]:
+    """Return (device, inode, size, mtime_ns) of a file.
+
+    If the fingerprint of a file did not change, we assume that its
+    content did not change either, so that we do not need to read the
+    whole file again to calculate its hash.
+    """
+    stat = os.stat(file_path)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def set_fingerprint(item: Item, fingerprint: tuple[int, int, int, int]) -> None:
+    item.device, item.inode, item.size, item.mtime_ns = fingerprint
+
+
+def fingerprint_matches(item: Item, fingerprint: tuple[int, int, int, int]) -> bool:
+    return (item.device, item.inode, item.size, item.mtime_ns) == tuple(fingerprint)
+
+
+def convert_to_degrees(value, ref):
+    d = float(value.values[0])
+    m = float(value.values[1])
+    s = float(value.values[2])
+
+    f = d + (m / 60.0) + (s / 3600.0)
+    if ref not in ["E", "N"]:
+        f = -f
+    return f
+
+
+def find_box(f, box_type: bytes, end: int) -> int | None:
+    """Find a box in an MP4/MOV file between the current position and end.
+
+    Returns the size of its content and leaves the file at the start
+    of the content.
+    """
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        size, kind = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", f.read(8))
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return None
+        if kind == box_type:
+            return size - header
+        f.seek(start + size)
+    return None
+
+
+def read_creation_time(file: Path) -> datetime | None:
+    """Return the creation time from the 'mvhd' box of MP4/MOV files.
+
+    The time is stored in UTC, we return it in local time like the
+    EXIF dates. Returns None for other files or if it is not set.
+    """
+    try:
+        with open(file, "rb") as f:
+            f.seek(4)
+            if f.read(4) not in FIRST_BOXES:
+                return None
+            f.seek(0)
+            end = os.fstat(f.fileno()).st_size
+            size = find_box(f, b"moov", end)
+            if size is None:
+                return None
+            size = find_box(f, b"mvhd", f.tell() + size)
+            if size is None or size < 12:
+                return None
+            version = f.read(4)[0]
+            if version == 1:
+                (seconds,) = struct.unpack(">Q", f.read(8))
+            else:
+                (seconds,) = struct.unpack(">I", f.read(4))
+    except (OSError, struct.error):
+        return None
+    if not seconds:
+        return None
+    # seconds since 1904
+    date = datetime(1904, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=seconds)
+    return date.astimezone().replace(tzinfo=None)
+
+
+def read_jpeg_size(file: Path) -> tuple[int, int] | None:
+    """Return (width, height) from the header of a JPEG file.
+
+    Only the markers before the image data are read. Returns None for
+    other files or if there is no frame header.
+    """
+    try:
+        with open(file, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return None
+            while True:
+                byte = f.read(1)
+                if byte != b"\xff":
+                    return None
+                marker = f.read(1)
+                # fill bytes
+                while marker == b"\xff":
+                    marker = f.read(1)
+                if not marker:
+                    return None
+                code = marker[0]
+                if code == 0x01 or 0xD0 <= code <= 0xD7:
+                    # markers without a segment
+                    continue
+                (length,) = struct.unpack(">H", f.read(2))
+                # start of frame, but not DHT, JPG and DAC
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    _, height, width = struct.unpack(">BHH", f.read(5))
+                    return width, height
+                if code == 0xDA or length < 2:
+                    # image data starts without a frame header
+                    return None
+                f.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+
+def read_date(item: Item) -> bool:
+    """Set the date of an item from its EXIF data, returns True if found.
+
+    For videos we use the creation time of MP4/MOV files. Raises
+    ValueError if the date cannot be parsed.
+    """
+    tags = load_exif(Path(item.uri))
+    if "EXIF DateTimeOriginal" not in tags:
+        date = read_creation_time(Path(item.uri))
+        if date is None:
+            return False
+        item.date = date
+        return True
+    date_str = str(tags["EXIF DateTimeOriginal"])
+    try:
+        item.date = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        raise ValueError(f"Cannot parse date '{date_str}' for {item.uri}")
+    return True
+
+
+def read_location(item: Item) -> bool:
+    """Set the location of an item from its EXIF data, returns True if found."""
+    tags = load_exif(Path(item.uri))
+    if "GPS GPSLongitude" not in tags or "GPS GPSLatitude" not in tags:
+        return False
+
+    lon_values = tags["GPS GPSLongitude"]
+    lat_values = tags["GPS GPSLatitude"]
+
+    lon_ref = str(tags.get("GPS GPSLongitudeRef", "E"))
+    lat_ref = str(tags.get("GPS GPSLatitudeRef", "N"))
+
+    item.longitude = convert_to_degrees(lon_values, lon_ref)
+    item.latitude = convert_to_degrees(lat_values, lat_ref)
+    return True
+
+
+def update_hash(item: Item, verify: bool, check: bool) -> int:
+    """Set the hashes and the fingerprint of an item.
+
+    Items hashed before we stored fingerprints only get the fingerprint
+    added, unless we want to verify hashes. With `check` the file also
+    gets hashed again if its fingerprint changed. Returns the number of
+    bytes we read.
+    """
+    filepath = Path(item.uri)
+    fingerprint = get_fingerprint(filepath)
+    item.uri_md5 = calculate_md5(item.uri)
+    read = 0
+    if (
+        verify
+        or not item.data_xxhash
+        or (check and not fingerprint_matches(item, fingerprint))
+    ):
+        item.data_xxhash = calculate_xxhash(filepath)
+        read = fingerprint[2]
+    set_fingerprint(item, fingerprint)
+    return read
+
+
+def message_level(message: str) -> int:
+    """Severity of a message, from its prefix like '[Error]'."""
+    start = message.lstrip().lower()
+    if start.startswith("[error"):
+        return logging.ERROR
+    if start.startswith(("[warning", "[skip")):
+        return logging.WARNING
+    return logging.INFO
+
+
+def set_log_file(path: Path | None) -> None:
+    """Write all messages also to a rotating log file (or stop doing so)."""
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    if path is None:
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handler = RotatingFileHandler(
+        path, maxBytes=LOG_SIZE, backupCount=LOG_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(handler)
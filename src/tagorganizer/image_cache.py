@@ -0,0 +1,140 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from collections import OrderedDict
+from collections.abc import Iterable
+
+MiB = 1 << 20
+
+# default budgets in MiB, can be set in the profile
+THUMBNAIL_CACHE_SIZE = 256
+IMAGE_CACHE_SIZE = 512
+TILE_CACHE_SIZE = 256
+
+
+def image_bytes(image) -> int:
+    """Memory used by a QPixmap or QImage (None is used for failed loads)."""
+    if image is None:
+        return 0
+    return image.width() * image.height() * image.depth() // 8
+
+
+class ImageCache:
+    """LRU cache of decoded images that is limited by their size in bytes.
+
+    Keys are tuples that start with the uri of the item, so that all
+    entries of a file can be removed when it gets moved or deleted.
+    Only used from the GUI thread.
+    """
+
+    def __init__(self, name: str, budget: int):
+        self.name = name
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, key):
+        """Return a cached image, raises KeyError if it is not cached."""
+        try:
+            image, _ = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return image
+
+    def __setitem__(self, key, image) -> None:
+        self.pop(key)
+        size = image_bytes(image)
+        # an image larger than the budget would push out everything else
+        if size > self.budget:
+            return
+        self.entries[key] = (image, size)
+        self.bytes += size
+        self.shrink()
+
+    def pop(self, key) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def shrink(self) -> None:
+        while self.bytes > self.budget:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def set_budget(self, budget: int) -> None:
+        self.budget = budget
+        self.shrink()
+
+    def invalidate(self, uris: Iterable[str]) -> int:
+        """Remove all entries of the given files, returns the number removed."""
+        uris = set(uris)
+        keys = [key for key in self.entries if key[0] in uris]
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = f"{self.hits / lookups:.0%}" if lookups else "-"
+        return (
+            f"{self.name}: {len(self)} items, {self.bytes / MiB:.0f} of"
+            f" {self.budget / MiB:.0f} MiB, {self.hits} hits, {self.misses} misses"
+            f" ({hit_rate}), {self.evictions} evicted"
+        )
+
+
+# (uri, level) -> QPixmap of the thumbnail or None if it cannot be created
+thumbnails = ImageCache("Thumbnail cache", THUMBNAIL_CACHE_SIZE * MiB)
+# (uri, width, height) -> QPixmap of a photo scaled for the single item view
+images = ImageCache("Image cache", IMAGE_CACHE_SIZE * MiB)
+# (uri, level, row, col) -> QImage of a tile for zooming, see `read_band`
+tiles = ImageCache("Tile cache", TILE_CACHE_SIZE * MiB)
+
+
+def set_budgets(thumbnail_size: int, image_size: int, tile_size: int) -> None:
+    """Set the budgets in MiB."""
+    thumbnails.set_budget(thumbnail_size * MiB)
+    images.set_budget(image_size * MiB)
+    tiles.set_budget(tile_size * MiB)
+
+
+def invalidate(uris: Iterable[str]) -> None:
+    """Forget all images of files that got moved, changed or deleted."""
+    uris = set(uris)
+    thumbnails.invalidate(uris)
+    images.invalidate(uris)
+    tiles.invalidate(uris)
@@ -0,0 +1,205 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+import os
+from pathlib import Path
+import socket
+import time
+
+from . import db
+from . import thumbnail_store
+from .thumbnail_store import LEVELS, thumbnail_keys
+from .helper import read_date, read_location, update_hash
+from .models import Item, Job
+
+JOB_KINDS = ["hash", "metadata", "thumbnail"]
+
+# a running job that was not renewed for this many seconds gets
+# claimed again, e.g. because its worker crashed
+JOB_TIMEOUT = 600
+# seconds between renewing the claimed jobs of a worker
+HEARTBEAT_INTERVAL = 60
+
+# seconds between looking for new jobs when waiting
+POLL_INTERVAL = 5
+
+
+@dataclass
+class WorkerConfig:
+    """Everything a worker process needs to know about the profile."""
+
+    db: str
+    wal: bool
+    photos: Path
+    thumbnails: Path
+    verify_hashes: bool
+    kinds: list[str] = field(default_factory=lambda: list(JOB_KINDS))
+    # number of jobs claimed at once
+    batch: int = 20
+    # keep polling for new jobs when the queue is empty
+    wait: bool = False
+
+
+def get_item_ids(kind: str, photos: Path, verify: bool) -> list[int]:
+    """Return the ids of the items that need a job of this kind."""
+    if kind == "hash":
+        items = db.get_all_items() if verify else db.get_items_without_hashes()
+        return [item.id for item in items]
+    if kind == "metadata":
+        ids = {item.id for item in db.get_items_without_date()}
+        ids.update(item.id for item in db.get_items_without_location())
+        return sorted(ids)
+    if kind == "thumbnail":
+        # thumbnails are keyed by the content hash, so we need the hash first
+        stored = thumbnail_store.store.keys(LEVELS[0])
+        return [
+            item.id
+            for item in db.get_all_items()
+            if thumbnail_keys(item) and thumbnail_keys(item)[0] not in stored
+        ]
+    raise ValueError(f"unknown kind of job {kind}")
+
+
+def queue_jobs(kind: str, photos: Path, verify: bool) -> int:
+    """Add jobs for all items that need them, returns the number of new jobs."""
+    return db.enqueue_jobs(kind, get_item_ids(kind, photos, verify))
+
+
+def run_job(job: Job, item: Item, config: WorkerConfig) -> None:
+    """Update a single item, raises an exception if the job failed."""
+    if not Path(item.uri).is_file():
+        raise FileNotFoundError(f"{item.uri} does not exist")
+
+    if job.kind == "hash":
+        # the file could have changed since the job got queued
+        update_hash(item, config.verify_hashes, check=True)
+    elif job.kind == "metadata":
+        if item.date is None:
+            read_date(item)
+        if item.latitude is None:
+            read_location(item)
+    elif job.kind == "thumbnail":
+        # only workers that create thumbnails load Qt
+        from .thumbnails import load_image
+
+        keys = thumbnail_keys(item)
+        if not keys:
+            raise ValueError("item has no hash yet")
+        if load_image(item.uri, keys, LEVELS[-1], config.photos) is None:
+            raise ValueError("cannot create thumbnail")
+    else:
+        raise ValueError(f"unknown kind of job {job.kind}")
+
+
+def work(config: WorkerConfig) -> tuple[int, int]:
+    """Claim and run jobs until the queue is empty.
+
+    This runs in its own process. Returns the number of finished and
+    failed jobs.
+    """
+    db.set_engine(config.db, config.wal)
+    thumbnail_store.set_store(config.thumbnails, config.wal)
+    if "thumbnail" in config.kinds:
+        # QPixmap needs a QGuiApplication, the offscreen platform works
+        # without a display
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        from qtpy.QtGui import QGuiApplication
+
+        app = QGuiApplication.instance() or QGuiApplication([])  # noqa: F841
+
+    name = f"{socket.gethostname()}-{os.getpid()}"
+    done = 0
+    failed = 0
+    while True:
+        jobs = db.claim_jobs(name, config.kinds, config.batch, JOB_TIMEOUT)
+        if not jobs:
+            if not config.wait:
+                break
+            try:
+                time.sleep(POLL_INTERVAL)
+            except KeyboardInterrupt:
+                break
+            continue
+
+        items = {
+            item.id: item for item in db.get_items_by_ids([j.item_id for j in jobs])
+        }
+        finished = []
+        errors = []
+        renewed = time.monotonic()
+        try:
+            for i, job in enumerate(jobs):
+                if time.monotonic() - renewed > HEARTBEAT_INTERVAL:
+                    # a slow batch should not get claimed by another worker
+                    db.renew_jobs(name, jobs[i:])
+                    renewed = time.monotonic()
+                item = items.get(job.item_id)
+                if item is None:
+                    # item got deleted in the meantime
+                    finished.append(job)
+                    continue
+                try:
+                    run_job(job, item, config)
+                    finished.append(job)
+                except Exception as e:
+                    job.error = str(e)
+                    errors.append(job)
+        except KeyboardInterrupt:
+            # give the jobs we did not get to back to the other workers
+            db.release_jobs(jobs[len(finished) + len(errors) :])
+            break
+        finally:
+            updated = [items[j.item_id] for j in finished if j.item_id in items]
+            db.finish_jobs(updated, finished, errors)
+            done += len(finished)
+            failed += len(errors)
+    return done, failed
+
+
+def run_workers(
+    config: WorkerConfig, n: int, progress: Callable[[str], None]
+) -> tuple[int, int]:
+    """Run n worker processes until they are done.
+
+    Shows the state of the queue while waiting. Returns the number of
+    finished and failed jobs.
+    """
+    # spawn, so that the workers do not inherit our db connections
+    with ProcessPoolExecutor(n, mp_context=get_context("spawn")) as pool:
+        futures = [pool.submit(work, config) for _ in range(n)]
+        while True:
+            _, pending = wait(futures, timeout=1)
+            progress(format_job_counts(db.get_job_counts()))
+            if not pending:
+                break
+    results = [future.result() for future in futures]
+    return sum(r[0] for r in results), sum(r[1] for r in results)
+
+
+def format_job_counts(counts: dict[str, int]) -> str:
+    return (
+        f"Jobs: {counts.get('queued', 0)} queued,"
+        f" {counts.get('running', 0)} running,"
+        f" {counts.get('failed', 0)} failed"
+    )
@@ -40,12 +40,11 @@ from qtpy.QtWidgets import (
 )
 from qtpy.QtCore import Qt, QEvent
 
-from docopt import docopt
-
 from . import db
 from . import config
 from . import DBimport
-from . import tasks
+from . import image_cache
+from .watcher import LibraryWatcher
 from .widgets import (
     AddTagDialog,
     DeleteConfirmationDialog,
@@ -56,10 +55,12 @@ from .widgets import (
     SingleItem,
     TagBar,
     TagView,
+    TaskDialog,
     Timeline,
+    TimerTaskManager,
     RESERVED_TAGS,
 )
-from .widgets.helper import CommaCompleter, get_thumbnail_path
+from .widgets.helper import CommaCompleter
 
 
 class MainWindow(QMainWindow):
@@ -72,7 +73,9 @@ class MainWindow(QMainWindow):
         self.config = config.ConfigManager()
         self.setWindowTitle(f"Tag Organizer -- Profile {self.config.profile}")
 
-        self.tasks = tasks.TaskManager(self)
+        self.tasks = TimerTaskManager(self)
+        self.task_dialog = TaskDialog(self)
+        self.watcher = LibraryWatcher(self)
 
         # Set up the menu bar
         self.menu_bar = self.menuBar()
@@ -89,6 +92,8 @@ class MainWindow(QMainWindow):
                 "---",
                 ["Delete", "Ctrl+D", self.delete_items],
                 "---",
+                ["Show Similar Items", "Ctrl+L", self.show_similar_items],
+                "---",
                 ["Copy Selection to dir", self.copy_selection],
                 ["Clear Selection", "Ctrl+E", self.clear_selection],
                 "---",
@@ -98,6 +103,10 @@ class MainWindow(QMainWindow):
                 ["Update Timestamps in DB", self.tasks.db_update_timestamps],
                 ["Update Locations in DB", self.tasks.db_update_locations],
                 ["Update Hashes in DB", self.tasks.db_update_hashes],
+                ["Find Duplicates", self.tasks.find_duplicates],
+                ["Find Similar Items", self.tasks.db_update_similarity],
+                ["Generate Thumbnails", self.tasks.create_thumbnails],
+                ["Probe Videos", self.tasks.probe_videos],
                 ["Check for Files in Default Dirs", self.tasks.list_files_not_in_db],
                 [
                     "Check for Files outside of Default Dirs",
@@ -105,6 +114,11 @@ class MainWindow(QMainWindow):
                 ],
                 ["Move Files with new date set", self.tasks.fix_no_date_files],
                 ["Move Files to Default Dirs", self.tasks.move_files],
+                "---",
+                ["Queue Jobs for Workers", self.tasks.queue_jobs],
+                "---",
+                ["Show Tasks", "Ctrl+T", self.show_tasks],
+                ["Cancel Tasks", self.tasks.cancel],
             ],
             "Profiles": [],
             "Help": [["About", "Ctrl+H", self.show_about_dialog]],
@@ -172,6 +186,7 @@ class MainWindow(QMainWindow):
 
         self.tabs.currentChanged.connect(self.on_tab_changed)
 
+        self.tasks.replay_move_journal()
         self.update_items()
 
         # Add the tag view and the main area to the layout
@@ -202,6 +217,10 @@ class MainWindow(QMainWindow):
                 (Qt.Key_Down, Qt.ShiftModifier): self.grid.shift_move_down,
                 Qt.Key_I: self.single_item.toggle_exif_visibility,
                 Qt.Key_F: self.single_item.toggle_filename_visibility,
+                Qt.Key_Plus: self.single_item.zoom_in,
+                Qt.Key_Equal: self.single_item.zoom_in,
+                Qt.Key_Minus: self.single_item.zoom_out,
+                Qt.Key_1: self.single_item.toggle_actual_size,
                 Qt.Key_Escape: self.focus_grid,
             },
         }
@@ -261,12 +280,11 @@ class MainWindow(QMainWindow):
     def update_items(self):
         filters = self.tag_bar.get_filters()
 
-        nr_items = db.get_number_of_items(filters)
+        ids = db.get_item_ids(filters)
         nr_total_items = db.get_number_of_items()
-        self.update_numbers(view=nr_items, total=nr_total_items)
+        self.update_numbers(view=len(ids), total=nr_total_items)
 
-        items = db.get_images(self.grid.page, filters)
-        self.grid.show_images(items)
+        self.grid.set_ids(ids)
 
         if filters != self.filters:
             dates, coords = db.get_times_and_location_from_images(filters)
@@ -302,11 +320,26 @@ class MainWindow(QMainWindow):
         self.create_action("Change Config", self.change_config, self.menu["Profiles"])
 
     def change_profile(self, name):
-        self.tasks.stop()
+        # tasks get resumed when we switch back to this profile
+        self.tasks.suspend()
+        self.watcher.stop()
         self.config.set_current_profile(name)
+        self.tasks.replay_move_journal()
         self.tag_view.update_tags()
         self.update_items()
         self.setWindowTitle(f"Tag Organizer -- Profile {self.config.profile}")
+        self.start_watcher()
+        self.tasks.resume_tasks()
+
+    def show_tasks(self):
+        self.task_dialog.show()
+        self.task_dialog.raise_()
+
+    def start_watcher(self):
+        if self.config.watch:
+            self.watcher.start([self.config.photos, self.config.videos])
+        else:
+            self.watcher.stop()
 
     def new_profile(self):
         dialog = ProfileDialog()
@@ -343,7 +376,10 @@ class MainWindow(QMainWindow):
         text += f"DB location: {self.config.db}\n"
         text += f"Photo location: {self.config.photos}\n"
         text += f"Video location: {self.config.videos}\n"
-        text += f"Thumbnail location: {get_thumbnail_path(self.config.photos)}\n"
+        text += f"Thumbnail location: {self.config.thumbnails}\n\n"
+        text += f"{image_cache.thumbnails.stats()}\n"
+        text += f"{image_cache.images.stats()}\n"
+        text += f"{image_cache.tiles.stats()}\n"
         QMessageBox.about(self, "TagOrganizer", text)
 
     def handle_tags(self):
@@ -373,23 +409,23 @@ class MainWindow(QMainWindow):
             tag_list.append(tag)
 
         if self.grid.selected_items:
-            item_list = self.grid.selected_items
+            item_list = self.grid.selection()
         else:
             current = self.grid.current_item()
             if current is None:
                 return
-            item_list = [current.item]
+            item_list = [current]
 
             db.set_tags(item_list, tag_list)
 
     def display_common_tags(self):
         if self.grid.selected_items:
-            common_tags = db.get_common_tags(self.grid.selected_items)
+            common_tags = db.get_common_tags(self.grid.selection())
         else:
             current = self.grid.current_item()
             if current is None:
                 return
-            common_tags = db.get_common_tags([current.item])
+            common_tags = db.get_common_tags([current])
 
         self.tag_line_edit.setText(",".join(common_tags))
 
@@ -425,10 +461,6 @@ class MainWindow(QMainWindow):
         context = "single" if self.tabs.currentWidget() == self.single_item else "grid"
 
         if context == "grid":
-            new_page = self.grid.highlight // self.grid.N
-            if new_page != self.grid.page:
-                self.grid.page = new_page
-                self.update_items()
             self.display_common_tags()
 
     def focus_grid(self):
@@ -444,7 +476,7 @@ class MainWindow(QMainWindow):
             self.messages.add(f"[ERROR] target {target} not a directory.")
             return
 
-        for item in self.grid.selected_items:
+        for item in self.grid.selection():
             source = Path(item.uri)
             if not source.is_file():
                 self.messages.add(f"[ERROR] item at {source} does not exist...skipping")
@@ -452,16 +484,28 @@ class MainWindow(QMainWindow):
             destination = target / source.name
             shutil.copy(source, destination)
 
+    def show_similar_items(self):
+        current = self.grid.current_item()
+        if current is None:
+            return
+        if current.phash_failed:
+            self.messages.add("[ERROR] cannot calculate a perceptual hash for item")
+            return
+        if current.phash is None:
+            self.messages.add(
+                "[ERROR] item has no perceptual hash, run 'Find Similar Items' first"
+            )
+            return
+        self.tag_bar.add_similar_tag(current.id)
+
     def clear_selection(self):
         self.grid.clear_selection()
-        self.grid.selected_items = []
         self.update_numbers(selected=0)
 
     def show_current_item(self):
-        widget = self.grid.current_item()
-        if not widget:
+        item = self.grid.current_item()
+        if item is None:
             return
-        item = widget.item
 
         self.single_item.set_item(item)
 
@@ -476,11 +520,8 @@ class MainWindow(QMainWindow):
         self.tag_line_edit.setCompleter(completer)
 
     def delete_items(self):
-        items_to_delete = (
-            self.grid.selected_items
-            if self.grid.selected_items
-            else [self.grid.current_item().item]
-        )
+        current = self.grid.current_item()
+        items_to_delete = self.grid.selection() or ([current] if current else [])
 
         if not items_to_delete:
             return
@@ -494,8 +535,9 @@ class MainWindow(QMainWindow):
                     if filepath.exists():
                         filepath.unlink()
                 db.delete_item(item.id)
+            image_cache.invalidate(item.uri for item in items_to_delete)
 
-            self.grid.selected_items = []
+            self.grid.clear_selection()
             self.update_items()  # Assuming update_items refreshes the displayed items
 
     def add_directory(self):
@@ -503,16 +545,7 @@ class MainWindow(QMainWindow):
 
         if directory:
             self.messages.add(f"selected: {directory}")
-            mydir = Path(directory)
-            files = []
-            for ext in config.ALL_SUFFIX:
-                new = list(mydir.rglob(f"*{ext}"))
-                files = files + new
-                new = list(mydir.rglob(f"*{ext.upper()}"))
-                files = files + new
-            db.add_images(files)
-            self.update_items()
-            self.messages.add(f"finished adding {directory}")
+            self.tasks.add_directory(Path(directory))
 
     def add_tag(self):
         dialog = AddTagDialog(self)
@@ -534,17 +567,8 @@ class MainWindow(QMainWindow):
         self.setup_autocomplete()
 
 
-def main():
-    commands = docopt("""
-    Usage:
-        TagOragnizer [options]
-
-    --config=<file>                 Use this config file
-    --profile=<profile>             Use this profile
-    --import-from-f-spot=<f-spot>   Try to load data from this f-spot database
-
-    """)
-
+def main(commands: dict):
+    """Start the GUI, `commands` are the parsed command line options."""
     app = QApplication(sys.argv)
     window = MainWindow(app)
 
@@ -566,9 +590,13 @@ def main():
         old_db = Path(commands["--import-from-f-spot"]).expanduser()
         DBimport.import_f_spot(old_db)
 
+    window.start_watcher()
+    window.tasks.resume_tasks()
     window.show()
     sys.exit(app.exec_())
 
 
 if __name__ == "__main__":
-    main()
+    from .cli import main as cli_main
+
+    cli_main()
@@ -1,6 +1,7 @@
 """DB migrations"""
 
 from pathlib import Path
+import sys
 
 from alembic.config import Config
 from alembic import command
@@ -15,7 +16,8 @@ def current_db(verbose=False):
 
 
 def upgrade_db(revision="head"):
-    print("DB: upgrade/ensure latest schema")
+    # stdout is reserved for the output of the headless commands
+    print("DB: upgrade/ensure latest schema", file=sys.stderr)
     command.upgrade(ALEMBIC_CFG, revision)
 
 
@@ -9,6 +9,7 @@ from sqlmodel import SQLModel
 from tagorganizer.models import Tag, Item, ItemTagLink  # noqa: F401
 
 import os
+import sys
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -17,7 +18,7 @@ config = context.config
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
-    fileConfig(config.config_file_name)
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
 
 # ues SQLModel
 target_metadata = SQLModel.metadata
@@ -26,7 +27,7 @@ target_metadata = SQLModel.metadata
 TAGORGANIZER_DB_URL = os.getenv("TAGORGANIZER_DB_URL")
 if TAGORGANIZER_DB_URL:
     config.set_main_option("sqlalchemy.url", TAGORGANIZER_DB_URL)
-    print(f"DB using: {TAGORGANIZER_DB_URL}")
+    print(f"DB using: {TAGORGANIZER_DB_URL}", file=sys.stderr)
 else:
     raise Exception("TAGORGANIZER_DB_URL environment variable not set.")
 
@@ -18,6 +18,9 @@ along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
 
 """
 
+from dataclasses import dataclass
+from pathlib import Path
+
 from sqlmodel import SQLModel, Field, Relationship
 from datetime import datetime
 
@@ -57,9 +60,21 @@ class Tag(SQLModel, table=True):
 
 class Item(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
-    uri: str
+    uri: str = Field(index=True)
     uri_md5: str = Field(default="")
-    data_xxhash: str = Field(default="")
+    data_xxhash: str = Field(default="", index=True)
+    # stat fingerprint of the file at the time data_xxhash was calculated
+    size: int | None = Field(default=None, index=True)
+    mtime_ns: int | None = Field(default=None)
+    inode: int | None = Field(default=None)
+    device: int | None = Field(default=None)
+    # perceptual hash and the group of near duplicates the item belongs to
+    phash: int | None = Field(default=None, index=True)
+    phash_group: int | None = Field(default=None, index=True)
+    # the perceptual hash could not be calculated, so we do not try again
+    phash_failed: bool = Field(default=False)
+    # file vanished from disk
+    missing: bool = Field(default=False, index=True)
     camera: str | None = Field(default=None, index=True)
     date: datetime | None = Field(default=None, index=True)
 
@@ -67,6 +82,14 @@ class Item(SQLModel, table=True):
     longitude: float | None = Field(default=None, index=True)
     latitude: float | None = Field(default=None, index=True)
 
+    # properties of videos, see `video.probe_video`
+    duration: float | None = Field(default=None)
+    width: int | None = Field(default=None)
+    height: int | None = Field(default=None)
+    fps: float | None = Field(default=None)
+    # the video was probed, also if it could not be read
+    probed: bool = Field(default=False)
+
     tags: list[Tag] = Relationship(back_populates="items", link_model=ItemTagLink)
 
     def __hash__(self):
@@ -76,3 +99,82 @@ class Item(SQLModel, table=True):
         if isinstance(other, Item):
             return self.id == other.id
         return False
+
+
+class MoveJournal(SQLModel, table=True):
+    """Moves of files that are planned or in progress.
+
+    Entries get removed in the same transaction that updates the uri of
+    the item, so that after a crash we know which moves need to be
+    finished or rolled back.
+    """
+
+    id: int | None = Field(default=None, primary_key=True)
+    item_id: int = Field(foreign_key="item.id", index=True)
+    source: str
+    target: str
+    # 'planned' or 'copied' (a verified copy exists on the target filesystem)
+    state: str = Field(default="planned")
+
+
+class TaskCheckpoint(SQLModel, table=True):
+    """Tasks that did not finish yet, so that we can resume them."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    kind: str
+    # json encoded arguments of the task and its state
+    args: str = Field(default="[]")
+    state: str = Field(default="{}")
+
+
+class TaskHistory(SQLModel, table=True):
+    """Summary of each task that ran, e.g. to compare throughput."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    name: str
+    kind: str | None = Field(default=None)
+    # 'done', 'failed', 'cancelled' or 'suspended'
+    status: str
+    started: datetime
+    wall_time: float
+    total: int
+    items: int
+    bytes: int = Field(default=0)
+    errors: int = Field(default=0)
+
+
+class Job(SQLModel, table=True):
+    """Work for the worker processes, one row per item and kind of job."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    # 'hash', 'metadata' or 'thumbnail'
+    kind: str
+    item_id: int = Field(foreign_key="item.id", index=True)
+    # 'queued', 'running' or 'failed', finished jobs get deleted
+    state: str = Field(default="queued", index=True)
+    worker: str | None = Field(default=None)
+    # in UTC, renewed while the worker is running the job
+    claimed: datetime | None = Field(default=None)
+    error: str | None = Field(default=None)
+
+
+@dataclass
+class Filters:
+    """What the tag bar selected, used by db.filter_query."""
+
+    tags: list[str] | None = None
+    start_date: datetime | None = None
+    end_date: datetime | None = None
+    min_longitude: float | None = None
+    max_longitude: float | None = None
+    min_latitude: float | None = None
+    max_latitude: float | None = None
+    wrong_dir: bool | None = False
+    no_time: bool | None = False
+    no_gps: bool | None = False
+    duplicates: bool | None = False
+    near_duplicates: bool | None = False
+    missing: bool | None = False
+    similar_to: int | None = None
+    similarity_threshold: int | None = None
+    directories: list[Path] | None = None
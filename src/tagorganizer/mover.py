@@ -0,0 +1,363 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+import errno
+import os
+from pathlib import Path
+import shutil
+import sys
+
+from more_itertools import chunked
+import xxhash
+
+from . import config
+from . import db
+from . import image_cache
+from .thumbnail_store import keep_thumbnail
+from .models import Item, MoveJournal
+from .helper import (
+    calculate_md5,
+    calculate_xxhash,
+    fingerprint_matches,
+    get_fingerprint,
+    set_fingerprint,
+)
+
+if sys.platform == "win32":
+    import msvcrt
+else:
+    import fcntl
+
+# name of the temporary file while copying to another filesystem
+PART_SUFFIX = ".tagorganizer-part"
+# lock file next to the db, held while a process uses the move journal
+LOCK_SUFFIX = ".moves-lock"
+
+
+@dataclass
+class Move:
+    item: Item
+    entry: MoveJournal
+
+    @property
+    def source(self) -> Path:
+        return Path(self.entry.source)
+
+    @property
+    def target(self) -> Path:
+        return Path(self.entry.target)
+
+
+@contextmanager
+def journal_lock() -> Iterator[bool]:
+    """Try to get the move journal of the current db for this process.
+
+    Yields False if another process (or another task) is moving files,
+    its journal entries are not interrupted moves and must not be
+    replayed. The lock is released when the process dies.
+    """
+    path = Path(f"{db.engine.url.database}{LOCK_SUFFIX}")
+    with open(path, "a+b") as f:
+        try:
+            if sys.platform == "win32":
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        # closing the file releases the lock
+        yield True
+
+
+def get_target_path(item: Item, photo_dir: Path, video_dir: Path) -> Path:
+    """Return <photo or video dir>/YYYY/MM/DD/<name> (or no-date/<name>)."""
+    filepath = Path(item.uri)
+    ext = filepath.suffix.lower()
+    if ext in config.PHOTO_SUFFIX:
+        directory = Path(photo_dir)
+    elif ext in config.VIDEO_SUFFIX:
+        directory = Path(video_dir)
+    else:
+        raise ValueError(f"cannot handle {ext}")
+
+    if item.date:
+        directory = (
+            directory
+            / f"{item.date.year:04d}"
+            / f"{item.date.month:02d}"
+            / f"{item.date.day:02d}"
+        )
+    else:
+        directory = directory / "no-date"
+
+    # lower the case for the extension
+    return (directory / filepath.name).with_suffix(ext)
+
+
+def get_part_path(target: Path) -> Path:
+    return target.with_name(target.name + PART_SUFFIX)
+
+
+def plan_moves(
+    items: list[Item], photo_dir: Path, video_dir: Path
+) -> tuple[list[Move], list[str]]:
+    """Calculate the targets of all items before we move anything.
+
+    Each target directory is only listed once and targets that already
+    exist or that several items would end up at are reported as
+    problems instead of being moved.
+    """
+    moves = []
+    problems = []
+
+    listings = {}
+    taken = set()
+    for item in items:
+        source = Path(item.uri)
+        if not source.is_file():
+            problems.append(f"[Error] item {item.uri} does not exist")
+            continue
+        try:
+            target = get_target_path(item, photo_dir, video_dir)
+        except ValueError as e:
+            problems.append(f"[Error] item {item.uri} {e}")
+            continue
+        if target == source:
+            continue
+
+        directory = target.parent
+        if directory not in listings:
+            try:
+                listings[directory] = set(os.listdir(directory))
+            except FileNotFoundError:
+                listings[directory] = set()
+        if target.name in listings[directory] or target in taken:
+            problems.append(f"File already exists: {target}")
+            continue
+        taken.add(target)
+
+        entry = MoveJournal(item_id=item.id, source=str(source), target=str(target))
+        moves.append(Move(item, entry))
+    return moves, problems
+
+
+def copy_verified(source: Path, target: Path) -> str:
+    """Copy a file to its part file on the target filesystem.
+
+    The copy is synced to disk and read back to compare it with the
+    source. Returns the xxhash of the data.
+    """
+    part = get_part_path(target)
+    hasher = xxhash.xxh128()
+    with open(source, "rb") as src, open(part, "wb") as dst:
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            hasher.update(chunk)
+            dst.write(chunk)
+        dst.flush()
+        os.fsync(dst.fileno())
+    shutil.copystat(source, part)
+
+    data_xxhash = hasher.hexdigest()
+    if calculate_xxhash(part) != data_xxhash:
+        part.unlink()
+        raise OSError(f"copy of {source} does not match the original")
+    return data_xxhash
+
+
+def update_item(
+    item: Item,
+    target: Path,
+    fingerprint: tuple[int, int, int, int] | None,
+    verify: bool,
+    photos: Path,
+    data_xxhash: str | None = None,
+) -> None:
+    """Point an item to its new location.
+
+    After a rename the fingerprint of the file did not change, so we
+    only recalculate the content hash if the file changed since it was
+    hashed (or 'verify_hashes' is set in the config). Items hashed
+    before we stored fingerprints are trusted after a rename, since a
+    rename does not touch the data. Thumbnails stored under the md5 of
+    the old uri are kept (see `thumbnail_store.keep_thumbnail`).
+    """
+    image_cache.invalidate([item.uri])
+    old_md5 = item.uri_md5
+    item.uri = str(target)
+    item.uri_md5 = calculate_md5(item.uri)
+    if data_xxhash:
+        item.data_xxhash = data_xxhash
+    elif (
+        verify
+        or not item.data_xxhash
+        or (item.size is not None and not fingerprint_matches(item, fingerprint))
+    ):
+        item.data_xxhash = calculate_xxhash(target)
+    set_fingerprint(item, get_fingerprint(target))
+    item.missing = False
+    keep_thumbnail(item, old_md5, photos)
+
+
+def move_file(move: Move, verify: bool, photos: Path) -> None:
+    """Move a single file, using a rename if possible."""
+    source = move.source
+    target = move.target
+
+    fingerprint = get_fingerprint(source)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # a rename would silently replace a file that showed up after planning
+    if target.exists():
+        raise FileExistsError(f"{target} already exists")
+
+    try:
+        os.rename(source, target)
+        update_item(move.item, target, fingerprint, verify, photos)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    data_xxhash = copy_verified(source, target)
+    db.set_move_state(move.entry, "copied")
+    os.rename(get_part_path(target), target)
+    source.unlink()
+    update_item(move.item, target, None, verify, photos, data_xxhash)
+
+
+def recover_move(move: Move, verify: bool, photos: Path) -> str:
+    """Finish or roll back a move that was interrupted.
+
+    Returns 'finished', 'rolled back' or 'lost' and updates the item in
+    case the move gets finished. The journal entry needs to be removed
+    by the caller.
+    """
+    source = move.source
+    target = move.target
+    part = get_part_path(target)
+
+    if move.entry.state == "copied":
+        # we have a verified copy, so we can finish the move
+        if part.is_file() and not target.exists():
+            os.rename(part, target)
+        if target.is_file():
+            source.unlink(missing_ok=True)
+            update_item(move.item, target, get_fingerprint(target), verify, photos)
+            return "finished"
+    else:
+        part.unlink(missing_ok=True)
+        if source.is_file():
+            return "rolled back"
+        if target.is_file():
+            # the rename happened, but we did not update the db
+            update_item(move.item, target, get_fingerprint(target), verify, photos)
+            return "finished"
+    return "lost"
+
+
+def run_moves(
+    moves: list[Move],
+    verify: bool,
+    photos: Path,
+    log: Callable[[str], None],
+    N: int = 100,
+) -> Iterator[tuple[int, int]]:
+    """Execute planned moves, yields (total, current, stats) after each batch.
+
+    All moves are written to the journal before we touch any file. The
+    items are updated together with the removal of their journal
+    entries after each batch, so a crash loses at most the db update
+    of one batch, which replay_journal can redo. The caller needs to
+    hold the `journal_lock`. Returns the number of moved items.
+    """
+    total = len(moves)
+    current = 0
+    started = 0
+    moved = 0
+    errors = 0
+
+    db.add_move_journal([m.entry for m in moves])
+    try:
+        for chunk in chunked(moves, N):
+            done = []
+            for move in chunk:
+                started += 1
+                try:
+                    move_file(move, verify, photos)
+                    moved += 1
+                    log(f"Moved {move.source} to {move.target}")
+                except Exception as e:
+                    log(f"[Error] Failed to move {move.source} to {move.target}: {e}")
+                    errors += 1
+                    try:
+                        if recover_move(move, verify, photos) == "finished":
+                            moved += 1
+                    except Exception as e:
+                        # keep the journal entry, replay_journal tries again
+                        log(f"[Error] Failed to recover {move.source}: {e}")
+                        continue
+                done.append(move)
+            db.finish_moves([m.item for m in done], [m.entry for m in done])
+            current += len(chunk)
+            yield total, current, {"errors": errors}
+    finally:
+        # e.g. the task got cancelled, forget about the moves we did not start
+        db.finish_moves([], [m.entry for m in moves[started:]])
+    return moved
+
+
+def replay_journal(verify: bool, photos: Path, log: Callable[[str], None]) -> None:
+    """Finish or roll back moves that got interrupted by a crash.
+
+    The caller needs to hold the `journal_lock`.
+    """
+    entries = db.get_move_journal()
+    if not entries:
+        return
+
+    items = {
+        item.id: item for item in db.get_items_by_ids([e.item_id for e in entries])
+    }
+    log(f"Found {len(entries)} interrupted moves")
+
+    finished = []
+    handled = []
+    for entry in entries:
+        item = items.get(entry.item_id)
+        if item is None:
+            handled.append(entry)
+            continue
+        move = Move(item, entry)
+        try:
+            result = recover_move(move, verify, photos)
+        except Exception as e:
+            # keep the journal entry for the next start
+            log(f"[Error] Failed to recover {move.source}: {e}")
+            continue
+        handled.append(entry)
+        if result == "finished":
+            finished.append(item)
+        elif result == "lost":
+            log(f"[Error] neither {move.source} nor {move.target} exist")
+        log(f"Move of {move.source} to {move.target}: {result}")
+    db.finish_moves(finished, handled)
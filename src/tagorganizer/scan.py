@@ -0,0 +1,98 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from collections.abc import Iterator
+import os
+from pathlib import Path
+
+# files we never want to look at
+SKIP_FILES = frozenset([".DS_Store"])
+
+
+def walk_files(root: Path, skip: frozenset[str] = frozenset()) -> Iterator[os.DirEntry]:
+    """Walk a directory tree and yield all files.
+
+    We use os.scandir, since the DirEntry objects already know if they
+    are files or directories, so that we do not need an extra stat
+    call for each entry. Symlinks to directories are not followed and
+    the directories in `skip` (full paths, e.g. the old thumbnail dir
+    inside the photo dir) are left out.
+    """
+    stack = [str(root)]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.path not in skip:
+                            stack.append(entry.path)
+                    elif entry.is_file() and entry.name not in SKIP_FILES:
+                        yield entry
+        except OSError as e:
+            print(f"[ERROR] cannot read directory {path}: {e}")
+
+
+def find_files(
+    root: Path, suffixes: frozenset[str], skip: frozenset[str] = frozenset()
+) -> Iterator[str]:
+    """Yield all files in a directory tree with one of the given suffixes.
+
+    The suffixes need to be lower case, the comparison is case insensitive.
+    """
+    for entry in walk_files(root, skip):
+        if os.path.splitext(entry.name)[1].lower() in suffixes:
+            yield entry.path
+
+
+def reconcile(
+    root: Path,
+    known: dict[str, tuple[int | None, int | None]],
+    skip: frozenset[str] = frozenset(),
+) -> Iterator[tuple[str, str]]:
+    """Compare the files in a directory tree with the files in the db.
+
+    `known` maps the uris of the items in the db to their (size,
+    mtime_ns) and is emptied while walking the tree. Yields tuples of
+    (status, path) where status is one of
+
+    'ok': file is in the db and did not change
+    'new': file is not in the db
+    'changed': size or mtime changed since the file was hashed
+    'missing': file is in the db, but does not exist anymore
+
+    Only files that are in the db and have a fingerprint need a stat call.
+    """
+    for entry in walk_files(root, skip):
+        fingerprint = known.pop(entry.path, None)
+        if fingerprint is None:
+            yield "new", entry.path
+            continue
+
+        size, mtime_ns = fingerprint
+        if size is not None:
+            stat = entry.stat()
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                yield "changed", entry.path
+                continue
+        yield "ok", entry.path
+
+    for uri in known:
+        yield "missing", uri
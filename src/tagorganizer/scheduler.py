@@ -0,0 +1,289 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from collections import defaultdict, deque
+from collections.abc import Callable, Generator
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import count
+import json
+import time
+
+from . import db
+from .models import TaskCheckpoint, TaskHistory
+
+# lower numbers run first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 10
+PRIORITY_BULK = 20
+
+# how many tasks can use a resource at the same time
+RESOURCE_LIMITS = {"disk": 1, "cpu": 1}
+
+# seconds of progress used for the moving average of the rates
+RATE_WINDOW = 30
+
+task_ids = count(1)
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def format_bytes(n: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if n < 1000:
+            return f"{n:.1f} {unit}"
+        n /= 1000
+    return f"{n:.1f} TB"
+
+
+class Checkpoint:
+    """State of a resumable task that is stored in the db.
+
+    `kind` and `args` are used to create the task again after a
+    restart, the task itself can store whatever it needs to continue
+    in `state`.
+    """
+
+    def __init__(self, kind: str, args: list | None = None):
+        self.row = TaskCheckpoint(kind=kind, args=json.dumps(args or []))
+        self.state = {}
+        self.last_save = 0.0
+
+    @classmethod
+    def load_all(cls) -> list["Checkpoint"]:
+        checkpoints = []
+        for row in db.get_task_checkpoints():
+            checkpoint = cls(row.kind)
+            checkpoint.row = row
+            checkpoint.state = json.loads(row.state)
+            checkpoints.append(checkpoint)
+        return checkpoints
+
+    @property
+    def kind(self) -> str:
+        return self.row.kind
+
+    @property
+    def args(self) -> list:
+        return json.loads(self.row.args)
+
+    def save(self, **state) -> None:
+        """Update the state, it gets written at most once per second."""
+        self.state.update(state)
+        if self.row.id is None or time.monotonic() - self.last_save > 1:
+            self.flush()
+
+    def flush(self) -> None:
+        self.row.state = json.dumps(self.state)
+        db.save_task_checkpoint(self.row)
+        self.last_save = time.monotonic()
+
+    def delete(self) -> None:
+        if self.row.id is not None:
+            db.delete_task_checkpoint(self.row.id)
+
+
+@dataclass(eq=False)
+class Task:
+    """A generator that yields (total, current) after each step.
+
+    Tasks can also yield (total, current, stats), where stats is a dict
+    with the number of "bytes" processed and "errors" so far. Tasks
+    that are waiting, e.g. for a process pool, yield None.
+    """
+
+    name: str
+    gen: Generator
+    priority: int = PRIORITY_NORMAL
+    resource: str = "disk"
+    checkpoint: Checkpoint | None = None
+    paused: bool = False
+    total: int = 0
+    current: int = 0
+    bytes: int = 0
+    errors: int = 0
+    id: int = field(default_factory=lambda: next(task_ids))
+    # set when the task runs for the first time
+    started: float | None = None
+    started_at: datetime | None = None
+    # (time, current, bytes) of the last RATE_WINDOW seconds
+    samples: deque = field(default_factory=deque)
+
+    def update(self, progress: tuple) -> None:
+        self.total, self.current = progress[:2]
+        if len(progress) > 2:
+            self.bytes = progress[2].get("bytes", self.bytes)
+            self.errors = progress[2].get("errors", self.errors)
+
+        now = time.monotonic()
+        self.samples.append((now, self.current, self.bytes))
+        while len(self.samples) > 2 and now - self.samples[1][0] > RATE_WINDOW:
+            self.samples.popleft()
+
+    def rates(self) -> tuple[float, float]:
+        """Moving average of items/s and bytes/s."""
+        if len(self.samples) < 2:
+            return 0.0, 0.0
+        (t0, c0, b0), (t1, c1, b1) = self.samples[0], self.samples[-1]
+        if t1 <= t0:
+            return 0.0, 0.0
+        return (c1 - c0) / (t1 - t0), (b1 - b0) / (t1 - t0)
+
+    def eta(self) -> float | None:
+        """Seconds until the task is done, if we know the total."""
+        items_per_second, _ = self.rates()
+        if not self.total or not items_per_second:
+            return None
+        return max(self.total - self.current, 0) / items_per_second
+
+    def status(self) -> str:
+        items_per_second, bytes_per_second = self.rates()
+        text = f"{items_per_second:.1f} items/s"
+        if bytes_per_second:
+            text += f", {format_bytes(bytes_per_second)}/s"
+        eta = self.eta()
+        if eta is not None:
+            text += f", ETA {format_duration(eta)}"
+        return text
+
+
+class Scheduler:
+    """Run task generators cooperatively, ordered by priority.
+
+    Each step advances every task that is allowed to run by one
+    iteration. Only RESOURCE_LIMITS[resource] tasks that use the same
+    resource run at the same time, these are the ones with the highest
+    priority. So a new interactive task takes over the disk from a
+    running bulk task, which continues once the interactive task is
+    done.
+    """
+
+    def __init__(self, log: Callable[[str], None], limits: dict | None = None):
+        self.log = log
+        self.limits = RESOURCE_LIMITS if limits is None else limits
+        self.tasks: list[Task] = []
+
+    def submit(self, task: Task) -> Task:
+        self.tasks.append(task)
+        return task
+
+    def find(self, kind: str, args: list) -> Task | None:
+        for task in self.tasks:
+            if task.checkpoint and (task.checkpoint.kind, task.checkpoint.args) == (
+                kind,
+                args,
+            ):
+                return task
+        return None
+
+    def runnable(self) -> list[Task]:
+        used = defaultdict(int)
+        tasks = []
+        for task in sorted(self.tasks, key=lambda t: (t.priority, t.id)):
+            if task.paused:
+                continue
+            if used[task.resource] >= self.limits.get(task.resource, 1):
+                continue
+            used[task.resource] += 1
+            tasks.append(task)
+        return tasks
+
+    def step(self) -> bool:
+        """Advance all runnable tasks by one step.
+
+        Returns False if no task ran or all of them are only waiting.
+        """
+        tasks = self.runnable()
+        progressed = False
+        for task in tasks:
+            if task.started is None:
+                task.started = time.monotonic()
+                task.started_at = datetime.now()
+            try:
+                progress = next(task.gen)
+            except StopIteration:
+                self.finish(task, "done")
+                progressed = True
+                continue
+            except Exception as e:
+                self.log(f"[Error] Task '{task.name}' failed: {e}")
+                task.errors += 1
+                self.finish(task, "failed")
+                progressed = True
+                continue
+            if progress is not None:
+                task.update(progress)
+                progressed = True
+        return progressed
+
+    def finish(self, task: Task, status: str) -> None:
+        """Remove a task and record a summary in the task history."""
+        self.tasks.remove(task)
+        if task.checkpoint:
+            if status == "suspended":
+                task.checkpoint.flush()
+            else:
+                task.checkpoint.delete()
+
+        if task.started is None:
+            # never ran, e.g. cancelled while waiting
+            return
+
+        wall_time = time.monotonic() - task.started
+        db.add_task_history(
+            TaskHistory(
+                name=task.name,
+                kind=task.checkpoint.kind if task.checkpoint else None,
+                status=status,
+                started=task.started_at,
+                wall_time=wall_time,
+                total=task.total,
+                items=task.current,
+                bytes=task.bytes,
+                errors=task.errors,
+            )
+        )
+
+        summary = (
+            f"Task '{task.name}' {status}: {task.current} items"
+            f" in {format_duration(wall_time)}"
+            f" ({task.current / max(wall_time, 1e-6):.1f} items/s"
+        )
+        if task.bytes:
+            summary += f", {format_bytes(task.bytes / max(wall_time, 1e-6))}/s"
+        summary += f"), {task.errors} errors"
+        self.log(summary)
+
+    def cancel(self, task: Task) -> None:
+        task.gen.close()
+        self.finish(task, "cancelled")
+
+    def cancel_all(self) -> None:
+        for task in list(self.tasks):
+            self.cancel(task)
+
+    def suspend(self) -> None:
+        """Stop all tasks, but keep the checkpoints to resume them later."""
+        for task in list(self.tasks):
+            task.gen.close()
+            self.finish(task, "suspended")
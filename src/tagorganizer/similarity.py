@@ -0,0 +1,241 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from itertools import combinations
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from . import config
+
+# we use 64 bit hashes and split them into 4 chunks of 16 bits for
+# the index
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# max number of candidate pairs that are compared at once
+PAIR_BATCH = 1 << 20
+
+
+def to_signed(value: int) -> int:
+    """Convert an unsigned 64 bit hash, so that sqlite can store it."""
+    if value >= 1 << 63:
+        value -= 1 << 64
+    return value
+
+
+def compute_dhash(file: str) -> int | None:
+    """Calculate a 64 bit difference hash of an image or a video frame.
+
+    The image is reduced to 9x8 gray pixels and each bit encodes if a
+    pixel is brighter than its right neighbour. This survives resizing
+    and re-encoding of an image.
+    """
+    if Path(file).suffix.lower() in config.VIDEO_SUFFIX:
+        cap = cv2.VideoCapture(file)
+        cap.set(cv2.CAP_PROP_POS_MSEC, 1000)
+        success, frame = cap.read()
+        cap.release()
+        if not success:
+            return None
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    else:
+        # let the decoder do most of the downscaling
+        image = cv2.imread(file, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if image is None:
+            return None
+
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    value = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    return to_signed(value)
+
+
+def compute_dhashes(files: list[str]) -> list[int | None]:
+    """Calculate hashes for several files (used in the process pool)."""
+    return [compute_dhash(f) for f in files]
+
+
+def flip_masks(bits: int) -> np.ndarray:
+    """Return all chunk masks with at most `bits` bits set."""
+    masks = [0]
+    for n in range(1, bits + 1):
+        for positions in combinations(range(CHUNK_BITS), n):
+            masks.append(sum(1 << p for p in positions))
+    return np.array(masks, dtype=np.uint64)
+
+
+class HammingIndex:
+    """Multi-index hashing for fast hamming distance searches.
+
+    Each hash is split into CHUNKS chunks. If two hashes differ in at
+    most r bits, then at least one of their chunks differs in at most
+    r // CHUNKS bits. So we only have to compare hashes that share a
+    chunk value (or one that is a few bit flips away) with the hash
+    we are looking for, instead of comparing all hashes with each other.
+    """
+
+    def __init__(self, ids, hashes):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.hashes = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+
+        # for each chunk we store the chunk values, and a sorted copy
+        # including the order, so that we can use binary searches
+        self.chunks = []
+        for c in range(CHUNKS):
+            values = (self.hashes >> np.uint64(c * CHUNK_BITS)) & np.uint64(CHUNK_MASK)
+            order = np.argsort(values, kind="stable")
+            self.chunks.append((values, order, values[order]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_hash(self, item_id: int) -> np.uint64 | None:
+        position = np.flatnonzero(self.ids == item_id)
+        if not len(position):
+            return None
+        return self.hashes[position[0]]
+
+    def query(self, value, max_distance: int):
+        """Return ids and distances of all hashes close to `value`."""
+        value = np.uint64(int(value) & ((1 << 64) - 1))
+        masks = flip_masks(max_distance // CHUNKS)
+
+        found = []
+        for c, (_, order, sorted_values) in enumerate(self.chunks):
+            key = (value >> np.uint64(c * CHUNK_BITS)) & np.uint64(CHUNK_MASK)
+            keys = key ^ masks
+            left = np.searchsorted(sorted_values, keys, "left")
+            right = np.searchsorted(sorted_values, keys, "right")
+            for start, end in zip(left, right):
+                found.append(order[start:end])
+        if not found:
+            return self.ids[:0], np.zeros(0, dtype=np.int64)
+
+        positions = np.unique(np.concatenate(found))
+        distances = np.bitwise_count(self.hashes[positions] ^ value).astype(np.int64)
+        keep = distances <= max_distance
+        positions = positions[keep]
+        distances = distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return self.ids[positions[order]], distances[order]
+
+    def candidates(self, max_distance: int, batch: int = PAIR_BATCH):
+        """Yield pairs of positions (i, j) with i < j that share a chunk.
+
+        A large group of (nearly) identical hashes results in a
+        quadratic number of candidates, so they are created in batches
+        of about `batch` pairs to keep the memory use bounded.
+        """
+        masks = flip_masks(max_distance // CHUNKS)
+        n = len(self.hashes)
+
+        for values, order, sorted_values in self.chunks:
+            for mask in masks:
+                keys = values ^ mask
+                left = np.searchsorted(sorted_values, keys, "left")
+                right = np.searchsorted(sorted_values, keys, "right")
+                counts = right - left
+                ends = np.cumsum(counts)
+                start = 0
+                while start < n:
+                    # rows start:stop expand to at most `batch` pairs
+                    # (or a single row, which expands to at most n pairs)
+                    done = ends[start - 1] if start else 0
+                    stop = max(
+                        int(np.searchsorted(ends, done + batch, "right")), start + 1
+                    )
+                    rows = counts[start:stop]
+                    total = int(rows.sum())
+                    if total:
+                        # expand the ranges [left, right) into pairs (i, j)
+                        i = np.repeat(np.arange(start, stop), rows)
+                        offsets = np.arange(total) - np.repeat(
+                            np.cumsum(rows) - rows, rows
+                        )
+                        j = order[np.repeat(left[start:stop], rows) + offsets]
+                        keep = i < j
+                        yield i[keep], j[keep]
+                    start = stop
+
+    def components(self, max_distance: int) -> np.ndarray:
+        """Label each hash with the smallest position of its group.
+
+        Uses a union find on the close pairs of `candidates`, batch by
+        batch. Candidates that are already in the same group are not
+        compared again.
+        """
+        labels = np.arange(len(self.hashes))
+        for i, j in self.candidates(max_distance):
+            labels = compress(labels)
+            keep = labels[i] != labels[j]
+            i = i[keep]
+            j = j[keep]
+            distances = np.bitwise_count(self.hashes[i] ^ self.hashes[j])
+            keep = distances <= max_distance
+            labels = union(labels, i[keep], j[keep])
+        return compress(labels)
+
+
+def compress(labels: np.ndarray) -> np.ndarray:
+    """Point every label directly to the root of its tree."""
+    while True:
+        new = labels[labels]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def union(labels: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Merge the groups of all pairs (a, b), roots point to smaller roots."""
+    while len(a):
+        labels = compress(labels)
+        root_a = labels[a]
+        root_b = labels[b]
+        keep = root_a != root_b
+        a, b = a[keep], b[keep]
+        root_a, root_b = root_a[keep], root_b[keep]
+        np.minimum.at(labels, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+    return labels
+
+
+def cluster(ids, hashes, max_distance: int) -> dict[int, int]:
+    """Group items whose hashes are at most `max_distance` bits apart.
+
+    Returns a dictionary from item id to group, where the group is the
+    smallest item id in the group. Items without close neighbours are
+    not included.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return {}
+
+    # identical hashes are trivially in the same group
+    unique, inverse = np.unique(np.asarray(hashes, dtype=np.int64), return_inverse=True)
+    labels = HammingIndex(np.arange(len(unique)), unique).components(max_distance)
+
+    item_labels = labels[inverse]
+    sizes = np.bincount(item_labels, minlength=len(unique))
+    groups = np.full(len(unique), np.iinfo(np.int64).max)
+    np.minimum.at(groups, item_labels, ids)
+
+    keep = sizes[item_labels] > 1
+    return dict(zip(ids[keep].tolist(), groups[item_labels[keep]].tolist()))
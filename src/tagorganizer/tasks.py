@@ -18,163 +18,467 @@ along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
 
 """
 
-from collections import deque
-from datetime import datetime
+from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait
+from functools import wraps
+from itertools import groupby
+from multiprocessing import get_context
+import os
 from pathlib import Path
-import shutil
+import time
 
-from qtpy.QtWidgets import QProgressBar, QLabel
-from qtpy.QtCore import QTimer
 from more_itertools import chunked
 
 from . import db
 from . import config
-from .widgets.helper import load_exif, calculate_md5, calculate_xxhash
+from . import thumbnail_store
+from .thumbnail_store import (
+    LEVELS,
+    SPRITE_LEVEL,
+    create_thumbnails,
+    get_skip_dirs,
+    get_thumbnail_file,
+    thumbnail_keys,
+)
+from .models import Item
+from .scheduler import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_NORMAL,
+    Checkpoint,
+    Scheduler,
+    Task,
+)
+from .jobs import JOB_KINDS, queue_jobs
+from .mover import journal_lock, plan_moves, replay_journal, run_moves
+from .scan import find_files, reconcile
+from .similarity import cluster, compute_dhashes
+from .video import probe_videos
+from .helper import (
+    calculate_partial_xxhash,
+    calculate_xxhash,
+    get_fingerprint,
+    read_date,
+    read_location,
+    set_fingerprint,
+    update_hash,
+)
+
+
+def offset_progress(gen, total: int, current: int, errors: int):
+    """Report the progress of a sub task as part of a larger task.
+
+    Returns the result of the sub task and its number of errors.
+    """
+    sub_errors = 0
+    try:
+        while True:
+            try:
+                progress = next(gen)
+            except StopIteration as e:
+                return e.value, sub_errors
+            if len(progress) > 2:
+                sub_errors = progress[2].get("errors", sub_errors)
+            yield total, current + progress[1], {"errors": errors + sub_errors}
+    finally:
+        gen.close()
+
+
+def moves_files(func):
+    """Hold the move journal while a task moves files.
+
+    Moves that got interrupted last time are finished or rolled back
+    first. The task does not run if another process is moving files.
+    """
+
+    @wraps(func)
+    def wrapper(self, *args):
+        with journal_lock() as locked:
+            if not locked:
+                self.main.messages.add(
+                    "[Error] another process is moving files, try again later"
+                )
+                return None
+            replay_journal(
+                self.main.config.verify_hashes,
+                self.main.config.photos,
+                self.main.messages.add,
+            )
+            return (yield from func(self, *args))
+
+    return wrapper
+
+
+@contextmanager
+def process_pool(workers: int):
+    """A process pool for tasks that can get cancelled or suspended.
+
+    Leaving the pool normally waits for the workers. When the task
+    gets closed (GeneratorExit) or fails, queued chunks are cancelled
+    and we do not wait for the running ones, so that the GUI does not
+    freeze.
+    """
+    # spawn instead of fork, since we are running inside a Qt application
+    pool = ProcessPoolExecutor(workers, mp_context=get_context("spawn"))
+    try:
+        yield pool
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
 
 
 class TaskManager:
-    def __init__(self, main):
-        self.main = main
+    """Create tasks and run them using the scheduler.
+
+    Tasks are generators that yield (total, current) after each step.
+    Tasks listed in `self.resumable` store a checkpoint in the db and
+    get started again after a restart or a profile switch, if they did
+    not finish.
 
-        self.generators = deque()
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.run_next_task)
-        self.current_gen_index = 0
+    This class does not use Qt, so that tasks can also run headless
+    (see cli.py). `main` needs to provide `config`, `messages.add()`
+    and `update_items()`. The GUI runs the tasks from a QTimer, see
+    widgets.TimerTaskManager.
+    """
 
-        self.progressbar_label = QLabel("Task")
-        self.progressbar = QProgressBar()
-        self.progressbar.setMaximumWidth(200)
-        self.progressbar_label.setVisible(False)
-        self.progressbar.setVisible(False)
+    def __init__(self, main, budget: float = 0.05):
+        self.main = main
 
-    def register_widgets(self, statusbar):
-        statusbar.addPermanentWidget(self.progressbar_label)
-        statusbar.addPermanentWidget(self.progressbar)
+        self.scheduler = Scheduler(self.message)
+        # seconds per timer event we spend on running tasks
+        self.budget = budget
+        # seconds a task waits for its process pool per step, the GUI
+        # only polls, so that the event loop does not get blocked
+        self.pool_timeout = 0.0
+
+        # kind: (name, priority, resource, function(checkpoint, *args))
+        self.resumable = {
+            "add_directory": (
+                "Adding files in {0}",
+                PRIORITY_NORMAL,
+                "disk",
+                lambda cp, directory: self.task_add_directory(Path(directory)),
+            ),
+            "update_timestamps": (
+                "Updating timestamps",
+                PRIORITY_NORMAL,
+                "disk",
+                lambda cp: self.task_add_timestamp_to_db(),
+            ),
+            "update_locations": (
+                "Updating locations",
+                PRIORITY_NORMAL,
+                "disk",
+                lambda cp: self.task_add_geolocation_to_db(),
+            ),
+            "update_hashes": (
+                "Updating hashes",
+                PRIORITY_BULK,
+                "disk",
+                lambda cp: self.task_update_hashes(checkpoint=cp),
+            ),
+            "find_duplicates": (
+                "Find duplicates",
+                PRIORITY_BULK,
+                "disk",
+                lambda cp: self.task_find_duplicates(),
+            ),
+            "update_similarity": (
+                "Find similar items",
+                PRIORITY_BULK,
+                "cpu",
+                lambda cp: self.task_update_similarity(),
+            ),
+            "create_thumbnails": (
+                "Creating thumbnails",
+                PRIORITY_BULK,
+                "cpu",
+                lambda cp: self.task_create_missing_thumbnails(),
+            ),
+            "probe_videos": (
+                "Probing videos",
+                PRIORITY_BULK,
+                "cpu",
+                lambda cp: self.task_probe_videos(),
+            ),
+            "move_files": (
+                "Moving files",
+                PRIORITY_NORMAL,
+                "disk",
+                lambda cp: self.task_move_files(
+                    self.main.config.photos, self.main.config.videos
+                ),
+            ),
+            "fix_no_date_files": (
+                "Check files for new dates",
+                PRIORITY_NORMAL,
+                "disk",
+                lambda cp: self.task_fix_no_date_files(
+                    self.main.config.photos, self.main.config.videos
+                ),
+            ),
+        }
+
+    def message(self, text: str):
+        self.main.messages.add(text)
+
+    def submit(
+        self,
+        name: str,
+        gen,
+        priority: int = PRIORITY_NORMAL,
+        resource: str = "disk",
+        checkpoint: Checkpoint | None = None,
+    ) -> Task:
+        self.message(f"Task: {name}")
+        task = self.scheduler.submit(Task(name, gen, priority, resource, checkpoint))
+        self.start()
+        return task
+
+    def submit_resumable(self, kind: str, *args):
+        name, priority, resource, function = self.resumable[kind]
+        name = name.format(*args)
+        args = [str(a) for a in args]
+        if self.scheduler.find(kind, args):
+            self.message(f"Task: '{name}' is already running")
+            return
 
-    def register_generator(self, gen):
-        self.generators.append(gen)
+        # continue where the same task stopped last time
+        for checkpoint in Checkpoint.load_all():
+            if (checkpoint.kind, checkpoint.args) == (kind, args):
+                break
+        else:
+            checkpoint = Checkpoint(kind, args)
+            checkpoint.save()
+        self.submit(name, function(checkpoint, *args), priority, resource, checkpoint)
+
+    def resume_tasks(self):
+        """Start the tasks again that did not finish last time."""
+        running = {t.checkpoint.row.id for t in self.scheduler.tasks if t.checkpoint}
+        for checkpoint in Checkpoint.load_all():
+            if checkpoint.row.id in running:
+                continue
+            if checkpoint.kind not in self.resumable:
+                checkpoint.delete()
+                continue
+            name, priority, resource, function = self.resumable[checkpoint.kind]
+            name = name.format(*checkpoint.args)
+            self.message(f"Task: resuming '{name}'")
+            self.scheduler.submit(
+                Task(
+                    name,
+                    function(checkpoint, *checkpoint.args),
+                    priority,
+                    resource,
+                    checkpoint,
+                )
+            )
+        if self.scheduler.tasks:
+            self.start()
 
-    def start(self, interval=500):
-        self.timer.start(interval)
-        self.progressbar_label.setVisible(True)
-        self.progressbar.setVisible(True)
+    def start(self):
+        """Called when tasks got submitted, the GUI starts its timer here."""
+        self.update_progress()
 
     def stop(self):
-        self.timer.stop()
-        self.generators = deque()
-        self.progressbar_label.setVisible(False)
-        self.progressbar.setVisible(False)
-        self.main.messages.add("Task done")
-
-    def run_next_task(self):
-        if not self.generators:
-            self.stop()
-            return
+        self.update_progress()
+
+    def suspend(self):
+        """Stop all tasks, they get resumed by resume_tasks."""
+        self.scheduler.suspend()
+        self.stop()
+
+    def cancel(self):
+        if self.scheduler.tasks:
+            self.message("Task: cancelling all tasks")
+        self.scheduler.cancel_all()
+        self.stop()
+
+    def cancel_task(self, task: Task):
+        self.scheduler.cancel(task)
+        self.update_progress()
+
+    def pause_task(self, task: Task, paused: bool = True):
+        task.paused = paused
+        if not paused:
+            self.start()
+        self.update_progress()
 
-        gen = self.generators[0]
-        try:
-            total, current = next(gen)
-            self.progressbar.setMaximum(total)
-            self.progressbar.setValue(current)
-        except StopIteration:
-            self.generators.popleft()
-            if not self.generators:
-                self.progressbar_label.setVisible(False)
-                self.progressbar.setVisible(False)
+    def run_tasks(self) -> bool:
+        """Run task steps for up to `self.budget` seconds.
+
+        Returns False once no task can run anymore.
+        """
+        start = time.monotonic()
+        ran = False
+        while time.monotonic() - start < self.budget:
+            if not self.scheduler.step():
+                break
+            ran = True
+
+        if ran and not self.scheduler.tasks:
+            self.message("Task done")
+        self.update_progress()
+        return bool(self.scheduler.runnable())
+
+    def poll_pool(self, pending) -> set:
+        """Return the futures that are done, waits up to `self.pool_timeout`."""
+        done, _ = wait(pending, timeout=self.pool_timeout)
+        return done
+
+    def run_all(self):
+        """Run all tasks until they are done, used when running headless."""
+        while self.run_tasks():
+            pass
+
+    def update_progress(self):
+        """Show the progress of the running task, e.g. in a progressbar."""
+        pass
+
+    def replay_move_journal(self):
+        """Finish or roll back moves that got interrupted last time.
+
+        Nothing happens while another process is moving files, its
+        journal entries are not interrupted.
+        """
+        with journal_lock() as locked:
+            if locked:
+                replay_journal(
+                    self.main.config.verify_hashes,
+                    self.main.config.photos,
+                    self.main.messages.add,
+                )
+
+    def add_directory(self, directory: Path):
+        self.submit_resumable("add_directory", directory)
 
     def db_update_timestamps(self):
-        self.main.messages.add("Task: Updating timestamps")
-        self.register_generator(self.task_add_timestamp_to_db())
-        self.start()
+        self.submit_resumable("update_timestamps")
 
     def db_update_locations(self):
-        self.main.messages.add("Task: Updating locations")
-        self.register_generator(self.task_add_geolocation_to_db())
-        self.start()
+        self.submit_resumable("update_locations")
 
     def db_update_hashes(self):
-        self.main.messages.add("Task: Updating hashes")
-        self.register_generator(self.task_update_hashes())
-        self.start()
+        self.submit_resumable("update_hashes")
 
     def move_files(self):
-        self.main.messages.add("Task: moving files")
-
-        self.register_generator(
-            self.task_move_files(self.main.config.photos, self.main.config.videos)
-        )
-        self.start()
+        self.submit_resumable("move_files")
 
     def fix_no_date_files(self):
-        self.main.messages.add("Task: Check files for new dates")
-        self.register_generator(
-            self.task_fix_no_date_files(
-                self.main.config.photos, self.main.config.videos
-            )
+        self.submit_resumable("fix_no_date_files")
+
+    def update_new_items(self, items: list[Item]):
+        """Update timestamps, locations, hashes and thumbnails of some items."""
+        self.submit(
+            "Creating thumbnails",
+            self.task_create_thumbnails(items),
+            PRIORITY_INTERACTIVE,
         )
-        self.start()
+        self.submit("Updating timestamps", self.task_add_timestamp_to_db(items))
+        self.submit("Updating locations", self.task_add_geolocation_to_db(items))
+        self.submit("Updating hashes", self.task_update_hashes(items))
+
+    def create_thumbnails(self):
+        """Create the thumbnails that are not in the thumbnail store yet."""
+        self.submit_resumable("create_thumbnails")
+
+    def probe_videos(self):
+        """Read the properties of videos and create their preview strips."""
+        self.submit_resumable("probe_videos")
+
+    def queue_jobs(self):
+        """Queue jobs for all items that need them, see `TagOrganizer worker`."""
+        for kind in JOB_KINDS:
+            added = queue_jobs(
+                kind, self.main.config.photos, self.main.config.verify_hashes
+            )
+            self.message(f"queued {added} {kind} jobs")
+
+    def find_duplicates(self):
+        self.submit_resumable("find_duplicates")
+
+    def db_update_similarity(self):
+        self.submit_resumable("update_similarity")
 
     def list_files_not_in_db(self):
         """List files that are in photo/video dir, but not in the db."""
-        self.main.messages.add("Task: List files that are not in the database")
-        self.register_generator(self.task_list_files_not_in_db())
-        self.start()
+        self.submit(
+            "List files that are not in the database", self.task_list_files_not_in_db()
+        )
 
     def list_files_not_in_config_dir(self):
         """List files that are in photo/video dir, but not in the db."""
-        self.main.messages.add("Task: List files that are outside of the config dirs")
-        self.register_generator(
+        self.submit(
+            "List files that are outside of the config dirs",
             self.task_list_files_not_in_config_dir(
                 self.main.config.photos, self.main.config.videos
-            )
+            ),
         )
-        self.start()
 
-    def task_add_timestamp_to_db(self):
-        items = db.get_items_without_date()
+    def task_add_directory(self, directory: Path):
+        """Add all photos and videos in a directory and its subdirectories.
+
+        The directory tree is only walked once (suffixes are matched case
+        insensitive) and the files are added to the db in batches while
+        we are walking.
+        """
+        # we don't know the total, so the progressbar just shows that we are busy
+        total = 0
+        current = 0
+        N = 500
+
+        added = 0
+        files = find_files(
+            directory, config.ALL_SUFFIX_SET, get_skip_dirs(self.main.config.photos)
+        )
+        for chunk in chunked(files, N):
+            added += db.add_images(chunk)
+            current += len(chunk)
+            yield total, current
+
+        self.main.update_items()
+        self.main.messages.add(f"found {current} files in {directory}")
+        self.main.messages.add(f"added {added} new items")
+
+    def task_add_timestamp_to_db(self, items: list[Item] | None = None):
+        if items is None:
+            items = db.get_items_without_date()
+        else:
+            items = [item for item in items if item.date is None]
 
         total = len(items)
         current = 0
         N = 10
 
         fixed = 0
+        errors = 0
         for chunk in chunked(items, N):
             need_update = []
             for entry in chunk:
-                filepath = Path(entry.uri)
-                if not filepath.is_file():
+                if not Path(entry.uri).is_file():
                     continue
-                tags = load_exif(filepath)
-                if "EXIF DateTimeOriginal" in tags:
-                    date_str = str(tags["EXIF DateTimeOriginal"])
-                    try:
-                        date_obj = datetime.strptime(date_str, "%Y:%m:%d %H:%M:%S")
-                    except ValueError:
-                        self.main.messages.add(
-                            f"Cannot parse date '{date_str}' for {entry.uri}"
-                        )
+                try:
+                    if not read_date(entry):
                         continue
-                    entry.date = date_obj
-                    fixed += 1
-                    need_update.append(entry)
+                except ValueError as e:
+                    self.main.messages.add(str(e))
+                    errors += 1
+                    continue
+                fixed += 1
+                need_update.append(entry)
             db.update_items_in_db(need_update)
-            current += N
-            yield total, current
+            current += len(chunk)
+            yield total, current, {"errors": errors}
         self.main.messages.add(f"total items without timestamp in db={total}")
         self.main.messages.add(f"added timesstamp to {fixed} items")
 
-    def convert_to_degrees(self, value, ref):
-        d = float(value.values[0])
-        m = float(value.values[1])
-        s = float(value.values[2])
-
-        f = d + (m / 60.0) + (s / 3600.0)
-        if ref not in ["E", "N"]:
-            f = -f
-        return f
-
-    def task_add_geolocation_to_db(self):
-        items = db.get_items_without_location()
+    def task_add_geolocation_to_db(self, items: list[Item] | None = None):
+        if items is None:
+            items = db.get_items_without_location()
+        else:
+            items = [item for item in items if item.latitude is None]
 
         total = len(items)
         current = 0
@@ -184,133 +488,387 @@ class TaskManager:
         for chunk in chunked(items, N):
             need_update = []
             for entry in chunk:
-                filepath = Path(entry.uri)
-                if not filepath.is_file():
+                if not Path(entry.uri).is_file():
                     continue
-                tags = load_exif(filepath)
-
-                if "GPS GPSLongitude" in tags and "GPS GPSLatitude" in tags:
-                    lon_values = tags["GPS GPSLongitude"]
-                    lat_values = tags["GPS GPSLatitude"]
-
-                    lon_ref = str(tags.get("GPS GPSLongitudeRef", "E"))
-                    lat_ref = str(tags.get("GPS GPSLatitudeRef", "N"))
-
-                    lon = self.convert_to_degrees(lon_values, lon_ref)
-                    lat = self.convert_to_degrees(lat_values, lat_ref)
-
-                    entry.longitude = lon
-                    entry.latitude = lat
-
+                if read_location(entry):
                     fixed += 1
                     need_update.append(entry)
             db.update_items_in_db(need_update)
-            current += N
+            current += len(chunk)
             yield total, current
         self.main.messages.add(f"total items without geolocation in db={total}")
         self.main.messages.add(f"added geolocation to {fixed} items")
 
-    def task_update_hashes(self):
-        items = db.get_items_without_hashes()
+    def task_update_hashes(
+        self, items: list[Item] | None = None, checkpoint: Checkpoint | None = None
+    ):
+        verify = self.main.config.verify_hashes
+        # files given to us might have been overwritten, so we also
+        # check their fingerprints
+        check = items is not None
+        if items is None:
+            if verify:
+                # continue after the last item we hashed before a restart
+                last_id = checkpoint.state.get("last_id", 0) if checkpoint else 0
+                items = db.get_all_items(after_id=last_id)
+            else:
+                items = db.get_items_without_hashes()
 
         total = len(items)
         current = 0
         N = 10
 
         fixed = 0
+        hashed_bytes = 0
+        errors = 0
         for chunk in chunked(items, N):
             need_update = []
             for item in chunk:
-                filepath = Path(item.uri)
-                if not filepath.is_file():
+                if not Path(item.uri).is_file():
+                    errors += 1
                     continue
-                item.uri_md5 = calculate_md5(item.uri)
-                item.data_xxhash = calculate_xxhash(filepath)
+                hashed_bytes += update_hash(item, verify, check)
                 need_update.append(item)
                 fixed += 1
             db.update_items_in_db(need_update)
-            current += N
-            yield total, current
+            if checkpoint:
+                checkpoint.save(last_id=chunk[-1].id)
+            current += len(chunk)
+            yield total, current, {"bytes": hashed_bytes, "errors": errors}
         self.main.messages.add(f"total items without hashes in db={total}")
         self.main.messages.add(f"added hashes to {fixed} items")
 
-    def task_move_files(self, photo_dir: Path, video_dir: Path):
-        """Move files to the directories named in the config file.
+    def task_create_thumbnails(self, items: list[Item]):
+        # headless commands that do not create thumbnails do not load Qt
+        from .thumbnails import load_image
 
-        We use different directories for photos and videos.
+        total = len(items)
+        current = 0
+        N = 10
+
+        for chunk in chunked(items, N):
+            for item in chunk:
+                load_image(
+                    item.uri, thumbnail_keys(item), LEVELS[-1], self.main.config.photos
+                )
+            current += len(chunk)
+            yield total, current
+
+    def task_create_missing_thumbnails(self):
+        """Create all missing thumbnails in a process pool.
+
+        The workers decode the files with cv2 and return JPEGs that get
+        written to the thumbnail store in batches. Thumbnails that are
+        stored under an older key only get copied.
         """
-        items = db.get_all_items_not_in_dir([photo_dir, video_dir], config.ALL_SUFFIX)
+        store = thumbnail_store.store
+        photos = self.main.config.photos
+
+        # thumbnails are keyed by the content hash
+        items = [item for item in db.get_all_items() if thumbnail_keys(item)]
+        stored = store.keys(LEVELS[0])
+        missing = []
+        copies = []
+        for item in items:
+            keys = thumbnail_keys(item)
+            if keys[0] in stored:
+                continue
+            old = [key for key in keys[1:] if key in stored]
+            if old:
+                copies.append((keys[0], old[0]))
+            else:
+                missing.append(item)
+        for key, old in copies:
+            store.copy(old, key)
+
+        total = len(missing)
+        current = 0
+        N = 16
+
+        created = 0
+        errors = 0
+        workers = os.cpu_count() or 1
+        chunks = chunked(missing, N)
+        with process_pool(workers) as pool:
+            pending = {}
+            while True:
+                while len(pending) < 2 * workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    files = [
+                        (
+                            item.uri,
+                            [
+                                str(get_thumbnail_file(key, photos))
+                                for key in thumbnail_keys(item)
+                            ],
+                        )
+                        for item in chunk
+                    ]
+                    future = pool.submit(create_thumbnails, files)
+                    pending[future] = chunk
+                if not pending:
+                    break
+
+                done = self.poll_pool(pending)
+                if not done:
+                    yield None
+                    continue
+                rows = []
+                for future in done:
+                    chunk = pending.pop(future)
+                    for item, levels in zip(chunk, future.result()):
+                        if not levels:
+                            self.main.messages.add(
+                                f"[Error] cannot create thumbnail for {item.uri}"
+                            )
+                            errors += 1
+                            continue
+                        key = thumbnail_keys(item)[0]
+                        rows.extend((key, level, data) for level, data in levels)
+                    current += len(chunk)
+                store.put_many(rows)
+                created += len({key for key, _, _ in rows})
+                yield total, current, {"errors": errors}
+
+        self.main.messages.add(
+            f"created {created} thumbnails and copied {len(copies)} for"
+            f" {len(items)} items with hashes"
+        )
+
+    def task_probe_videos(self):
+        """Read the properties of videos and create their preview strips.
+
+        The videos get opened with cv2 in a process pool. Videos without
+        a date get the creation time of the container. Preview strips
+        are stored in the thumbnail store under the content hash, so
+        they need the hash of the video.
+        """
+        store = thumbnail_store.store
+        stored = store.keys(SPRITE_LEVEL)
+
+        todo = []
+        for item in db.get_all_items():
+            if item.missing or Path(item.uri).suffix.lower() not in config.VIDEO_SUFFIX:
+                continue
+            keys = thumbnail_keys(item)
+            # videos that cannot be read do not get a preview strip either
+            with_sprite = (
+                bool(keys)
+                and keys[0] not in stored
+                and (not item.probed or item.duration is not None)
+            )
+            if not item.probed or with_sprite:
+                todo.append((item, with_sprite))
+
+        total = len(todo)
+        current = 0
+        N = 4
+
+        probed = 0
+        sprites = 0
+        errors = 0
+        workers = os.cpu_count() or 1
+        chunks = chunked(todo, N)
+        with process_pool(workers) as pool:
+            pending = {}
+            while True:
+                while len(pending) < 2 * workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    files = [(item.uri, with_sprite) for item, with_sprite in chunk]
+                    future = pool.submit(probe_videos, files)
+                    pending[future] = chunk
+                if not pending:
+                    break
+
+                done = self.poll_pool(pending)
+                if not done:
+                    yield None
+                    continue
+                updated = []
+                rows = []
+                for future in done:
+                    chunk = pending.pop(future)
+                    for (item, _), (info, sprite) in zip(chunk, future.result()):
+                        # also remember videos that cannot be read, so
+                        # that we do not try them again
+                        item.probed = True
+                        updated.append(item)
+                        if info is None:
+                            self.main.messages.add(f"[Error] cannot read {item.uri}")
+                            errors += 1
+                            continue
+                        info.apply(item)
+                        if sprite:
+                            key = thumbnail_keys(item)[0]
+                            rows.append((key, SPRITE_LEVEL, sprite))
+                    current += len(chunk)
+                db.update_items_in_db(updated)
+                store.put_many(rows)
+                probed += len(updated)
+                sprites += len(rows)
+                yield total, current, {"errors": errors}
+
+        self.main.messages.add(
+            f"probed {probed} videos and created {sprites} preview strips"
+        )
+
+    def task_find_duplicates(self):
+        """Find items with the same content.
+
+        We first make sure that we know the size of all items. Only
+        files that share their size with another item are read and of
+        those only the ones where the first and last 64 KiB also match
+        get hashed completely.
+        """
+        items = db.get_items_without_size()
 
         total = len(items)
         current = 0
-        N = 10
+        N = 100
 
-        moved = 0
         for chunk in chunked(items, N):
             need_update = []
             for item in chunk:
-                # check that file actually exists
                 filepath = Path(item.uri)
                 if not filepath.is_file():
-                    self.main.messages.add(f"[Error] item {item.uri} does not exist")
                     continue
+                set_fingerprint(item, get_fingerprint(filepath))
+                need_update.append(item)
+            db.update_items_in_db(need_update)
+            current += len(chunk)
+            yield total, current
 
-                # figure out where to save the file
-                ext = filepath.suffix.lower()
-                if ext in config.PHOTO_SUFFIX:
-                    correct_dir = Path(photo_dir)
-                elif ext in config.VIDEO_SUFFIX:
-                    correct_dir = Path(video_dir)
-                else:
-                    self.main.messages.add(
-                        f"[Error] item {item.uri} cannot handle {ext}"
-                    )
-                    continue
+        items = db.get_items_with_same_size()
 
-                # figure out where to save the file
-                if item.date:
-                    year = item.date.year
-                    month = item.date.month
-                    day = item.date.day
-                    correct_path = (
-                        correct_dir
-                        / f"{year:04d}"
-                        / f"{month:02d}"
-                        / f"{day:02d}"
-                        / filepath.name
-                    )
-                else:
-                    self.main.messages.add(f"[Error] item {item.uri} has no date set")
-                    correct_path = correct_dir / "no-date" / filepath.name
-
-                # lower the case for the extension
-                correct_path = correct_path.with_suffix(ext)
-
-                if correct_path.exists():
-                    self.main.messages.add(
-                        f"File already exists in the correct directory: {correct_path}"
-                    )
-                    continue
+        total = len(items)
+        current = 0
 
-                # Move the file
-                try:
-                    correct_path.parent.mkdir(parents=True, exist_ok=True)
+        hashed = 0
+        read_bytes = 0
+        for size, group in groupby(items, key=lambda item: item.size):
+            group = list(group)
+
+            partial = defaultdict(list)
+            for item in group:
+                filepath = Path(item.uri)
+                if not filepath.is_file():
+                    continue
+                partial[calculate_partial_xxhash(filepath, size)].append(item)
+                read_bytes += min(size, 2 * 65536)
 
-                    shutil.move(filepath, correct_path)
-                    item.uri = str(correct_path)
-                    item.uri_md5 = calculate_md5(item.uri)
-                    item.data_xxhash = calculate_xxhash(correct_path)
+            need_update = []
+            for candidates in partial.values():
+                if len(candidates) < 2:
+                    continue
+                for item in candidates:
+                    if item.data_xxhash:
+                        continue
+                    item.data_xxhash = calculate_xxhash(Path(item.uri))
                     need_update.append(item)
-                    moved += 1
-                    self.main.messages.add(f"Moved {filepath} to {correct_path}")
-                except Exception:
-                    self.main.messages.add(
-                        f"Failed to move {filepath} to {correct_path}"
-                    )
+                    hashed += 1
+                    read_bytes += size
             db.update_items_in_db(need_update)
-            current += len(chunk)
-            yield total, current
-        self.main.messages.add(f"total items outside photo/video dirs: {total}")
+            current += len(group)
+            yield total, current, {"bytes": read_bytes}
+
+        groups, duplicates = db.get_number_of_duplicates()
+        self.main.messages.add(f"hashed {hashed} candidates for duplicates")
+        self.main.messages.add(
+            f"found {duplicates} items in {groups} groups of duplicates"
+            " (use the 'Duplicates' tag to show them)"
+        )
+
+    def task_update_similarity(self):
+        """Calculate perceptual hashes and group near duplicates.
+
+        The hashes are calculated in a process pool, so that we can use
+        all cores. Afterwards all items get clustered by the hamming
+        distance of their hashes.
+        """
+        items = db.get_items_without_phash()
+
+        total = len(items)
+        current = 0
+        N = 32
+
+        fixed = 0
+        errors = 0
+        workers = os.cpu_count() or 1
+        chunks = chunked(items, N)
+        with process_pool(workers) as pool:
+            pending = {}
+            while True:
+                while len(pending) < 2 * workers:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    future = pool.submit(compute_dhashes, [i.uri for i in chunk])
+                    pending[future] = chunk
+                if not pending:
+                    break
+
+                done = self.poll_pool(pending)
+                if not done:
+                    yield None
+                    continue
+                for future in done:
+                    chunk = pending.pop(future)
+                    need_update = []
+                    for item, value in zip(chunk, future.result()):
+                        # also remember items that failed, so that we do
+                        # not try them again
+                        need_update.append(item)
+                        if value is None:
+                            self.main.messages.add(
+                                f"[Error] cannot calculate hash for {item.uri}"
+                            )
+                            item.phash_failed = True
+                            errors += 1
+                            continue
+                        item.phash = value
+                        fixed += 1
+                    db.update_items_in_db(need_update)
+                    current += len(chunk)
+                yield total, current, {"errors": errors}
+
+        ids, hashes = db.get_phashes()
+        groups = cluster(ids, hashes, self.main.config.similarity_threshold)
+        db.set_phash_groups(groups)
+        db.reset_similarity_index()
+
+        self.main.messages.add(f"total items without perceptual hash in db={total}")
+        self.main.messages.add(f"added perceptual hash to {fixed} items")
+        self.main.messages.add(
+            f"found {len(groups)} items in {len(set(groups.values()))} groups"
+            " of near duplicates (use the 'Near Duplicates' tag to show them)"
+        )
+
+    @moves_files
+    def task_move_files(self, photo_dir: Path, video_dir: Path):
+        """Move files to the directories named in the config file.
+
+        We use different directories for photos and videos.
+        """
+        items = db.get_all_items_not_in_dir([photo_dir, video_dir], config.ALL_SUFFIX)
+        for item in items:
+            if not item.date:
+                self.main.messages.add(f"[Error] item {item.uri} has no date set")
+
+        moves, problems = plan_moves(items, photo_dir, video_dir)
+        for problem in problems:
+            self.main.messages.add(problem)
+
+        moved = yield from run_moves(
+            moves,
+            self.main.config.verify_hashes,
+            self.main.config.photos,
+            self.main.messages.add,
+        )
+        self.main.messages.add(f"total items outside photo/video dirs: {len(items)}")
         self.main.messages.add(f"moved {moved} items")
 
     def task_list_files_not_in_config_dir(self, photo_dir: Path, video_dir: Path):
@@ -337,120 +895,89 @@ class TaskManager:
         self.main.messages.add(f"total items outside photo/video dirs: {total}")
 
     def task_list_files_not_in_db(self):
-        """List files that are in the config dirs, but not in the db."""
+        """List differences between the config dirs and the db.
 
-        current = 0
+        Shows files that are not in the db, items whose file is missing
+        and files that changed since they were hashed. The directories
+        are streamed, so we never hold a list of all files in memory.
+        """
+        roots = [self.main.config.photos]
+        if self.main.config.videos != self.main.config.photos:
+            roots.append(self.main.config.videos)
 
-        photos = list(self.main.config.photos.rglob("*"))
-        videos = list(self.main.config.videos.rglob("*"))
+        known = {root: db.get_known_files(root) for root in roots}
 
-        total = len(photos) + len(videos)
-        N = 10
+        # we only know the number of items in the db, not the number of files
+        total = sum(len(k) for k in known.values())
+        current = 0
 
-        self.main.messages.add(
-            f"   Photos in {self.main.config.photos}, but not in db:"
-        )
-        for chunk in chunked(photos, N):
-            for file in chunk:
-                if file.is_dir():
-                    continue
-                if "thumbnails" in str(file):
-                    continue
-                if ".DS_Store" in str(file):
-                    continue
-                res = db.check_item_in_db(str(file))
-                if res is None:
-                    self.main.messages.add(f"      {file}")
-            current += N
-            yield total, current
+        counts = defaultdict(int)
+        last = time.monotonic()
+        skip = get_skip_dirs(self.main.config.photos)
+        for root in roots:
+            self.main.messages.add(f"   Checking {root}:")
+            for status, path in reconcile(root, known[root], skip):
+                counts[status] += 1
+                if status != "ok":
+                    self.main.messages.add(f"      [{status}] {path}")
+
+                current += 1
+                # only return to the GUI every 100 ms
+                if time.monotonic() - last > 0.1:
+                    last = time.monotonic()
+                    yield max(total, current), current
 
         self.main.messages.add(
-            f"   Videos in {self.main.config.videos}, but not in db:"
+            f"files not in db: {counts['new']}, "
+            f"missing files: {counts['missing']}, "
+            f"changed files: {counts['changed']}"
         )
-        for chunk in chunked(videos, N):
-            for file in chunk:
-                if file.is_dir():
-                    continue
-                res = db.check_item_in_db(str(file))
-                if res is None:
-                    self.main.messages.add(f"      {file}")
-            current += N
-            yield total, current
 
+    @moves_files
     def task_fix_no_date_files(self, photo_dir: Path, video_dir: Path):
-        """Move items from 'no-date' to their correct date-based location if date is now available."""
+        """Move items out of 'no-date' once they have a date.
+
+        Only the 'no-date' dirs that task_move_files creates are checked.
+        The items that have a date by now are read in batches using the
+        index on uri, so we never load the whole library.
+        """
         self.main.messages.add("Task: Moving files out of 'no-date' if date is now set")
 
-        # Find all items whose path includes 'no-date'
-        items = db.get_all_items_with_location()  # Use a broad search
-        items = [
-            item
-            for item in items
-            if "/no-date/" in item.uri or "\\no-date\\" in item.uri
-        ]
+        directories = sorted({photo_dir / "no-date", video_dir / "no-date"})
+        total = sum(db.count_items_in_dir(d, dated=True) for d in directories)
+        undated = sum(db.count_items_in_dir(d, dated=False) for d in directories)
 
-        total = len(items)
         current = 0
-        N = 10
-        moved = 0
+        N = 500
 
-        for chunk in chunked(items, N):
-            need_update = []
-
-            for item in chunk:
-                filepath = Path(item.uri)
-
-                if not filepath.is_file():
-                    self.main.messages.add(f"[Error] item {item.uri} does not exist")
-                    continue
-
-                if not item.date:
-                    self.main.messages.add(f"[Skip] item {item.uri} still has no date")
-                    continue
-
-                ext = filepath.suffix.lower()
-                if ext in config.PHOTO_SUFFIX:
-                    correct_dir = Path(photo_dir)
-                elif ext in config.VIDEO_SUFFIX:
-                    correct_dir = Path(video_dir)
-                else:
-                    self.main.messages.add(f"[Error] Unknown file type: {item.uri}")
-                    continue
-
-                year = item.date.year
-                month = item.date.month
-                day = item.date.day
-                correct_path = (
-                    correct_dir
-                    / f"{year:04d}"
-                    / f"{month:02d}"
-                    / f"{day:02d}"
-                    / filepath.name
+        moved = 0
+        errors = 0
+        for directory in directories:
+            last_uri = ""
+            while items := db.get_dated_items_in_dir(directory, last_uri, N):
+                last_uri = items[-1].uri
+
+                moves, problems = plan_moves(items, photo_dir, video_dir)
+                for problem in problems:
+                    self.main.messages.add(problem)
+                errors += len(problems)
+
+                batch_moved, batch_errors = yield from offset_progress(
+                    run_moves(
+                        moves,
+                        self.main.config.verify_hashes,
+                        self.main.config.photos,
+                        self.main.messages.add,
+                    ),
+                    total,
+                    current,
+                    errors,
                 )
-                correct_path = correct_path.with_suffix(ext)  # Normalize extension case
-
-                if correct_path.exists():
-                    self.main.messages.add(f"File already exists: {correct_path}")
-                    continue
-
-                try:
-                    correct_path.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.move(filepath, correct_path)
-
-                    item.uri = str(correct_path)
-                    item.uri_md5 = calculate_md5(item.uri)
-                    item.data_xxhash = calculate_xxhash(correct_path)
-                    need_update.append(item)
-                    moved += 1
-                    self.main.messages.add(
-                        f"Moved from no-date: {filepath} → {correct_path}"
-                    )
-                except Exception as e:
-                    self.main.messages.add(f"[Error] Failed to move {filepath}: {e}")
-
-            db.update_items_in_db(need_update)
-            current += len(chunk)
-            yield total, current
+                moved += batch_moved
+                errors += batch_errors
+                current += len(items)
+                yield total, current, {"errors": errors}
 
-        self.main.messages.add(f"Total items in 'no-date': {total}")
+        self.main.messages.add(f"Total items in 'no-date': {total + undated}")
+        self.main.messages.add(f"{undated} items in 'no-date' still have no date")
         self.main.messages.add(f"Moved {moved} items to correct date folders")
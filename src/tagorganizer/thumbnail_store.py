@@ -0,0 +1,382 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import os
+from pathlib import Path
+import sqlite3
+import sys
+import threading
+
+import cv2
+from more_itertools import chunked
+
+from . import config
+from .helper import get_orientation, read_jpeg_size
+from .image_cache import MiB
+from .models import Item
+
+# sizes (longest side) of the thumbnails we store for each item, they
+# all get created from the same decoded image
+LEVELS = (128, 256, 512)
+
+# size (longest side) of the images for the single item view, they
+# get stored when an item is shown for the first time
+DISPLAY_LEVEL = 2560
+# level of the preview strips of videos, see `video.create_sprite`
+SPRITE_LEVEL = 0
+
+# default max size of all display images in the store in MiB
+DISPLAY_CACHE_SIZE = 1024
+# summing up the size of the display images needs to read all of
+# them, so we only check after this many new ones
+TRIM_INTERVAL = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumbnail (
+    key TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (key, level)
+)
+"""
+
+# the store is only a cache, if the schema changes we start from scratch
+VERSION = 1
+
+# sqlite reads the file through mmap up to this size
+MMAP_SIZE = 1 << 30
+
+# quality of the JPEG thumbnails
+JPEG_QUALITY = 85
+
+# decoder flags from the largest reduction to none
+REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+    (1, cv2.IMREAD_COLOR),
+]
+
+ROTATIONS = {
+    3: cv2.ROTATE_180,
+    6: cv2.ROTATE_90_CLOCKWISE,
+    8: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+store = None
+
+
+def pick_level(size: int) -> int:
+    """Return the smallest level that is at least `size`, or the largest one."""
+    for level in LEVELS:
+        if level >= size:
+            return level
+    return LEVELS[-1]
+
+
+def get_thumbnail_path(photos_path: Path) -> Path:
+    """Location of the thumbnails before we used the thumbnail store."""
+    if sys.platform.startswith("linux"):
+        return Path.home() / ".cache" / "thumbnails" / "large"
+    else:
+        return photos_path / "thumbnails"
+
+
+def get_skip_dirs(photos_path: Path) -> frozenset[str]:
+    """Directories that scans of the photo dir leave out.
+
+    Only the old thumbnail dir itself is skipped, a 'thumbnails' dir
+    somewhere else belongs to the user.
+    """
+    return frozenset([str(get_thumbnail_path(photos_path))])
+
+
+def get_thumbnail_file(md5: str, photos_path: Path) -> Path:
+    thumbnail_path = get_thumbnail_path(photos_path)
+    if sys.platform.startswith("linux"):
+        return thumbnail_path / f"{md5}.png"
+    md5_dir = md5[:2]
+    md5_file = md5[2:]
+    return thumbnail_path / md5_dir / f"{md5_file}.png"
+
+
+class ThumbnailStore:
+    """Encoded thumbnails (JPEG or PNG) as blobs in their own sqlite file.
+
+    Each thumbnail is stored in several sizes (see LEVELS) under the
+    keys from `thumbnail_keys`. Display images (see DISPLAY_LEVEL) are
+    stored in the same table, the oldest ones get removed once they
+    use more than `display_budget` bytes (see `put_display`).
+
+    Much faster than one file per thumbnail for large libraries.
+    Each thread uses its own connection, so that the thumbnail loader
+    threads and worker processes can read and write at the same time.
+    """
+
+    def __init__(
+        self, path: Path, wal: bool = True, display_cache_size=DISPLAY_CACHE_SIZE
+    ):
+        self.path = path
+        self.journal_mode = "WAL" if wal else "DELETE"
+        self.display_budget = display_cache_size * MiB
+        self.display_puts = 0
+        self.local = threading.local()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        if connection.execute("PRAGMA user_version").fetchone()[0] != VERSION:
+            connection.execute("DROP TABLE IF EXISTS thumbnail")
+            connection.execute(f"PRAGMA user_version={VERSION}")
+        connection.execute(SCHEMA)
+        connection.execute("COMMIT")
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            # autocommit, every put is its own transaction
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            connection.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key: str, level: int) -> bytes | None:
+        row = (
+            self.connection()
+            .execute(
+                "SELECT data FROM thumbnail WHERE key = ? AND level = ?", (key, level)
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def __contains__(self, key: str) -> bool:
+        row = (
+            self.connection()
+            .execute("SELECT 1 FROM thumbnail WHERE key = ?", (key,))
+            .fetchone()
+        )
+        return row is not None
+
+    def put_many(self, rows: list[tuple[str, int, bytes]]) -> None:
+        """Add several (key, level, data) in one transaction, existing ones are kept."""
+        connection = self.connection()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany(
+                "INSERT OR IGNORE INTO thumbnail (key, level, data) VALUES (?, ?, ?)",
+                rows,
+            )
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def put_display(self, key: str, data: bytes) -> None:
+        """Add a display image, removes the oldest ones from time to time."""
+        self.put_many([(key, DISPLAY_LEVEL, data)])
+        self.display_puts += 1
+        if self.display_puts % TRIM_INTERVAL == 0:
+            self.trim(DISPLAY_LEVEL, self.display_budget)
+
+    def copy(self, old: str, new: str) -> None:
+        """Store all levels of a thumbnail also under a new key."""
+        self.connection().execute(
+            "INSERT OR IGNORE INTO thumbnail (key, level, data)"
+            " SELECT ?, level, data FROM thumbnail WHERE key = ?",
+            (new, old),
+        )
+
+    def keys(self, level: int | None = None) -> set[str]:
+        """All keys, or only the ones that have the given level."""
+        if level is None:
+            rows = self.connection().execute("SELECT DISTINCT key FROM thumbnail")
+        else:
+            rows = self.connection().execute(
+                "SELECT key FROM thumbnail WHERE level = ?", (level,)
+            )
+        return {key for (key,) in rows}
+
+    def delete(self, keys) -> None:
+        connection = self.connection()
+        for chunk in chunked(keys, 500):
+            connection.execute(
+                f"DELETE FROM thumbnail WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+
+    def prune(self, keep: set[str]) -> int:
+        """Delete all thumbnails not in keep, returns the number deleted."""
+        unused = self.keys() - keep
+        self.delete(unused)
+        return len(unused)
+
+    def trim(self, level: int, max_bytes: int) -> int:
+        """Delete the oldest images of a level beyond max_bytes.
+
+        Returns the number of deleted images.
+        """
+        cursor = self.connection().execute(
+            "DELETE FROM thumbnail WHERE rowid IN ("
+            " SELECT rowid FROM ("
+            "  SELECT rowid, SUM(LENGTH(data)) OVER (ORDER BY rowid DESC) AS total"
+            "  FROM thumbnail WHERE level = ?"
+            " ) WHERE total > ?"
+            ")",
+            (level, max_bytes),
+        )
+        return cursor.rowcount
+
+    def size(self) -> int:
+        """Size of the file, including the WAL file."""
+        wal = self.path.with_name(f"{self.path.name}-wal")
+        return sum(os.path.getsize(file) for file in (self.path, wal) if file.exists())
+
+    def compact(self) -> tuple[int, int]:
+        """Rebuild the file, returns the size before and after."""
+        before = self.size()
+        connection = self.connection()
+        connection.execute("VACUUM")
+        # in WAL mode the new pages end up in the WAL file first
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return before, self.size()
+
+
+def thumbnail_keys(item: Item) -> list[str]:
+    """Keys of the thumbnail of an item, the first one is the current key.
+
+    Thumbnails are keyed by the content hash, so that they stay valid
+    when a file gets moved. Older thumbnails used the md5 of the uri.
+    """
+    return [key for key in (item.data_xxhash, item.uri_md5) if key]
+
+
+def keep_thumbnail(item: Item, old_md5: str, photos_path: Path) -> None:
+    """Keep the thumbnail of an item whose uri (and uri_md5) changed.
+
+    Thumbnails that are only stored under the md5 of the old uri (in
+    the store or as an old PNG file) get stored under the current key
+    of the item, so they are not created again after a move.
+    """
+    keys = thumbnail_keys(item)
+    if not old_md5 or not keys or keys[0] == old_md5 or keys[0] in store:
+        return
+    if old_md5 in store:
+        store.copy(old_md5, keys[0])
+        return
+    levels = convert_old_thumbnail(get_thumbnail_file(old_md5, photos_path))
+    store.put_many([(keys[0], level, data) for level, data in levels])
+
+
+def fit(image, size: int):
+    """Scale a cv2 image down, so that its longest side is at most `size`."""
+    height, width = image.shape[:2]
+    if max(height, width) <= size:
+        return image
+    scale = size / max(height, width)
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, new_size, interpolation=cv2.INTER_AREA)
+
+
+def encode_levels(image, levels) -> list[tuple[int, bytes]]:
+    """Encode an image as JPEG for each level, starting with the largest."""
+    result = []
+    for level in sorted(levels, reverse=True):
+        # each level gets scaled from the previous one
+        image = fit(image, level)
+        success, data = cv2.imencode(
+            ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+        )
+        if not success:
+            return []
+        result.append((level, data.tobytes()))
+    return result
+
+
+def reduced_flag(size: tuple[int, int] | None) -> int:
+    """Decoder flag for the largest reduction that keeps LEVELS[-1] pixels.
+
+    `size` comes from the JPEG header, other formats (None) do not
+    profit from a reduced decode.
+    """
+    if size is None:
+        return cv2.IMREAD_COLOR
+    for factor, flag in REDUCED_FLAGS:
+        # libjpeg rounds the scaled size up
+        if -(-max(size) // factor) >= LEVELS[-1]:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def convert_old_thumbnail(old_file: Path) -> list[tuple[int, bytes]]:
+    """Convert an old PNG thumbnail into the levels it is large enough for."""
+    image = cv2.imread(str(old_file)) if old_file.is_file() else None
+    if image is None:
+        return []
+    levels = [level for level in LEVELS if level <= max(image.shape[:2])]
+    return encode_levels(image, levels or LEVELS[:1])
+
+
+def create_thumbnail(file: str, old_files: list[str]) -> list[tuple[int, bytes]]:
+    """Create all levels of a thumbnail using cv2 (used in the process pool).
+
+    Photos are decoded at the largest reduction (1/8, 1/4, 1/2) that is
+    still larger than the largest level (see `reduced_flag`), so
+    libjpeg only needs to decode a fraction of the image. Old PNG thumbnails in `old_files`
+    only get converted into the levels they are large enough for.
+    Returns (level, JPEG) for all levels, or an empty list.
+    """
+    for old_file in old_files:
+        levels = convert_old_thumbnail(Path(old_file))
+        if levels:
+            return levels
+
+    rotation = None
+    if Path(file).suffix.lower() in config.VIDEO_SUFFIX:
+        cap = cv2.VideoCapture(file)
+        cap.set(cv2.CAP_PROP_POS_MSEC, 1000)
+        success, image = cap.read()
+        cap.release()
+        if not success:
+            return []
+    else:
+        flag = reduced_flag(read_jpeg_size(Path(file)))
+        image = cv2.imread(file, flag | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is None:
+            return []
+        rotation = ROTATIONS.get(get_orientation(file))
+
+    image = fit(image, LEVELS[-1])
+    if rotation is not None:
+        image = cv2.rotate(image, rotation)
+    return encode_levels(image, LEVELS)
+
+
+def create_thumbnails(
+    files: list[tuple[str, list[str]]],
+) -> list[list[tuple[int, bytes]]]:
+    """Create thumbnails for several (file, old_files) (used in the process pool)."""
+    return [create_thumbnail(f, old_files) for f, old_files in files]
+
+
+def set_store(path: Path, wal: bool = True, display_cache_size=DISPLAY_CACHE_SIZE):
+    global store
+    store = ThumbnailStore(path, wal, display_cache_size)
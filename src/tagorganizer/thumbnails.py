@@ -0,0 +1,397 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from pathlib import Path
+
+from qtpy.QtGui import QPixmap, QTransform, QImage, QImageIOHandler, QImageReader
+from qtpy.QtCore import QBuffer, QIODevice, QPoint, QRect, QSize, Qt
+
+import cv2
+
+from . import config
+from . import image_cache
+from . import thumbnail_store
+from .thumbnail_store import (
+    DISPLAY_LEVEL,
+    JPEG_QUALITY,
+    LEVELS,
+    SPRITE_LEVEL,
+    get_thumbnail_file,
+    pick_level,
+    thumbnail_keys,
+)
+from .helper import get_orientation, load_exif
+from .models import Item
+
+# rotation for the EXIF orientations
+ROTATION_ANGLES = {3: 180, 6: 90, 8: -90}
+
+# size of the tiles when zooming into photos
+TILE_SIZE = 512
+# tiles get decoded at 1/level, libjpeg can decode at these scales directly
+TILE_LEVELS = (1, 2, 4, 8)
+
+# Qt refuses to decode images larger than 256 MB by default, which
+# would already fail for 70 MP photos
+ALLOCATION_LIMIT = 2048
+QImageReader.setAllocationLimit(ALLOCATION_LIMIT)
+
+
+def encode_image(image: QImage) -> bytes:
+    """Encode as JPEG, or as PNG if the image can be transparent."""
+    buffer = QBuffer()
+    buffer.open(QIODevice.WriteOnly)
+    if image.hasAlphaChannel():
+        image.save(buffer, "PNG")
+    else:
+        image.save(buffer, "JPG", JPEG_QUALITY)
+    return bytes(buffer.data())
+
+
+def fit_image(image: QImage, size: int) -> QImage:
+    """Scale an image down, so that its longest side is at most `size`."""
+    if max(image.width(), image.height()) <= size:
+        return image
+    return image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def make_levels(image: QImage, levels) -> dict[int, QImage]:
+    """Scale an image to each level, starting with the largest."""
+    result = {}
+    for level in sorted(levels, reverse=True):
+        # each level gets scaled from the previous one
+        image = fit_image(image, level)
+        result[level] = image
+    return result
+
+
+def save_thumbnail(images: dict[int, QImage], key: str) -> None:
+    thumbnail_store.store.put_many(
+        [(key, level, encode_image(image)) for level, image in images.items()]
+    )
+
+
+def load_thumbnail(keys: list[str], level: int, photos_path: Path) -> QImage | None:
+    """Load a thumbnail from the store, see `thumbnail_keys`.
+
+    Thumbnails stored under an older key and the old PNG files get
+    stored under the current key.
+    """
+    store = thumbnail_store.store
+    for key in keys:
+        data = store.get(key, level)
+        if data is not None:
+            if key != keys[0]:
+                store.copy(key, keys[0])
+            image = QImage.fromData(data)
+            return None if image.isNull() else image
+
+    # old thumbnails are only large enough for the smallest level
+    if level != LEVELS[0]:
+        return None
+    for key in keys:
+        thumbnail = get_thumbnail_file(key, photos_path)
+        if thumbnail.is_file():
+            image = QImage(str(thumbnail))
+            if not image.isNull():
+                image = fit_image(image, level)
+                save_thumbnail({level: image}, keys[0])
+                return image
+    return None
+
+
+def read_image(file: str, size: int | None = None) -> QImage:
+    """Read an image, its longest side scaled down to `size` by the decoder.
+
+    For JPEGs libjpeg decodes directly at a reduced size, so the full
+    image is never in memory.
+    """
+    reader = QImageReader(file)
+    # we rotate using the EXIF orientation ourselves
+    reader.setAutoTransform(False)
+    original = reader.size()
+    if size and original.isValid() and max(original.width(), original.height()) > size:
+        reader.setScaledSize(original.scaled(size, size, Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        print(f"[ERROR] cannot read {file}: {reader.errorString()}")
+    return image
+
+
+def read_exif_thumbnail(file: str, size: int) -> QImage | None:
+    """Return the thumbnail from the EXIF data, if it is large enough."""
+    data = load_exif(file).get("JPEGThumbnail")
+    if not data:
+        return None
+    image = QImage.fromData(data)
+    if image.isNull() or max(image.width(), image.height()) < size:
+        return None
+
+    # some cameras add black bars to the thumbnail, so only use it if
+    # the aspect ratio matches the image
+    original = QImageReader(file).size()
+    if not original.isValid():
+        return None
+    if (
+        abs(image.width() / image.height() - original.width() / original.height())
+        > 0.02
+    ):
+        return None
+
+    return fit_image(image, size)
+
+
+def load_image(
+    uri: str, keys: list[str], size: int, photos_path: Path
+) -> QImage | None:
+    """Load the thumbnail level for `size`, create and save it if needed.
+
+    All levels get created from the same decoded image, only the
+    smallest level can also come from the EXIF preview. Only uses
+    QImage (and not QPixmap), so that it can run in worker threads.
+    """
+    filepath = Path(uri)
+    level = pick_level(size)
+
+    if not filepath.is_file():
+        print(f"[ERROR] cannot find file {filepath}")
+        return
+
+    file = str(filepath)
+
+    if keys:
+        image = load_thumbnail(keys, level, photos_path)
+        if image is not None:
+            return image
+
+    if filepath.suffix.lower() in config.PHOTO_SUFFIX:
+        orientation = get_orientation(file)
+        image = None
+        if level == LEVELS[0]:
+            image = read_exif_thumbnail(file, level)
+        if image is not None:
+            images = {level: rotate_pixmap(image, orientation)}
+        else:
+            image = read_image(file, LEVELS[-1])
+            if image.isNull():
+                return None
+            images = make_levels(rotate_pixmap(image, orientation), LEVELS)
+    elif filepath.suffix.lower() in config.VIDEO_SUFFIX:
+        cap = cv2.VideoCapture(file)
+
+        time = 1  # in s
+
+        # Set the position of the frame to capture
+        cap.set(cv2.CAP_PROP_POS_MSEC, time * 1000)
+
+        success, frame = cap.read()
+
+        # Release the video capture object
+        cap.release()
+
+        if not success:
+            print(f"[ERROR] {filepath} don't know how to create thumbnail.")
+            print(f"        Failed to capture frame at {time} seconds.")
+            return None
+
+        # Convert the frame to a QImage, rgbSwapped creates a copy of the data
+        height, width, channel = frame.shape
+        bytes_per_line = 3 * width
+        image = QImage(
+            frame.data, width, height, bytes_per_line, QImage.Format_RGB888
+        ).rgbSwapped()
+        images = make_levels(image, LEVELS)
+
+    else:
+        print(f"[ERROR] {filepath} don't know how to create thumbnail.")
+        return
+
+    if keys:
+        save_thumbnail(images, keys[0])
+    return images[level]
+
+
+def fit_size(size: QSize, width: int, height: int) -> QSize:
+    """Scale a size down to fit into width x height, keeping the aspect ratio."""
+    if size.width() <= width and size.height() <= height:
+        return size
+    return size.scaled(width, height, Qt.KeepAspectRatio)
+
+
+def read_data(data: bytes, width: int, height: int) -> QImage:
+    """Decode an image from memory, scaled down by the decoder to fit."""
+    buffer = QBuffer()
+    buffer.setData(data)
+    buffer.open(QIODevice.ReadOnly)
+    reader = QImageReader(buffer)
+    size = reader.size()
+    if size.isValid():
+        reader.setScaledSize(fit_size(size, width, height))
+    return reader.read()
+
+
+def load_display_image(
+    uri: str, keys: list[str], width: int, height: int
+) -> QImage | None:
+    """Load a photo scaled to fit into width x height (in device pixels).
+
+    The first time a photo is shown, it gets decoded at DISPLAY_LEVEL
+    and stored in the thumbnail store. Afterwards it only needs to be
+    decoded from there, which is much faster than decoding the
+    original. For screens larger than DISPLAY_LEVEL, the original is
+    always used. Only uses QImage, so that it can run in worker threads.
+    """
+    store = thumbnail_store.store
+    use_store = bool(keys) and max(width, height) <= DISPLAY_LEVEL
+
+    if use_store:
+        data = store.get(keys[0], DISPLAY_LEVEL)
+        if data is not None:
+            image = read_data(data, width, height)
+            if not image.isNull():
+                return image
+
+    file = str(uri)
+    image = read_image(file, max(width, height, DISPLAY_LEVEL))
+    if image.isNull():
+        return None
+    image = rotate_pixmap(image, get_orientation(file))
+
+    if use_store:
+        store.put_display(keys[0], encode_image(image))
+
+    size = fit_size(image.size(), width, height)
+    if size == image.size():
+        return image
+    return image.scaled(size, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+
+def tile_level(zoom: float) -> int:
+    """Largest level whose tiles still have enough pixels for zoom."""
+    for level in reversed(TILE_LEVELS):
+        if 1 / level >= zoom:
+            return level
+    return TILE_LEVELS[0]
+
+
+def read_band(file: str, level: int, row: int) -> dict[tuple[int, int], QImage]:
+    """Decode a row of tiles of a photo scaled by 1/level.
+
+    The tiles are in the orientation of the file (without EXIF
+    rotation). Decoders that can clip (e.g. JPEG) only decode the
+    band of the row, though they still need to read all rows above
+    it. For other formats the whole image gets decoded, so we return
+    the tiles of all rows, the ones closest to `row` last. Returns
+    {(row, col): QImage}.
+    """
+    reader = QImageReader(file)
+    reader.setAutoTransform(False)
+    original = reader.size()
+    if not original.isValid():
+        return {}
+    # same rounding as libjpeg
+    size = QSize(-(-original.width() // level), -(-original.height() // level))
+
+    option = (
+        QImageIOHandler.ImageOption.ClipRect
+        if level == 1
+        else QImageIOHandler.ImageOption.ScaledClipRect
+    )
+    if level > 1:
+        reader.setScaledSize(size)
+    if reader.supportsOption(option):
+        band = QRect(0, row * TILE_SIZE, size.width(), TILE_SIZE).intersected(
+            QRect(QPoint(0, 0), size)
+        )
+        if band.isEmpty():
+            return {}
+        if level == 1:
+            reader.setClipRect(band)
+        else:
+            reader.setScaledClipRect(band)
+        bands = {row: reader.read()}
+    else:
+        image = reader.read()
+        rows = sorted(
+            range(-(-image.height() // TILE_SIZE)), key=lambda r: -abs(r - row)
+        )
+        # the last row and column are smaller, copying a full tile
+        # would pad them with black
+        bands = {
+            r: image.copy(
+                0,
+                r * TILE_SIZE,
+                image.width(),
+                min(TILE_SIZE, image.height() - r * TILE_SIZE),
+            )
+            for r in rows
+        }
+
+    tiles = {}
+    for r, band in bands.items():
+        if band.isNull():
+            continue
+        for col in range(-(-band.width() // TILE_SIZE)):
+            width = min(TILE_SIZE, band.width() - col * TILE_SIZE)
+            tiles[(r, col)] = band.copy(col * TILE_SIZE, 0, width, band.height())
+    return tiles
+
+
+def load_pixmap(item: Item, size: int, photos_path: Path):
+    """Load a thumbnail right away, shares the cache with the thumbnail loader."""
+    key = (item.uri, pick_level(size))
+    try:
+        return image_cache.thumbnails[key]
+    except KeyError:
+        pass
+    image = load_image(item.uri, thumbnail_keys(item), size, photos_path)
+    pixmap = None if image is None else QPixmap.fromImage(image)
+    image_cache.thumbnails[key] = pixmap
+    return pixmap
+
+
+def load_sprite(item: Item) -> QPixmap | None:
+    """Load the preview strip of a video, see `video.create_sprite`."""
+    keys = thumbnail_keys(item)
+    if not keys:
+        return None
+    key = (item.uri, SPRITE_LEVEL)
+    try:
+        return image_cache.thumbnails[key]
+    except KeyError:
+        pass
+    # not cached if missing, the strip could still get created
+    data = thumbnail_store.store.get(keys[0], SPRITE_LEVEL)
+    if data is None:
+        return None
+    image = QImage.fromData(data)
+    if image.isNull():
+        return None
+    pixmap = QPixmap.fromImage(image)
+    image_cache.thumbnails[key] = pixmap
+    return pixmap
+
+
+def rotate_pixmap(pixmap, orientation):
+    """Rotate a QPixmap or QImage according to the EXIF orientation."""
+    transform = QTransform()
+    if orientation in ROTATION_ANGLES:
+        transform.rotate(ROTATION_ANGLES[orientation])
+    return pixmap.transformed(transform, Qt.SmoothTransformation)
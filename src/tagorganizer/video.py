@@ -0,0 +1,109 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from .helper import read_creation_time
+from .models import Item
+from .thumbnail_store import JPEG_QUALITY, fit
+
+# number of frames in the preview strip of a video and their size
+# (longest side)
+SPRITE_FRAMES = 8
+SPRITE_SIZE = 256
+
+
+@dataclass
+class VideoInfo:
+    """Properties of a video from its container."""
+
+    duration: float | None
+    width: int
+    height: int
+    fps: float | None
+    created: datetime | None
+
+    def apply(self, item: Item) -> None:
+        item.duration = self.duration
+        item.width = self.width
+        item.height = self.height
+        item.fps = self.fps
+        if item.date is None:
+            item.date = self.created
+
+
+def probe_video(cap: cv2.VideoCapture, file: str) -> VideoInfo | None:
+    """Read the properties of an opened video, None if it cannot be read."""
+    if not cap.isOpened():
+        return None
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if not width or not height:
+        return None
+    fps = cap.get(cv2.CAP_PROP_FPS) or None
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    duration = frames / fps if fps and frames > 0 else None
+    return VideoInfo(duration, width, height, fps, read_creation_time(Path(file)))
+
+
+def create_sprite(cap: cv2.VideoCapture, duration: float | None) -> bytes | None:
+    """Create a strip of SPRITE_FRAMES evenly spaced frames as JPEG.
+
+    Frames that cannot be read are replaced by the previous one, so
+    the strip always has the same number of frames.
+    """
+    if not duration:
+        return None
+    frames = []
+    for i in range(SPRITE_FRAMES):
+        cap.set(cv2.CAP_PROP_POS_MSEC, duration * 1000 * (i + 0.5) / SPRITE_FRAMES)
+        success, frame = cap.read()
+        if success:
+            frames.append(fit(frame, SPRITE_SIZE))
+        elif frames:
+            frames.append(frames[-1])
+    if not frames:
+        return None
+    frames = [frames[0]] * (SPRITE_FRAMES - len(frames)) + frames
+    success, data = cv2.imencode(
+        ".jpg", np.hstack(frames), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY]
+    )
+    return data.tobytes() if success else None
+
+
+def probe_videos(
+    files: list[tuple[str, bool]],
+) -> list[tuple[VideoInfo | None, bytes | None]]:
+    """Probe several (file, with_sprite) (used in the process pool)."""
+    result = []
+    for file, with_sprite in files:
+        cap = cv2.VideoCapture(file)
+        try:
+            info = probe_video(cap, file)
+            sprite = create_sprite(cap, info.duration) if info and with_sprite else None
+        finally:
+            cap.release()
+        result.append((info, sprite))
+    return result
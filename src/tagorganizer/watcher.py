@@ -0,0 +1,370 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import ctypes
+import ctypes.util
+import os
+from pathlib import Path
+import struct
+import sys
+
+from qtpy.QtCore import QObject, QSocketNotifier, QTimer
+
+from . import db
+from . import config
+from . import image_cache
+from .scan import find_files
+from .helper import calculate_md5
+from .thumbnail_store import get_skip_dirs, keep_thumbnail
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal ctypes wrapper around the Linux inotify API."""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        # watch descriptor -> directory
+        self.watches = {}
+
+    def add_watch(self, path: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"cannot watch {path}: {os.strerror(errno)}")
+        self.watches[wd] = path
+
+    def rename_watches(self, old: str, new: str) -> None:
+        """Update our paths after a watched directory got renamed."""
+        prefix = os.path.join(old, "")
+        for wd, path in self.watches.items():
+            if path == old:
+                self.watches[wd] = new
+            elif path.startswith(prefix):
+                self.watches[wd] = os.path.join(new, path[len(prefix) :])
+
+    def read(self) -> list[tuple[str, int, int, str]]:
+        """Return all pending events as (directory, mask, cookie, name)."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                events.append((self.watches.get(wd, ""), mask, cookie, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+        self.watches = {}
+
+
+class LibraryWatcher(QObject):
+    """Watch the photo and video directories for new or removed files.
+
+    Uses inotify on Linux and falls back to polling the mtimes of all
+    directories otherwise. Changes are collected until nothing happened
+    for a few seconds and then handled in one go: new files get added
+    to the db, vanished files are marked as missing, files moved inside
+    the watched directories keep their tags, and timestamps, locations,
+    hashes and thumbnails get updated for just the new items.
+    """
+
+    def __init__(self, main, debounce: int = 2000, poll_interval: int = 10_000):
+        super().__init__()
+        self.main = main
+
+        self.roots = []
+        # the old thumbnail dir inside the photo dir
+        self.skip = frozenset()
+        self.inotify = None
+        self.notifier = None
+        self.dir_mtimes = {}
+
+        self.added = set()
+        self.removed = set()
+        self.removed_dirs = set()
+        self.moved = {}
+        self.moved_dirs = {}
+        # cookie -> (path, is_dir) for moves where we only saw the first half
+        self.pending_moves = {}
+
+        self.debounce = QTimer()
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(debounce)
+        self.debounce.timeout.connect(self.flush)
+
+        self.poll_timer = QTimer()
+        self.poll_timer.setInterval(poll_interval)
+        self.poll_timer.timeout.connect(self.poll)
+
+    def start(self, roots: list[Path]) -> None:
+        self.stop()
+        self.roots = [str(r) for r in dict.fromkeys(roots) if Path(r).is_dir()]
+        self.skip = get_skip_dirs(self.main.config.photos)
+
+        try:
+            self.inotify = Inotify()
+        except OSError as e:
+            self.main.messages.add(f"Watcher: using polling, no inotify ({e})")
+            self.inotify = None
+
+        if self.inotify:
+            for root in self.roots:
+                self.watch_tree(root)
+            self.notifier = QSocketNotifier(
+                self.inotify.fd, QSocketNotifier.Type.Read, self
+            )
+            self.notifier.activated.connect(self.read_events)
+        else:
+            for root in self.roots:
+                self.dir_mtimes.update(self.get_dir_mtimes(root))
+            self.poll_timer.start()
+
+        self.main.messages.add(f"Watcher: watching {', '.join(self.roots)}")
+
+    def stop(self) -> None:
+        self.debounce.stop()
+        self.poll_timer.stop()
+        if self.notifier:
+            self.notifier.setEnabled(False)
+            self.notifier.deleteLater()
+            self.notifier = None
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+        self.dir_mtimes = {}
+        self.pending_moves = {}
+
+    def watch_tree(self, root: str) -> None:
+        """Add watches for a directory and all its subdirectories."""
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                self.inotify.add_watch(path)
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.skip:
+                                stack.append(entry.path)
+            except OSError as e:
+                self.main.messages.add(f"[Error] Watcher: {e}")
+
+    def read_events(self) -> None:
+        for directory, mask, cookie, name in self.inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                self.main.messages.add(
+                    "[Error] Watcher: too many changes, run 'Check for Files in Default Dirs'"
+                )
+                continue
+            path = os.path.join(directory, name)
+            if path in self.skip:
+                continue
+            is_dir = bool(mask & IN_ISDIR)
+
+            if mask & IN_MOVED_FROM:
+                self.pending_moves[cookie] = (path, is_dir)
+            elif mask & IN_MOVED_TO:
+                old, _ = self.pending_moves.pop(cookie, (None, None))
+                if is_dir:
+                    if old:
+                        self.inotify.rename_watches(old, path)
+                        self.moved_dirs[old] = path
+                    else:
+                        self.watch_tree(path)
+                        self.added.update(
+                            find_files(path, config.ALL_SUFFIX_SET, self.skip)
+                        )
+                elif old:
+                    self.moved[old] = path
+                else:
+                    self.added.add(path)
+            elif is_dir and mask & IN_CREATE:
+                # files might have been created before we started watching
+                self.watch_tree(path)
+                self.added.update(find_files(path, config.ALL_SUFFIX_SET, self.skip))
+            elif mask & IN_CLOSE_WRITE:
+                self.added.add(path)
+            elif mask & IN_DELETE and not is_dir:
+                self.removed.add(path)
+
+        self.debounce.start()
+
+    def get_dir_mtimes(self, root: str) -> dict[str, int]:
+        """Return the mtime of a directory and all its subdirectories."""
+        mtimes = {}
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.path not in self.skip:
+                                stack.append(entry.path)
+            except OSError:
+                continue
+        return mtimes
+
+    def poll(self) -> None:
+        """Compare directory mtimes and only look at the changed directories."""
+        mtimes = {}
+        for root in self.roots:
+            mtimes.update(self.get_dir_mtimes(root))
+
+        changed = [d for d, m in mtimes.items() if self.dir_mtimes.get(d) != m]
+        vanished = [d for d in self.dir_mtimes if d not in mtimes]
+        self.removed_dirs.update(vanished)
+        self.dir_mtimes = mtimes
+
+        for directory in changed:
+            try:
+                with os.scandir(directory) as entries:
+                    on_disk = {e.path for e in entries if e.is_file()}
+            except OSError:
+                continue
+            known = {
+                uri
+                for uri in db.get_known_files(directory)
+                if os.path.dirname(uri) == directory
+            }
+            self.added.update(on_disk - known)
+            self.removed.update(known - on_disk)
+
+        if changed or vanished:
+            self.debounce.start()
+
+    def flush(self) -> None:
+        # moves out of the watched directories
+        for path, is_dir in self.pending_moves.values():
+            if is_dir:
+                self.removed_dirs.add(path)
+            else:
+                self.removed.add(path)
+        self.pending_moves = {}
+
+        def is_media(path: str) -> bool:
+            return os.path.splitext(path)[1].lower() in config.ALL_SUFFIX_SET
+
+        # keep tags, etc. for items that got moved
+        moved = 0
+        for old, new in self.moved_dirs.items():
+            moved += self.move_items(db.get_items_in_dir(old), old, new)
+        for old, new in self.moved.items():
+            items = db.get_items_by_uris([old])
+            if items:
+                moved += self.move_items(items, old, new)
+            else:
+                self.added.add(new)
+
+        removed = {p for p in self.removed if is_media(p)}
+        for directory in self.removed_dirs:
+            removed.update(db.get_known_files(Path(directory)))
+        removed = {p for p in removed if not os.path.exists(p)}
+
+        # a file that vanished and showed up somewhere else is a move
+        # as well, e.g. when polling. We can only tell for items that
+        # have a stat fingerprint.
+        if removed and self.added:
+            inodes = {
+                (item.device, item.inode): item
+                for item in db.get_items_by_uris(sorted(removed))
+                if item.inode is not None
+            }
+            for path in sorted(self.added):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                item = inodes.pop((stat.st_dev, stat.st_ino), None)
+                if item is not None:
+                    removed.discard(item.uri)
+                    self.added.discard(path)
+                    moved += self.move_items([item], item.uri, path)
+
+        missing = db.set_missing(sorted(removed)) if removed else 0
+        image_cache.invalidate(removed)
+
+        added = sorted(p for p in self.added if is_media(p) and os.path.isfile(p))
+        new = db.add_images(added) if added else 0
+
+        self.added = set()
+        self.removed = set()
+        self.removed_dirs = set()
+        self.moved = {}
+        self.moved_dirs = {}
+
+        if not (new or missing or moved):
+            return
+
+        self.main.messages.add(
+            f"Watcher: {new} new, {missing} missing, {moved} moved items"
+        )
+        if added:
+            self.main.tasks.update_new_items(db.get_items_by_uris(added))
+        self.main.update_items()
+
+    def move_items(self, items, old: str, new: str) -> int:
+        """Replace the path prefix old by new for all items."""
+        image_cache.invalidate(item.uri for item in items)
+        for item in items:
+            old_md5 = item.uri_md5
+            item.uri = new + item.uri[len(old) :]
+            item.uri_md5 = calculate_md5(item.uri)
+            item.missing = False
+            keep_thumbnail(item, old_md5, self.main.config.photos)
+        db.update_items_in_db(items)
+        return len(items)
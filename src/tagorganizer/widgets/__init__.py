@@ -8,3 +8,5 @@ from .tag_bar import TagBar, RESERVED_TAGS  # noqa: F401
 from .delete_confirmation_dialog import DeleteConfirmationDialog  # noqa: F401
 from .tag_view import TagView  # noqa: F401
 from .messages import Messages  # noqa: F401
+from .task_dialog import TaskDialog  # noqa: F401
+from .task_manager import TimerTaskManager  # noqa: F401
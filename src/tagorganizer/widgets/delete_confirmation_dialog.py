@@ -29,7 +29,7 @@ from qtpy.QtWidgets import (
     QWidget,
 )
 
-from .helper import load_pixmap
+from ..thumbnails import load_pixmap
 
 
 class DeleteConfirmationDialog(QDialog):
@@ -53,7 +53,7 @@ class DeleteConfirmationDialog(QDialog):
 
         for item in self.items:
             label = QLabel()
-            pixmap = load_pixmap(item, size=80, photos_dir=self.main.config.photos)
+            pixmap = load_pixmap(item, size=80, photos_path=self.main.config.photos)
             label.setPixmap(pixmap)
             label.setToolTip(item.uri)
             scroll_layout.addWidget(label)
@@ -18,146 +18,34 @@ along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
 
 """
 
-from functools import lru_cache
-import hashlib
-from pathlib import Path
-import sys
-
 from qtpy.QtWidgets import QCompleter
-from qtpy.QtGui import QPixmap, QTransform, QImage
-from qtpy.QtCore import Qt
-
-import exifread as exif
-import cv2
-import xxhash
+from qtpy.QtGui import QPixmap
+from qtpy.QtCore import QSize, Qt
 
-from .. import config
+from .. import image_cache
 from ..models import Item
-
-
-def get_thumbnail_path(photos_path: Path) -> Path:
-    if sys.platform.startswith("linux"):
-        return Path.home() / ".cache" / "thumbnails" / "large"
-    else:
-        return photos_path / "thumbnails"
-
-
-def save_thumbnail(pixmap: QPixmap, md5: str, photos_path: Path) -> None:
-    thumbnail_path = get_thumbnail_path(photos_path)
-    if sys.platform.startswith("linux"):
-        thumbnail = thumbnail_path / f"{md5}.png"
-    else:
-        md5_dir = md5[:2]
-        md5_file = md5[2:]
-        thumbnail = thumbnail_path / md5_dir / f"{md5_file}.png"
-    thumbnail.parent.mkdir(parents=True, exist_ok=True)
-    pixmap.save(str(thumbnail), "PNG")
-
-
-@lru_cache(1_000)
-def load_pixmap(item: Item, size: int, photos_path: Path):
-    filepath = Path(item.uri)
-
-    if not filepath.is_file():
-        print(f"[ERROR] cannot find file {filepath}")
-        return
-
-    file = str(filepath)
-
-    if item.uri_md5:
-        thumbnail_path = get_thumbnail_path(photos_path)
-        if sys.platform.startswith("linux"):
-            thumbnail = thumbnail_path / f"{item.uri_md5}.png"
-        else:
-            md5_dir = item.uri_md5[:2]
-            md5_file = item.uri_md5[2:]
-            thumbnail = thumbnail_path / md5_dir / f"{md5_file}.png"
-        if thumbnail.is_file():
-            return QPixmap(str(thumbnail))
-
-    if filepath.suffix.lower() in config.PHOTO_SUFFIX:
-        pixmap = QPixmap(file)
-        pixmap = pixmap.scaledToWidth(size, Qt.SmoothTransformation)
-        orientation = get_orientation(file)
-        pixmap = rotate_pixmap(pixmap, orientation)
-    elif filepath.suffix.lower() in config.VIDEO_SUFFIX:
-        cap = cv2.VideoCapture(file)
-
-        time = 1  # in s
-
-        # Set the position of the frame to capture
-        cap.set(cv2.CAP_PROP_POS_MSEC, time * 1000)
-
-        success, frame = cap.read()
-
-        if not success:
-            print(f"[ERROR] {filepath} don't know how to create thumbnail.")
-            print(f"        Failed to capture frame at {time} seconds.")
-            cap.release()
-            return None
-
-        # Convert the frame to a QImage
-        height, width, channel = frame.shape
-        bytes_per_line = 3 * width
-        q_image = QImage(
-            frame.data, width, height, bytes_per_line, QImage.Format_RGB888
-        ).rgbSwapped()
-
-        # Convert the QImage to a QPixmap
-        pixmap = QPixmap.fromImage(q_image)
-
-        # Release the video capture object
-        cap.release()
-
-    else:
-        print(f"[ERROR] {filepath} don't know how to create thumbnail.")
-        return
-
-    if item.uri_md5:
-        save_thumbnail(pixmap, item.uri_md5, photos_path)
-    return pixmap
-
-
-@lru_cache(100)
-def load_full_pixmap(file):
-    pixmap = QPixmap(file)
-    orientation = get_orientation(file)
-    pixmap = rotate_pixmap(pixmap, orientation)
-
+from ..thumbnail_store import thumbnail_keys
+from ..thumbnails import load_display_image
+
+
+def load_display_pixmap(item: Item, size: QSize) -> QPixmap | None:
+    """Load a photo that fits into size (in device pixels).
+
+    Cached in `image_cache.images`, see `load_display_image`.
+    """
+    key = (item.uri, size.width(), size.height())
+    try:
+        return image_cache.images[key]
+    except KeyError:
+        pass
+    image = load_display_image(
+        item.uri, thumbnail_keys(item), size.width(), size.height()
+    )
+    pixmap = None if image is None else QPixmap.fromImage(image)
+    image_cache.images[key] = pixmap
     return pixmap
 
 
-@lru_cache(1_000)
-def load_exif(file):
-    file = Path(file)
-    if not file.is_file():
-        return {}
-    with file.open("rb") as f:
-        tags = exif.process_file(f)
-        return tags
-
-
-def get_orientation(file):
-    tags = load_exif(file)
-    orientation_tag = "Image Orientation"
-    if orientation_tag in tags:
-        orientation = tags[orientation_tag].values[0]
-    else:
-        orientation = 1  # Default to normal orientation if tag is not found
-    return orientation
-
-
-def rotate_pixmap(pixmap, orientation):
-    transform = QTransform()
-    if orientation == 3:
-        transform.rotate(180)
-    elif orientation == 6:
-        transform.rotate(90)
-    elif orientation == 8:
-        transform.rotate(-90)
-    return pixmap.transformed(transform, Qt.SmoothTransformation)
-
-
 class CommaCompleter(QCompleter):
     def __init__(self, model, parent=None):
         super().__init__(model, parent)
@@ -165,23 +53,3 @@ class CommaCompleter(QCompleter):
 
     def splitPath(self, path: str) -> list[str]:
         return [path.split(",")[-1].strip()]
-
-
-def calculate_md5(input_string: str) -> str:
-    md5_hash = hashlib.md5()
-    md5_hash.update(input_string.encode("utf-8"))
-    md5_hex = md5_hash.hexdigest()
-
-    return md5_hex
-
-
-def calculate_xxhash(file_path: Path) -> str:
-    hasher = xxhash.xxh128()
-
-    with open(file_path, "rb") as file:
-        for chunk in iter(lambda: file.read(4096), b""):
-            hasher.update(chunk)
-
-    xxhash_hex = hasher.hexdigest()
-
-    return xxhash_hex
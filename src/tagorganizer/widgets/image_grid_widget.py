@@ -18,52 +18,210 @@ along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
 
 """
 
+from collections import OrderedDict
 from functools import wraps
-import time
+from pathlib import Path
+
+from qtpy.QtWidgets import QAbstractItemView, QListView, QStyledItemDelegate
+from qtpy.QtGui import QColor, QPainter, QPen
+from qtpy.QtCore import (
+    QAbstractListModel,
+    QModelIndex,
+    QPoint,
+    QRect,
+    QSize,
+    Qt,
+)
+
+from .prefetcher import Prefetcher
+from .thumbnail_loader import ThumbnailLoader
+from .. import config
+from .. import db
+from ..models import Item
+from ..thumbnails import load_sprite
+from ..video import SPRITE_FRAMES
 
-from qtpy.QtWidgets import QWidget, QGridLayout
-from qtpy.QtCore import QTimer
+# shown until the thumbnail is loaded
+PLACEHOLDER = QColor(220, 220, 220)
+# space between the thumbnails
+MARGIN = 3
+
+ITEM_ROLE = Qt.UserRole
+
+# items are loaded from the db in chunks of rows, the last MAX_CHUNKS
+# chunks are kept
+CHUNK_SIZE = 256
+MAX_CHUNKS = 64
 
-from .framed_label import FramedLabel
-from .helper import load_pixmap, load_full_pixmap
-from .. import db
 
+class ItemModel(QAbstractListModel):
+    """All items of the view, from a snapshot of their ids.
+
+    The ids come from `db.get_item_ids`, only the items around the
+    rows that are shown get loaded from the db (see `item`).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ids = []
+        # chunk number -> list of Item (None for items deleted since
+        # the snapshot was taken)
+        self.chunks = OrderedDict()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ids)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == ITEM_ROLE:
+            return self.item(index.row())
+        return None
+
+    def set_ids(self, ids: list[int]):
+        self.beginResetModel()
+        self.ids = ids
+        self.chunks.clear()
+        self.endResetModel()
+
+    def item(self, row: int) -> Item | None:
+        if not 0 <= row < len(self.ids):
+            return None
+        n = row // CHUNK_SIZE
+        chunk = self.chunks.get(n)
+        if chunk is None:
+            ids = self.ids[n * CHUNK_SIZE : (n + 1) * CHUNK_SIZE]
+            items = {item.id: item for item in db.get_items_by_ids(ids)}
+            chunk = [items.get(id) for id in ids]
+            self.chunks[n] = chunk
+            if len(self.chunks) > MAX_CHUNKS:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end(n)
+        return chunk[row % CHUNK_SIZE]
+
+
+class ThumbnailDelegate(QStyledItemDelegate):
+    """Paint a thumbnail with blue (selected) and red (current) frames.
+
+    The thumbnail level (see `pick_level`) fits the size of the tiles
+    and gets scaled while painting. Until it is loaded, a placeholder
+    is shown. For the video under the mouse, the frame of its preview
+    strip (see `video.create_sprite`) at the mouse position is shown.
+    """
+
+    def __init__(self, grid):
+        super().__init__(grid)
+        self.grid = grid
+
+    def sizeHint(self, option, index):
+        return self.grid.gridSize()
+
+    def paint(self, painter, option, index):
+        grid = self.grid
+        row = index.row()
+        item = index.data(ITEM_ROLE)
+        rect = option.rect.adjusted(MARGIN, MARGIN, -MARGIN, -MARGIN)
+
+        painter.save()
+        painter.setClipRect(rect)
+        if row == grid.hover_row and grid.frame is not None:
+            width = grid.sprite.width() // SPRITE_FRAMES
+            source = QRect(grid.frame * width, 0, width, grid.sprite.height())
+            self.draw_scaled(painter, rect, grid.sprite, source)
+        else:
+            pixmap = None
+            if item is not None:
+                pixmap = grid.loader.get(
+                    item, grid.thumbnail_size(), grid.main.config.photos
+                )
+            if pixmap is None:
+                painter.fillRect(rect.adjusted(4, 4, -4, -4), PLACEHOLDER)
+            else:
+                self.draw_scaled(painter, rect, pixmap, pixmap.rect())
+        if item is not None and item.id in grid.selected_items:
+            painter.setPen(QPen(Qt.blue, 8))
+            painter.drawRect(rect)
+        if row == grid.highlight:
+            painter.setPen(QPen(Qt.red, 5))
+            painter.drawRect(rect)
+        painter.restore()
+
+    @staticmethod
+    def draw_scaled(painter: QPainter, rect: QRect, pixmap, source: QRect):
+        # let the painter scale the pixmap instead of creating scaled copies
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        target = QRect()
+        target.setSize(source.size().scaled(rect.size(), Qt.KeepAspectRatio))
+        target.moveCenter(rect.center())
+        painter.drawPixmap(target, pixmap, source)
+
+
+class ImageGridWidget(QListView):
+    """Grid of thumbnails of all items in the view.
+
+    Only the visible tiles get painted, so scrolling through large
+    views does not create any widgets. The tiles are `grid_size`
+    pixels (see the profile), stretched to fill the width of the
+    window.
+    """
 
-class ImageGridWidget(QWidget):
     def __init__(self, main):
         super().__init__()
-        self.columns = 5
-        self.rows = 5
-        self.N = self.columns * self.rows
         self.highlight = 0
-        self.page = 0
-        self.selected_items = []
+        # id -> Item
+        self.selected_items = {}
 
         self.main = main
-        self.layout = QGridLayout()
-        self.setLayout(self.layout)
-
-        # we need to keep a reference to the widgets in the grid, otherwise
-        # itemAtPosition will return a QLabel and not a FramedLabel
-        self.widgets = []
 
-        self.preloader = QTimer()
-        self.preloader.timeout.connect(self.preload_items)
-        self.preloader.start(100)
+        self.item_model = ItemModel()
+        self.setModel(self.item_model)
+        self.delegate = ThumbnailDelegate(self)
+        self.setItemDelegate(self.delegate)
+
+        # a wrapping list of tiles with the same size looks like the icon
+        # mode, but the layout does not need to store the position of
+        # every item (twice as fast for large views)
+        self.setFlow(QListView.LeftToRight)
+        self.setWrapping(True)
+        self.setUniformItemSizes(True)
+        self.setResizeMode(QListView.Adjust)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        # the number of columns should not change when the scrollbar shows up
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setGridSize(QSize(config.GRID_SIZE, config.GRID_SIZE))
+
+        # row of the video under the mouse, its preview strip and the
+        # frame we show
+        self.hover_row = None
+        self.sprite = None
+        self.frame = None
+        self.setMouseTracking(True)
+
+        self.loader = ThumbnailLoader(self)
+        self.loader.loaded.connect(self.on_thumbnail_loaded)
+
+        self.prefetcher = Prefetcher(self)
+        self.scroll_position = 0
+        # scrolling to the current item
+        self.following = False
+        self.verticalScrollBar().valueChanged.connect(self.on_scroll)
 
     @staticmethod
     def change_highlight(func):
         @wraps(func)
         def wrapper(self, *args):
-            if self.widgets:
-                n = self.highlight % self.N
-                n = min(n, len(self.widgets) - 1)
-                self.widgets[n].set_highlight(False)
+            old = self.highlight
+            self.update_row(self.highlight)
             func(self, *args)
-            if self.widgets:
-                n = self.highlight % self.N
-                n = min(n, len(self.widgets) - 1)
-                self.widgets[n].set_highlight(True)
+            self.update_row(self.highlight)
+            self.prefetcher.moved(self.highlight - old)
+            # the move already counted for the prefetcher
+            self.following = True
+            self.scrollTo(self.item_model.index(self.highlight))
+            self.following = False
             # update single item if in view
             if self.main.tabs.currentWidget() == self.main.single_item:
                 self.main.show_current_item()
@@ -71,118 +229,163 @@ class ImageGridWidget(QWidget):
         return wrapper
 
     @change_highlight
-    def show_images(self, items):
-        row = 0
-        col = 0
-
-        self.clear()
-
-        for i, item in enumerate(items):
-            label = FramedLabel(item, self.main.config.photos)
-            if item in self.selected_items:
-                label.selected = True
-            self.widgets.append(label)
-            self.layout.addWidget(label, row, col)
-            col += 1
-            if col >= self.columns:
-                col = 0
-                row += 1
-
-    def clear(self):
-        for row in range(self.layout.rowCount()):
-            for col in range(self.layout.columnCount()):
-                item = self.layout.itemAtPosition(row, col)
-                if item is not None:
-                    widget = item.widget()
-                    if widget is not None:
-                        widget.deleteLater()
-        self.widgets = []
+    def set_ids(self, ids: list[int]):
+        """Show the items with the given ids, see `db.get_item_ids`.
+
+        The current item stays the same if it is still in the view.
+        """
+        current = self.current_item()
+        self.item_model.set_ids(ids)
+        self.clear_hover()
+        self.prefetcher.moves.clear()
+        if current is not None and current.id in ids:
+            self.highlight = ids.index(current.id)
+        else:
+            self.highlight = max(min(self.highlight, len(ids) - 1), 0)
+
+    def update_row(self, row: int):
+        self.viewport().update(self.visualRect(self.item_model.index(row)))
+
+    def columns(self) -> int:
+        return max(self.viewport().width() // self.gridSize().width(), 1)
+
+    def page_size(self) -> int:
+        """Number of items that fit on the screen."""
+        rows = max(self.viewport().height() // self.gridSize().height(), 1)
+        return rows * self.columns()
+
+    def thumbnail_size(self) -> int:
+        """Size of the thumbnails in the grid in device pixels."""
+        return round(self.gridSize().width() * self.devicePixelRatioF())
+
+    def resizeEvent(self, event):
+        size = self.main.config.grid_size
+        width = self.viewport().width()
+        columns = max(width // size, 1)
+        self.setGridSize(QSize(width // columns, width // columns))
+        super().resizeEvent(event)
+        self.prefetcher.schedule()
+
+    def on_scroll(self, position: int):
+        # number of items we scrolled by
+        rows = (position - self.scroll_position) / self.gridSize().height()
+        self.scroll_position = position
+        if self.following:
+            return
+        self.prefetcher.moved(round(rows * self.columns()))
 
-    def clear_selection(self):
-        for row in range(self.layout.rowCount()):
-            for col in range(self.layout.columnCount()):
-                item = self.layout.itemAtPosition(row, col)
-                if item is not None:
-                    widget = item.widget()
-                    if widget.selected:
-                        widget.toggle_selected()
-
-    def current_item(self):
-        if self.widgets:
-            current = self.highlight % len(self.widgets)
-            return self.widgets[current]
+    def on_thumbnail_loaded(self, key, pixmap):
+        self.viewport().update()
 
-    def toggle_selection(self):
-        if self.widgets:
-            widget = self.current_item()
-            widget.toggle_selected()
+    def clear_selection(self):
+        self.selected_items = {}
+        self.viewport().update()
 
-            item = widget.item
+    def selection(self) -> list[Item]:
+        return list(self.selected_items.values())
 
-            if item in self.selected_items:
-                self.selected_items.remove(item)
-            else:
-                self.selected_items.append(item)
-            self.main.update_numbers(selected=len(self.selected_items))
-            self.main.display_common_tags()
+    def current_item(self) -> Item | None:
+        return self.item_model.item(self.highlight)
 
+    def toggle_selection(self):
+        item = self.current_item()
+        if item is None:
             return
 
+        if item.id in self.selected_items:
+            del self.selected_items[item.id]
+        else:
+            self.selected_items[item.id] = item
+        self.update_row(self.highlight)
+        self.main.update_numbers(selected=len(self.selected_items))
+        self.main.display_common_tags()
+
+    @change_highlight
+    def set_highlight(self, row: int):
+        self.highlight = row
+
     @change_highlight
     def move_left(self):
         self.highlight = max(self.highlight - 1, 0)
 
     @change_highlight
     def move_right(self):
-        N = self.main.numbers[2]
+        N = self.item_model.rowCount()
 
-        self.highlight = min(self.highlight + 1, N - 1)
+        self.highlight = max(min(self.highlight + 1, N - 1), 0)
 
     @change_highlight
     def move_up(self):
-        self.highlight = max(self.highlight - self.columns, 0)
+        self.highlight = max(self.highlight - self.columns(), 0)
 
     @change_highlight
     def shift_move_up(self):
-        self.highlight = max(self.highlight - self.N, 0)
+        self.highlight = max(self.highlight - self.page_size(), 0)
 
     @change_highlight
     def move_down(self):
-        N = self.main.numbers[2]
+        N = self.item_model.rowCount()
 
-        self.highlight = min(self.highlight + self.columns, N - 1)
+        self.highlight = max(min(self.highlight + self.columns(), N - 1), 0)
 
     @change_highlight
     def shift_move_down(self):
-        N = self.main.numbers[2]
-
-        self.highlight = min(self.highlight + self.N, N - 1)
-
-    def preload_items(self):
-        start = time.time()
-
-        filters = self.main.tag_bar.get_filters()
-        N = db.get_number_of_items(filters)
-
-        # thumbnails +- 2 pages
-        for i in range(self.page - 2, self.page + 3):
-            if i < 1:
-                continue
-            if i > N // self.N:
-                continue
-            items = db.get_images(i, filters)
-            for item in items:
-                load_pixmap(item, 150, self.main.config.photos)
-                if time.time() - start > 0.1:
-                    return
-
-        # full files +- 5 from current image
-        for i in range(self.highlight - 5, self.highlight + 6):
-            if i < 0:
-                continue
-            if i >= N:
-                continue
-            item = db.get_current_image(i, filters)
-            load_full_pixmap(str(item.uri))
-            if time.time() - start > 0.1:
-                return
+        N = self.item_model.rowCount()
+
+        self.highlight = max(min(self.highlight + self.page_size(), N - 1), 0)
+
+    def mousePressEvent(self, event):
+        index = self.indexAt(event.position().toPoint())
+        if not index.isValid():
+            return
+        self.setFocus()
+        self.set_highlight(index.row())
+        if event.modifiers() & Qt.ControlModifier:
+            self.toggle_selection()
+        else:
+            self.main.display_common_tags()
+
+    def mouseDoubleClickEvent(self, event):
+        index = self.indexAt(event.position().toPoint())
+        if index.isValid():
+            self.main.show_current_item()
+
+    def mouseMoveEvent(self, event):
+        position = event.position().toPoint()
+        index = self.indexAt(position)
+        row = index.row() if index.isValid() else None
+        if row != self.hover_row:
+            self.clear_hover()
+            self.hover_row = row
+            item = self.item_model.item(row) if row is not None else None
+            if (
+                item is not None
+                and Path(item.uri).suffix.lower() in config.VIDEO_SUFFIX
+            ):
+                self.sprite = load_sprite(item)
+        if self.sprite is None:
+            return
+        rect = self.visualRect(index)
+        frame = (position.x() - rect.left()) * SPRITE_FRAMES // max(rect.width(), 1)
+        frame = min(max(frame, 0), SPRITE_FRAMES - 1)
+        if frame != self.frame:
+            self.frame = frame
+            self.update_row(row)
+
+    def leaveEvent(self, event):
+        self.clear_hover()
+        super().leaveEvent(event)
+
+    def clear_hover(self):
+        if self.frame is not None:
+            self.update_row(self.hover_row)
+        self.hover_row = None
+        self.sprite = None
+        self.frame = None
+
+    def visible_rows(self) -> range:
+        first = self.indexAt(QPoint(MARGIN, MARGIN))
+        start = first.row() if first.isValid() else 0
+        # the last row of tiles can be partly visible
+        stop = start + self.page_size() + 2 * self.columns()
+        return range(start, min(stop, self.item_model.rowCount()))
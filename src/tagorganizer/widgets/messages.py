@@ -1,11 +1,84 @@
+import logging
+from collections import deque
+
 from qtpy.QtWidgets import (
-    QTextEdit,
+    QAbstractItemView,
+    QApplication,
+    QListView,
     QVBoxLayout,
     QPushButton,
     QWidget,
 )
-from qtpy.QtGui import QColor
-from qtpy.QtCore import Qt
+from qtpy.QtGui import QColor, QKeySequence, QShortcut
+from qtpy.QtCore import QAbstractListModel, QModelIndex, Qt, QTimer
+
+from ..helper import logger, message_level
+
+# number of messages we keep, older ones get dropped
+MAX_MESSAGES = 10_000
+
+# ms to collect new messages before we show them
+FLUSH_INTERVAL = 50
+
+COLORS = {
+    logging.ERROR: QColor(Qt.red),
+    logging.WARNING: QColor("darkorange"),
+}
+
+
+class MessageModel(QAbstractListModel):
+    """The last MAX_MESSAGES messages as (level, text).
+
+    New messages are collected in `pending` and added to the view in
+    one go by `flush`, so that a task that creates thousands of
+    messages does not update the view for each of them.
+    """
+
+    def __init__(self, max_messages: int = MAX_MESSAGES):
+        super().__init__()
+        self.messages = deque(maxlen=max_messages)
+        self.pending = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.messages)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        level, text = self.messages[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == Qt.ForegroundRole:
+            return COLORS.get(level)
+        return None
+
+    def flush(self) -> bool:
+        """Add the pending messages, returns False if there were none."""
+        if not self.pending:
+            return False
+        new = self.pending[-self.messages.maxlen :]
+        self.pending = []
+
+        overflow = min(
+            len(self.messages) + len(new) - self.messages.maxlen, len(self.messages)
+        )
+        if overflow > 0:
+            self.beginRemoveRows(QModelIndex(), 0, overflow - 1)
+            for _ in range(overflow):
+                self.messages.popleft()
+            self.endRemoveRows()
+
+        first = len(self.messages)
+        self.beginInsertRows(QModelIndex(), first, first + len(new) - 1)
+        self.messages.extend(new)
+        self.endInsertRows()
+        return True
+
+    def clear(self):
+        self.beginResetModel()
+        self.messages.clear()
+        self.pending = []
+        self.endResetModel()
 
 
 class Messages(QWidget):
@@ -13,29 +86,61 @@ class Messages(QWidget):
         super().__init__()
         self.main = main
 
-        self.text_edit = QTextEdit(self)
-        self.text_edit.setReadOnly(True)
+        self.model = MessageModel()
+        self.view = QListView(self)
+        self.view.setModel(self.model)
+        # all rows have the same height, so the view does not need to
+        # measure them
+        self.view.setUniformItemSizes(True)
+        self.view.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        copy = QShortcut(QKeySequence.Copy, self.view)
+        copy.activated.connect(self.copy_selection)
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(FLUSH_INTERVAL)
+        self.timer.timeout.connect(self.flush)
 
         self.clear_button = QPushButton("Clear", self)
         self.clear_button.clicked.connect(self.clear_messages)
 
         layout = QVBoxLayout()
-        layout.addWidget(self.text_edit)
+        layout.addWidget(self.view)
         layout.addWidget(self.clear_button)
         self.setLayout(layout)
 
     def clear_messages(self):
-        self.text_edit.clear()
+        self.model.clear()
+
+    def add(self, message: str, level: int | None = None):
+        """Add a message, it gets shown with the next flush."""
+        if level is None:
+            level = message_level(message)
+        logger.log(level, message)
+        self.model.pending.append((level, message))
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        """Show the new messages and highlight the tab if it's not active."""
+        scrollbar = self.view.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        if not self.model.flush():
+            return
+        if at_bottom:
+            self.view.scrollToBottom()
 
-    def add(self, message):
-        """Add a message to the QTextEdit and highlight the tab if it's not active."""
-        self.text_edit.append(message)
         current_index = self.main.tabs.currentIndex()
         tab_index = self.main.tabs.indexOf(self.main.messages)
 
         if current_index != tab_index:
             self.main.tabs.tabBar().setTabTextColor(tab_index, QColor(Qt.red))
 
+    def copy_selection(self):
+        rows = sorted(index.row() for index in self.view.selectedIndexes())
+        text = "\n".join(self.model.messages[row][1] for row in rows)
+        QApplication.clipboard().setText(text)
+
     def reset_tab_color(self):
         """Reset the tab color to default."""
         tab_index = self.main.tabs.indexOf(self.main.messages)
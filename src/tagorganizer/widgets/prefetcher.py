@@ -0,0 +1,158 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from collections import deque
+from pathlib import Path
+import time
+
+from qtpy.QtCore import QObject, QTimer
+
+from .. import config
+from .. import image_cache
+from ..thumbnail_store import pick_level
+from .thumbnail_loader import PRELOAD
+
+# ms to wait for more events before we prefetch
+DELAY = 50
+# moves in the last VELOCITY_WINDOW seconds predict where we go next
+VELOCITY_WINDOW = 1.0
+# prefetch the thumbnails we reach in LOOKAHEAD seconds
+LOOKAHEAD = 2.0
+# screens of thumbnails to prefetch, more in the direction we move
+SCREENS_AHEAD = 3
+SCREENS_BEHIND = 1
+SCREENS_IDLE = 2
+MAX_SCREENS = 10
+# photos for the single item view around the current item
+DISPLAY_AHEAD = 8
+DISPLAY_BEHIND = 2
+DISPLAY_IDLE = 5
+
+
+class Prefetcher(QObject):
+    """Load thumbnails and photos the user will probably look at next.
+
+    Runs only after the view, the current item or the scroll position
+    changed (see `schedule`), so an idle program does not use any cpu.
+    All decodes are submitted to the thread pool of the grid's
+    `ThumbnailLoader` in the order we expect them to be needed, and
+    everything that is not needed anymore gets cancelled. Once all
+    images around the visible ones are cached, nothing is submitted.
+
+    The velocity of recent moves (cursor keys or scrolling) decides
+    whether we prefetch more items after or before the visible ones,
+    and how far ahead.
+    """
+
+    def __init__(self, grid):
+        super().__init__(grid)
+        self.grid = grid
+        # (time, number of items moved), negative for moves back
+        self.moves = deque()
+
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(DELAY)
+        self.timer.timeout.connect(self.prefetch)
+
+    def moved(self, delta: int):
+        """Record a move by delta items and prefetch after it."""
+        if delta:
+            self.moves.append((time.monotonic(), delta))
+        self.schedule()
+
+    def schedule(self):
+        """Prefetch once there were no events for DELAY ms."""
+        self.timer.start()
+
+    def velocity(self) -> float:
+        """Items per second moved recently, negative when moving back."""
+        now = time.monotonic()
+        while self.moves and now - self.moves[0][0] > VELOCITY_WINDOW:
+            self.moves.popleft()
+        return sum(delta for _, delta in self.moves) / VELOCITY_WINDOW
+
+    @staticmethod
+    def around(start: int, stop: int, after: int, before: int) -> list[int]:
+        """Rows after and before start:stop, closest first."""
+        rows = []
+        for offset in range(max(after, before)):
+            if offset < after:
+                rows.append(stop + offset)
+            if offset < before:
+                rows.append(start - 1 - offset)
+        return rows
+
+    def prefetch(self):
+        grid = self.grid
+        model = grid.item_model
+        if not model.rowCount():
+            return
+
+        velocity = self.velocity()
+        page = grid.page_size()
+        if velocity:
+            # where we will be in LOOKAHEAD seconds, at least a few screens
+            ahead = max(SCREENS_AHEAD * page, round(abs(velocity) * LOOKAHEAD))
+            ahead = min(ahead, MAX_SCREENS * page)
+            behind = SCREENS_BEHIND * page
+            display_ahead, display_behind = DISPLAY_AHEAD, DISPLAY_BEHIND
+        else:
+            ahead = behind = SCREENS_IDLE * page
+            display_ahead = display_behind = DISPLAY_IDLE
+        if velocity < 0:
+            ahead, behind = behind, ahead
+            display_ahead, display_behind = display_behind, display_ahead
+
+        # photos next to the current item, as many as fit into the
+        # image cache (assuming they fill the single item view)
+        display_size = grid.main.single_item.display_size()
+        display_bytes = max(display_size.width() * display_size.height() * 4, 1)
+        n = max(image_cache.images.budget // display_bytes - 1, 0)
+        display_rows = self.around(
+            grid.highlight, grid.highlight + 1, display_ahead, display_behind
+        )[:n]
+
+        visible = grid.visible_rows()
+        thumbnail_rows = self.around(visible.start, visible.stop, ahead, behind)
+
+        size = grid.thumbnail_size()
+        level = pick_level(size)
+        photos = grid.main.config.photos
+        wanted = set()
+        for row in visible:
+            item = model.item(row)
+            if item is not None:
+                wanted.add((item.uri, level))
+        for row in display_rows:
+            item = model.item(row)
+            if item is None:
+                continue
+            if Path(item.uri).suffix.lower() not in config.PHOTO_SUFFIX:
+                continue
+            wanted.add((item.uri, display_size.width(), display_size.height()))
+            grid.loader.get_display(item, display_size, PRELOAD)
+        for row in thumbnail_rows:
+            item = model.item(row)
+            if item is None:
+                continue
+            wanted.add((item.uri, level))
+            grid.loader.get(item, size, photos, PRELOAD)
+        grid.loader.keep(wanted)
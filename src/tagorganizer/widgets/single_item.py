@@ -34,11 +34,14 @@ from qtpy.QtWidgets import (
     QPushButton,
     QSlider,
 )
-from qtpy.QtCore import Qt, QTimer
+from qtpy.QtCore import QSize, Qt, QTimer
+from qtpy.QtGui import QPixmap
 
 import vlc
 
-from .helper import load_exif, load_full_pixmap
+from .helper import load_display_pixmap
+from .zoom_view import ZoomView
+from ..helper import load_exif
 from .. import config
 
 
@@ -181,8 +184,7 @@ class PhotoItem(QWidget):
         layout = QStackedLayout()
         layout.setStackingMode(QStackedLayout.StackAll)
 
-        self.item = QLabel()
-        self.item.setAlignment(Qt.AlignCenter)
+        self.item = ZoomView()
 
         self.exif_table = QTableWidget()
         self.exif_table.setVisible(False)
@@ -257,19 +259,17 @@ class PhotoItem(QWidget):
             s = s[:17] + "..."
         return s
 
-    def setPixmap(self, pixmap):
-        self.item.setPixmap(pixmap)
-
     def toggle_exif_visibility(self):
         self.scroll_area_container.setVisible(
             not self.scroll_area_container.isVisible()
         )
 
-    def set_photo(self, item):
-        pixmap = load_full_pixmap(str(item.uri))
-        pixmap = pixmap.scaled(self.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    def set_photo(self, item, size: QSize):
+        # already scaled to the size of the view, no need to scale it again
+        pixmap = load_display_pixmap(item, size) or QPixmap()
+        pixmap.setDevicePixelRatio(self.devicePixelRatioF())
 
-        self.setPixmap(pixmap)
+        self.item.set_photo(pixmap, str(item.uri))
         self.load_exif(str(item.uri))
 
 
@@ -299,9 +299,33 @@ class SingleItem(QWidget):
     def toggle_exif_visibility(self):
         self.photo.toggle_exif_visibility()
 
+    def display_size(self) -> QSize:
+        """Size of a photo in the single item view in device pixels.
+
+        Hidden widgets keep the size they had when they were shown last
+        (or their default size), so we use the size of the current tab,
+        which is the same for all tabs.
+        """
+        page = self.main.tabs.currentWidget() or self
+        return page.size() * self.devicePixelRatioF()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # the prefetched photos have the wrong size now
+        self.main.grid.prefetcher.schedule()
+
     def toggle_filename_visibility(self):
         self.filename.setVisible(not self.filename.isVisible())
 
+    def zoom_in(self):
+        self.photo.item.zoom_in()
+
+    def zoom_out(self):
+        self.photo.item.zoom_out()
+
+    def toggle_actual_size(self):
+        self.photo.item.toggle_actual_size()
+
     def set_item(self, item):
         file_path = Path(item.uri)
 
@@ -312,7 +336,7 @@ class SingleItem(QWidget):
         self.filename.setText(item.uri)
 
         if file_path.suffix.lower() in config.PHOTO_SUFFIX:
-            self.photo.set_photo(item)
+            self.photo.set_photo(item, self.display_size())
             self.video.setVisible(False)
             self.photo.setVisible(True)
         elif file_path.suffix.lower() in config.VIDEO_SUFFIX:
@@ -18,14 +18,21 @@ along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
 
 """
 
-from pathlib import Path
-
 from dataclasses import dataclass
 from datetime import datetime
 
 from qtpy.QtWidgets import QHBoxLayout, QPushButton, QSizePolicy, QWidget
 
-RESERVED_TAGS = ["No Time", "No GPS", "Wrong dir"]
+from ..models import Filters
+
+RESERVED_TAGS = [
+    "No Time",
+    "No GPS",
+    "Wrong dir",
+    "Duplicates",
+    "Near Duplicates",
+    "Missing",
+]
 
 
 @dataclass
@@ -62,18 +69,9 @@ class SelectedArea:
 
 
 @dataclass
-class Filters:
-    tags: list[str] | None = None
-    start_date: datetime | None = None
-    end_date: datetime | None = None
-    min_longitude: float | None = None
-    max_longitude: float | None = None
-    min_latitude: float | None = None
-    max_latitude: float | None = None
-    wrong_dir: bool | None = False
-    no_time: bool | None = False
-    no_gps: bool | None = False
-    directories: list[Path] | None = None
+class SelectedSimilar:
+    item_id: int | None = None
+    widget: QWidget | None = None
 
 
 class TagBar(QHBoxLayout):
@@ -87,10 +85,14 @@ class TagBar(QHBoxLayout):
         self.selected_times_min = SelectedTime()
         self.selected_times_max = SelectedTime()
         self.selected_area = SelectedArea()
+        self.selected_similar = SelectedSimilar()
         self.bool = {
             "Wrong dir": SelectedBool(),
             "No Time": SelectedBool(),
             "No GPS": SelectedBool(),
+            "Duplicates": SelectedBool(),
+            "Near Duplicates": SelectedBool(),
+            "Missing": SelectedBool(),
         }
 
         self.clear_button = QPushButton("Clear")
@@ -113,6 +115,7 @@ class TagBar(QHBoxLayout):
         self.remove_tag_button(self.selected_times_min.widget)
         self.remove_tag_button(self.selected_times_max.widget)
         self.remove_tag_button(self.selected_area.widget)
+        self.remove_tag_button(self.selected_similar.widget)
         self.main.update_items()
 
     def get_all_names(self):
@@ -180,6 +183,21 @@ class TagBar(QHBoxLayout):
 
         self.main.update_items()
 
+    def add_similar_tag(self, item_id: int):
+        # only one item at a time
+        if self.selected_similar.widget is not None:
+            self.selected_similar.widget.setParent(None)
+
+        tag_button = QPushButton("Similar")
+        tag_button.setObjectName("Similar")
+        tag_button.setSizePolicy(QSizePolicy.Policy.Minimum, QSizePolicy.Policy.Minimum)
+        tag_button.clicked.connect(lambda flag, t=tag_button: self.remove_tag_button(t))
+
+        self.addWidget(tag_button, 0)
+        self.selected_similar = SelectedSimilar(item_id, tag_button)
+
+        self.main.update_items()
+
     def get_filters(self) -> Filters:
         return Filters(
             tags=[x.name for x in self.selected_tags],
@@ -192,6 +210,11 @@ class TagBar(QHBoxLayout):
             wrong_dir=self.bool["Wrong dir"].value,
             no_time=self.bool["No Time"].value,
             no_gps=self.bool["No GPS"].value,
+            duplicates=self.bool["Duplicates"].value,
+            near_duplicates=self.bool["Near Duplicates"].value,
+            missing=self.bool["Missing"].value,
+            similar_to=self.selected_similar.item_id,
+            similarity_threshold=self.main.config.similarity_threshold,
             directories=[self.main.config.photos, self.main.config.videos],
         )
 
@@ -221,6 +244,10 @@ class TagBar(QHBoxLayout):
                 w.setParent(None)
                 self.selected_area = SelectedArea()
                 del w
+            elif w == self.selected_similar.widget:
+                w.setParent(None)
+                self.selected_similar = SelectedSimilar()
+                del w
             else:
                 for key, value in self.bool.items():
                     if w == value.widget:
@@ -0,0 +1,153 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from qtpy.QtWidgets import (
+    QDialog,
+    QHBoxLayout,
+    QLabel,
+    QListWidget,
+    QListWidgetItem,
+    QPushButton,
+    QVBoxLayout,
+)
+from qtpy.QtCore import Qt, QTimer
+
+from .. import db
+from ..scheduler import format_bytes, format_duration
+
+
+class TaskDialog(QDialog):
+    """List the current tasks and pause, resume or cancel them.
+
+    Also shows the last finished tasks from the task history.
+    """
+
+    def __init__(self, main):
+        super().__init__()
+
+        self.main = main
+
+        self.setWindowTitle("Tasks")
+        self.resize(700, 400)
+
+        layout = QVBoxLayout()
+
+        self.task_list = QListWidget()
+        layout.addWidget(self.task_list)
+
+        button_layout = QHBoxLayout()
+        pause_button = QPushButton("Pause")
+        resume_button = QPushButton("Resume")
+        cancel_button = QPushButton("Cancel Task")
+        close_button = QPushButton("Close")
+
+        pause_button.clicked.connect(lambda: self.pause_selected(True))
+        resume_button.clicked.connect(lambda: self.pause_selected(False))
+        cancel_button.clicked.connect(self.cancel_selected)
+        close_button.clicked.connect(self.close)
+
+        button_layout.addWidget(pause_button)
+        button_layout.addWidget(resume_button)
+        button_layout.addWidget(cancel_button)
+        button_layout.addStretch(1)
+        button_layout.addWidget(close_button)
+        layout.addLayout(button_layout)
+
+        layout.addWidget(QLabel("History"))
+        self.history_list = QListWidget()
+        layout.addWidget(self.history_list)
+
+        self.setLayout(layout)
+
+        self.number_of_tasks = 0
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_tasks)
+
+    def showEvent(self, event):
+        self.update_tasks()
+        self.update_history()
+        self.timer.start(500)
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def update_tasks(self):
+        selected = self.get_selected()
+        running = self.main.tasks.scheduler.runnable()
+
+        self.task_list.clear()
+        tasks = sorted(
+            self.main.tasks.scheduler.tasks, key=lambda t: (t.priority, t.id)
+        )
+        for task in tasks:
+            if task.paused:
+                state = "paused"
+            elif task in running:
+                state = "running"
+            else:
+                state = "waiting"
+            progress = f"{task.current}/{task.total}" if task.total else task.current
+            entry = QListWidgetItem(
+                f"{task.name}: {progress} ({state}) {task.status()}"
+            )
+            entry.setData(Qt.UserRole, task)
+            self.task_list.addItem(entry)
+            if task is selected:
+                self.task_list.setCurrentItem(entry)
+
+        # a task finished
+        if len(tasks) != self.number_of_tasks:
+            self.number_of_tasks = len(tasks)
+            self.update_history()
+
+    def update_history(self):
+        self.history_list.clear()
+        for entry in db.get_task_history():
+            wall_time = max(entry.wall_time, 1e-6)
+            text = (
+                f"{entry.started:%Y-%m-%d %H:%M} {entry.name} ({entry.status}):"
+                f" {entry.items}/{entry.total} items"
+                f" in {format_duration(entry.wall_time)},"
+                f" {entry.items / wall_time:.1f} items/s"
+            )
+            if entry.bytes:
+                text += f", {format_bytes(entry.bytes / wall_time)}/s"
+            text += f", {entry.errors} errors"
+            self.history_list.addItem(text)
+
+    def get_selected(self):
+        entry = self.task_list.currentItem()
+        if entry is None:
+            return None
+        return entry.data(Qt.UserRole)
+
+    def pause_selected(self, paused: bool):
+        task = self.get_selected()
+        if task is not None:
+            self.main.tasks.pause_task(task, paused)
+            self.update_tasks()
+
+    def cancel_selected(self):
+        task = self.get_selected()
+        if task is not None and task in self.main.tasks.scheduler.tasks:
+            self.main.tasks.cancel_task(task)
+            self.update_tasks()
@@ -0,0 +1,113 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from qtpy.QtWidgets import QProgressBar, QLabel
+from qtpy.QtCore import QTimer
+
+from .. import db
+from ..jobs import format_job_counts
+from ..tasks import TaskManager
+
+
+class TimerTaskManager(TaskManager):
+    """Run the tasks from a QTimer and show their progress in the statusbar.
+
+    Also shows the state of the job queue that the worker processes
+    (`TagOrganizer worker`) are working on.
+    """
+
+    def __init__(self, main, budget: float = 0.05):
+        super().__init__(main, budget)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.run_tasks)
+
+        self.progressbar_label = QLabel("Task")
+        self.progressbar = QProgressBar()
+        self.progressbar.setMaximumWidth(200)
+        self.progressbar_label.setVisible(False)
+        self.progressbar.setVisible(False)
+
+        self.jobs_label = QLabel("Jobs")
+        self.jobs_label.setVisible(False)
+        # the workers are other processes, so we need to check the db,
+        # but only while there are jobs left for them
+        self.jobs_timer = QTimer()
+        self.jobs_timer.setInterval(2000)
+        self.jobs_timer.timeout.connect(self.update_jobs)
+
+    def register_widgets(self, statusbar):
+        statusbar.addPermanentWidget(self.jobs_label)
+        statusbar.addPermanentWidget(self.progressbar_label)
+        statusbar.addPermanentWidget(self.progressbar)
+
+    def queue_jobs(self):
+        super().queue_jobs()
+        self.update_jobs()
+
+    def resume_tasks(self):
+        super().resume_tasks()
+        # e.g. after a profile switch or jobs queued by `TagOrganizer queue`
+        self.update_jobs()
+
+    def update_jobs(self):
+        counts = db.get_job_counts()
+        self.jobs_label.setVisible(bool(counts))
+        if counts:
+            self.jobs_label.setText(format_job_counts(counts))
+
+        # failed jobs stay in the queue, but nobody works on them
+        if counts.get("queued") or counts.get("running"):
+            if not self.jobs_timer.isActive():
+                self.jobs_timer.start()
+        else:
+            self.jobs_timer.stop()
+
+    def start(self, interval=20):
+        if not self.timer.isActive():
+            self.timer.start(interval)
+        self.update_progress()
+
+    def stop(self):
+        self.timer.stop()
+        self.update_progress()
+
+    def run_tasks(self) -> bool:
+        running = super().run_tasks()
+        if not running:
+            self.timer.stop()
+        return running
+
+    def update_progress(self):
+        running = self.scheduler.runnable()
+        visible = bool(running)
+        self.progressbar_label.setVisible(visible)
+        self.progressbar.setVisible(visible)
+        if not visible:
+            return
+
+        task = running[0]
+        waiting = len(self.scheduler.tasks) - 1
+        label = f"{task.name}: {task.status()}"
+        if waiting:
+            label += f" (+{waiting})"
+        self.progressbar_label.setText(label)
+        self.progressbar.setMaximum(task.total)
+        self.progressbar.setValue(task.current)
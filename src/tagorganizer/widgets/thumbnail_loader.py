@@ -0,0 +1,142 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from pathlib import Path
+
+from qtpy.QtGui import QPixmap
+from qtpy.QtCore import QObject, QRunnable, QSize, QThread, QThreadPool, Signal
+
+from .. import image_cache
+from ..models import Item
+from ..thumbnail_store import pick_level, thumbnail_keys
+from ..thumbnails import load_display_image, load_image
+
+# priorities in the thread pool
+VISIBLE = 1
+PRELOAD = 0
+
+
+class ThumbnailJob(QRunnable):
+    def __init__(self, loader, key, uri: str, keys: list[str], photos_path: Path):
+        super().__init__()
+        # the loader keeps a reference to us until we are done
+        self.setAutoDelete(False)
+        self.loader = loader
+        self.key = key
+        self.uri = uri
+        self.keys = keys
+        self.photos_path = photos_path
+        self.priority = PRELOAD
+
+    def load(self):
+        return load_image(self.uri, self.keys, self.key[1], self.photos_path)
+
+    def run(self):
+        try:
+            image = self.load()
+        except Exception as e:
+            print(f"[ERROR] cannot load {self.uri}: {e}")
+            image = None
+        # queued connection, gets handled in the GUI thread
+        self.loader.job_done.emit(self.key, image)
+
+
+class DisplayJob(ThumbnailJob):
+    """Decode a photo for the single item view, see `load_display_image`."""
+
+    def load(self):
+        _, width, height = self.key
+        return load_display_image(self.uri, self.keys, width, height)
+
+
+class ThumbnailLoader(QObject):
+    """Load thumbnails in a thread pool.
+
+    `get` returns a thumbnail from the cache or None and loads the
+    thumbnail in the background, `loaded` is emitted once it is
+    available. Images are decoded as QImage in the worker threads and
+    converted to QPixmap in the GUI thread. Requests for the same
+    thumbnail only run once and requests that are not needed anymore
+    can be cancelled using `keep`.
+
+    `get_display` loads photos for the single item view into
+    `image_cache.images` in the same pool, see `Prefetcher`.
+    """
+
+    # (uri, level), QPixmap or None
+    loaded = Signal(object, object)
+    # emitted from the worker threads
+    job_done = Signal(object, object)
+
+    def __init__(self, parent=None, threads: int | None = None):
+        super().__init__(parent)
+
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(threads or min(4, QThread.idealThreadCount()))
+
+        self.cache = image_cache.thumbnails
+        self.in_flight = {}
+
+        self.job_done.connect(self.on_job_done)
+
+    def get(self, item: Item, size: int, photos_path: Path, priority: int = VISIBLE):
+        """Return the level of the thumbnail for `size` (see `pick_level`)."""
+        key = (item.uri, pick_level(size))
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        self.submit(ThumbnailJob, key, item, photos_path, priority)
+        return None
+
+    def get_display(self, item: Item, size: QSize, priority: int = PRELOAD) -> bool:
+        """Load a photo that fits into size, returns True if it is cached."""
+        key = (item.uri, size.width(), size.height())
+        if key in image_cache.images:
+            return True
+        self.submit(DisplayJob, key, item, None, priority)
+        return False
+
+    def submit(self, job_class, key, item: Item, photos_path, priority: int):
+        job = self.in_flight.get(key)
+        if job is None:
+            job = job_class(self, key, item.uri, thumbnail_keys(item), photos_path)
+            job.priority = priority
+            self.in_flight[key] = job
+            self.pool.start(job, priority)
+        elif priority > job.priority and self.pool.tryTake(job):
+            # a preloaded item became visible
+            job.priority = priority
+            self.pool.start(job, priority)
+
+    def keep(self, keys: set):
+        """Cancel all requests that did not start yet and are not in keys."""
+        for key, job in list(self.in_flight.items()):
+            if key not in keys and self.pool.tryTake(job):
+                del self.in_flight[key]
+
+    def on_job_done(self, key, image):
+        job = self.in_flight.pop(key, None)
+        pixmap = None if image is None or image.isNull() else QPixmap.fromImage(image)
+        if isinstance(job, DisplayJob):
+            image_cache.images[key] = pixmap
+            return
+        self.cache[key] = pixmap
+        self.loaded.emit(key, pixmap)
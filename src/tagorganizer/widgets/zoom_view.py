@@ -0,0 +1,365 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import math
+
+from qtpy.QtWidgets import QSizePolicy, QWidget
+from qtpy.QtGui import QImageIOHandler, QImageReader, QPainter, QPixmap, QTransform
+from qtpy.QtCore import (
+    QObject,
+    QPointF,
+    QRect,
+    QRectF,
+    QRunnable,
+    QSizeF,
+    QThreadPool,
+    Qt,
+    Signal,
+)
+
+from .. import image_cache
+from ..helper import get_orientation
+from ..thumbnails import ROTATION_ANGLES, TILE_SIZE, read_band, tile_level
+
+# zoom factor for a key press or a step of the mouse wheel
+ZOOM_STEP = math.sqrt(2)
+# at most 8 screen pixels per image pixel
+MAX_ZOOM = 8
+
+# priorities in the thread pool
+VISIBLE = 1
+PRELOAD = 0
+
+
+def job_key(uri: str, level: int, row: int, clips: bool):
+    return (uri, level, row if clips else None)
+
+
+class TileJob(QRunnable):
+    def __init__(self, loader, key, row: int):
+        super().__init__()
+        # the loader keeps a reference to us until we are done
+        self.setAutoDelete(False)
+        self.loader = loader
+        self.key = key
+        self.row = row
+        self.priority = PRELOAD
+
+    def run(self):
+        uri, level, _ = self.key
+        row = self.row
+        try:
+            tiles = read_band(uri, level, row)
+        except Exception as e:
+            print(f"[ERROR] cannot decode {uri}: {e}")
+            tiles = {}
+        # queued connection, gets handled in the GUI thread
+        self.loader.job_done.emit(self.key, tiles)
+
+
+class TileLoader(QObject):
+    """Decode rows of tiles in a thread pool, see `read_band`.
+
+    Tiles are kept in `image_cache.tiles`, `loaded` is emitted when
+    new tiles are available.
+    """
+
+    loaded = Signal()
+    # emitted from the worker threads
+    job_done = Signal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+
+        # each job can need a lot of memory, so only run two at a time
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(2)
+
+        self.cache = image_cache.tiles
+        # (uri, level, row) -> TileJob
+        self.in_flight = {}
+        # rows that could not be decoded
+        self.failed = set()
+
+        self.job_done.connect(self.on_job_done)
+
+    def get(self, uri: str, level: int, row: int, col: int):
+        try:
+            return self.cache[(uri, level, row, col)]
+        except KeyError:
+            return None
+
+    def request(
+        self, uri: str, level: int, row: int, cols, priority: int, clips: bool = True
+    ):
+        """Decode a row in the background, unless its tiles in cols are cached.
+
+        If the decoder cannot clip (see `read_band`), there is only one
+        job per level that returns all rows.
+        """
+        key = job_key(uri, level, row, clips)
+        if key in self.failed:
+            return
+        if all((uri, level, row, col) in self.cache for col in cols):
+            return
+
+        job = self.in_flight.get(key)
+        if job is None:
+            job = TileJob(self, key, row)
+            job.priority = priority
+            self.in_flight[key] = job
+            self.pool.start(job, priority)
+        elif priority > job.priority and self.pool.tryTake(job):
+            # a preloaded row became visible
+            job.priority = priority
+            self.pool.start(job, priority)
+
+    def keep(self, keys: set):
+        """Cancel all requests that did not start yet and are not in keys."""
+        for key, job in list(self.in_flight.items()):
+            if key not in keys and self.pool.tryTake(job):
+                del self.in_flight[key]
+
+    def on_job_done(self, key, tiles):
+        self.in_flight.pop(key, None)
+        uri, level, _ = key
+        if not tiles:
+            self.failed.add(key)
+        for (row, col), tile in tiles.items():
+            self.cache[(uri, level, row, col)] = tile
+        self.loaded.emit()
+
+
+class ZoomView(QWidget):
+    """Show a photo scaled to fit, or zoomed in using tiles.
+
+    Scaled to fit, we only show the display image (see
+    `load_display_pixmap`). When zooming in further than its
+    resolution, the visible part gets drawn from tiles that are
+    decoded from the original at the closest level (see `read_band`),
+    until then the display image is drawn scaled up. Only the visible
+    rows of tiles and the ones next to them get decoded, so large
+    panoramas never need to be in memory completely.
+
+    Zoom with +/-, 1 or the mouse wheel, pan by dragging.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        self.loader = TileLoader(self)
+        self.loader.loaded.connect(self.update)
+
+        # display image, already rotated
+        self.pixmap = None
+        self.uri = None
+        # size of the original in the orientation of the file
+        self.raw_size = QSizeF()
+        self.orientation = None
+        # the decoder can decode parts of the image
+        self.clips = True
+
+        # device pixels per image pixel, None to fit the widget
+        self.zoom = None
+        # point of the rotated image in the center of the widget
+        self.center = QPointF()
+        self.drag = None
+
+        self.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+
+    def set_photo(self, pixmap: QPixmap, uri: str):
+        self.pixmap = pixmap
+        self.uri = uri
+        reader = QImageReader(uri)
+        reader.setAutoTransform(False)
+        self.raw_size = QSizeF(reader.size())
+        self.clips = reader.supportsOption(
+            QImageIOHandler.ImageOption.ClipRect
+        ) and reader.supportsOption(QImageIOHandler.ImageOption.ScaledClipRect)
+        self.orientation = get_orientation(uri)
+        self.reset_zoom()
+
+    def orientation_transform(self) -> QTransform:
+        """Map pixels of the file to pixels of the rotated image."""
+        rotation = QTransform().rotate(ROTATION_ANGLES.get(self.orientation, 0))
+        box = rotation.mapRect(QRectF(QPointF(0, 0), self.raw_size))
+        return rotation * QTransform.fromTranslate(-box.x(), -box.y())
+
+    def image_rect(self) -> QRectF:
+        """The rotated image in image pixels."""
+        return self.orientation_transform().mapRect(
+            QRectF(QPointF(0, 0), self.raw_size)
+        )
+
+    def fit_zoom(self) -> float:
+        """Zoom of the display image, small images do not get scaled up."""
+        size = self.image_rect().size()
+        if size.isEmpty():
+            return 1.0
+        ratio = self.devicePixelRatioF()
+        return min(
+            self.width() * ratio / size.width(),
+            self.height() * ratio / size.height(),
+            1.0,
+        )
+
+    def view_transform(self) -> QTransform:
+        """Map pixels of the rotated image to the widget."""
+        scale = (self.zoom or self.fit_zoom()) / self.devicePixelRatioF()
+        return (
+            QTransform.fromTranslate(-self.center.x(), -self.center.y())
+            * QTransform.fromScale(scale, scale)
+            * QTransform.fromTranslate(self.width() / 2, self.height() / 2)
+        )
+
+    def reset_zoom(self):
+        self.zoom = None
+        self.center = self.image_rect().center()
+        self.setCursor(Qt.ArrowCursor)
+        self.update()
+
+    def set_zoom(self, zoom: float, anchor: QPointF | None = None):
+        """Zoom keeping the point at anchor (or the center) in place."""
+        if self.pixmap is None or self.raw_size.isEmpty():
+            return
+        if zoom <= self.fit_zoom():
+            self.reset_zoom()
+            return
+        zoom = min(zoom, MAX_ZOOM)
+        if anchor is None:
+            anchor = QPointF(self.rect().center())
+        point = self.view_transform().inverted()[0].map(anchor)
+        self.zoom = zoom
+        scale = zoom / self.devicePixelRatioF()
+        offset = anchor - QPointF(self.width() / 2, self.height() / 2)
+        self.move_center(point - offset / scale)
+        self.setCursor(Qt.OpenHandCursor)
+
+    def zoom_in(self):
+        self.set_zoom((self.zoom or self.fit_zoom()) * ZOOM_STEP)
+
+    def zoom_out(self):
+        if self.zoom is not None:
+            self.set_zoom(self.zoom / ZOOM_STEP)
+
+    def toggle_actual_size(self, anchor: QPointF | None = None):
+        """Switch between one image pixel per screen pixel and fit."""
+        if self.zoom == 1:
+            self.reset_zoom()
+        else:
+            self.set_zoom(1, anchor)
+
+    def move_center(self, center: QPointF):
+        rect = self.image_rect()
+        self.center = QPointF(
+            min(max(center.x(), rect.left()), rect.right()),
+            min(max(center.y(), rect.top()), rect.bottom()),
+        )
+        self.update()
+
+    def paintEvent(self, event):
+        if self.pixmap is None or self.pixmap.isNull():
+            return
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+
+        if self.zoom is None:
+            # the display image already fits
+            target = QRect()
+            target.setSize(self.pixmap.deviceIndependentSize().toSize())
+            target.moveCenter(self.rect().center())
+            painter.drawPixmap(target, self.pixmap)
+            return
+
+        view = self.view_transform()
+        painter.setTransform(view)
+        image = self.image_rect()
+        painter.drawPixmap(image, self.pixmap, QRectF(self.pixmap.rect()))
+
+        # the display image has enough pixels
+        if self.zoom <= self.pixmap.width() / image.width():
+            return
+        self.draw_tiles(painter, self.orientation_transform() * view)
+
+    def draw_tiles(self, painter: QPainter, transform: QTransform):
+        """Draw the visible tiles, transform maps pixels of the file to the widget."""
+        level = tile_level(self.zoom)
+        # pixels of the file per tile
+        step = TILE_SIZE * level
+        visible = (
+            transform.inverted()[0]
+            .mapRect(QRectF(self.rect()))
+            .intersected(QRectF(QPointF(0, 0), self.raw_size))
+        )
+        if visible.isEmpty():
+            return
+        rows = range(int(visible.top() // step), math.ceil(visible.bottom() / step))
+        cols = range(int(visible.left() // step), math.ceil(visible.right() / step))
+
+        painter.setTransform(transform)
+        for row in rows:
+            self.loader.request(self.uri, level, row, cols, VISIBLE, self.clips)
+            for col in cols:
+                tile = self.loader.get(self.uri, level, row, col)
+                if tile is not None:
+                    target = QRectF(
+                        col * step,
+                        row * step,
+                        tile.width() * level,
+                        tile.height() * level,
+                    )
+                    painter.drawImage(target, tile)
+
+        # decode the rows above and below in the background
+        last = math.ceil(self.raw_size.height() / step) - 1
+        neighbors = [row for row in (rows.start - 1, rows.stop) if 0 <= row <= last]
+        for row in neighbors:
+            self.loader.request(self.uri, level, row, cols, PRELOAD, self.clips)
+        self.loader.keep(
+            {job_key(self.uri, level, row, self.clips) for row in [*rows, *neighbors]}
+        )
+
+    def wheelEvent(self, event):
+        steps = event.angleDelta().y() / 120
+        if steps:
+            self.set_zoom(
+                (self.zoom or self.fit_zoom()) * ZOOM_STEP**steps, event.position()
+            )
+
+    def mouseDoubleClickEvent(self, event):
+        self.toggle_actual_size(event.position())
+
+    def mousePressEvent(self, event):
+        if self.zoom is not None and event.button() == Qt.LeftButton:
+            self.drag = event.position()
+            self.setCursor(Qt.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if self.drag is None:
+            return
+        scale = self.zoom / self.devicePixelRatioF()
+        delta = event.position() - self.drag
+        self.drag = event.position()
+        self.move_center(self.center - delta / scale)
+
+    def mouseReleaseEvent(self, event):
+        if self.drag is not None:
+            self.drag = None
+            self.setCursor(Qt.OpenHandCursor)
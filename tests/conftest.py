@@ -0,0 +1,42 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import pytest
+
+from tagorganizer import db
+from tagorganizer import thumbnail_store
+
+
+@pytest.fixture
+def database(tmp_path):
+    """An empty db in a temporary directory."""
+    db.set_engine(str(tmp_path / "test.db"), wal=False)
+    db.create_db()
+    yield db
+    db.engine.dispose()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """An empty thumbnail store, old PNG thumbnails are in tmp_path too."""
+    # see thumbnail_store.get_thumbnail_path
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    thumbnail_store.set_store(tmp_path / "thumbnails.db", wal=False)
+    yield thumbnail_store.store
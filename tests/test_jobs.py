@@ -0,0 +1,153 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from datetime import timedelta
+import time
+
+import pytest
+
+from tagorganizer import db
+from tagorganizer import jobs
+from tagorganizer.helper import calculate_xxhash
+from tagorganizer.jobs import WorkerConfig, format_job_counts, queue_jobs, run_job
+from tagorganizer.models import Job
+
+
+@pytest.fixture
+def items(database, tmp_path):
+    files = []
+    for i in range(4):
+        path = tmp_path / f"{i}.jpg"
+        path.write_bytes(f"data {i}".encode())
+        files.append(path)
+    db.add_images(files)
+    return db.get_all_items()
+
+
+@pytest.fixture
+def worker_config(tmp_path):
+    return WorkerConfig(
+        db=str(tmp_path / "test.db"),
+        wal=False,
+        photos=tmp_path,
+        thumbnails=tmp_path / "thumbnails",
+        verify_hashes=False,
+        kinds=["hash"],
+    )
+
+
+def test_queue_jobs(items, tmp_path):
+    assert queue_jobs("hash", tmp_path, False) == 4
+    # jobs that are already queued are not added again
+    assert queue_jobs("hash", tmp_path, False) == 0
+    assert db.get_job_counts() == {"queued": 4}
+    assert format_job_counts(db.get_job_counts()) == (
+        "Jobs: 4 queued, 0 running, 0 failed"
+    )
+
+
+def test_claim_jobs(items):
+    db.enqueue_jobs("hash", [item.id for item in items])
+    db.enqueue_jobs("metadata", [items[0].id])
+
+    first = db.claim_jobs("a", ["hash"], 3, 600)
+    second = db.claim_jobs("b", ["hash", "metadata"], 3, 600)
+
+    assert [job.item_id for job in first] == [item.id for item in items[:3]]
+    assert {job.worker for job in first} == {"a"}
+    assert [(job.kind, job.item_id) for job in second] == [
+        ("hash", items[3].id),
+        ("metadata", items[0].id),
+    ]
+    assert not db.claim_jobs("c", ["hash"], 3, 600)
+    assert db.get_job_counts() == {"running": 5}
+
+
+def test_claim_expired_jobs(items):
+    db.enqueue_jobs("hash", [item.id for item in items[:2]])
+    claimed = db.claim_jobs("a", ["hash"], 2, 600)
+    assert abs(claimed[0].claimed - db.utcnow()) < timedelta(seconds=5)
+
+    time.sleep(0.2)
+    # the worker is still working on the second job
+    db.renew_jobs("a", claimed[1:])
+    reclaimed = db.claim_jobs("b", ["hash"], 2, 0.1)
+
+    assert [job.item_id for job in reclaimed] == [items[0].id]
+    assert reclaimed[0].worker == "b"
+    # jobs of other workers do not get renewed
+    db.renew_jobs("a", claimed)
+    assert not db.claim_jobs("c", ["hash"], 2, 0.1)
+
+
+def test_finish_and_release_jobs(items):
+    db.enqueue_jobs("hash", [item.id for item in items])
+    claimed = db.claim_jobs("a", ["hash"], 4, 600)
+    claimed[1].error = "broken"
+
+    db.finish_jobs([], claimed[:1], claimed[1:2])
+    db.release_jobs(claimed[2:])
+
+    assert db.get_job_counts() == {"queued": 2, "failed": 1}
+    # failed jobs get replaced when they are queued again
+    assert db.enqueue_jobs("hash", [items[1].id]) == 1
+
+
+def test_run_job(items, worker_config):
+    item = items[0]
+    run_job(Job(kind="hash", item_id=item.id), item, worker_config)
+    assert item.data_xxhash == calculate_xxhash(item.uri)
+
+    with pytest.raises(ValueError):
+        run_job(Job(kind="unknown", item_id=item.id), item, worker_config)
+    with pytest.raises(ValueError):
+        run_job(Job(kind="thumbnail", item_id=items[1].id), items[1], worker_config)
+
+
+def test_run_job_missing_file(items, worker_config, tmp_path):
+    (tmp_path / "0.jpg").unlink()
+    with pytest.raises(FileNotFoundError):
+        run_job(Job(kind="hash", item_id=items[0].id), items[0], worker_config)
+
+
+def test_work(items, worker_config, tmp_path):
+    (tmp_path / "3.jpg").unlink()
+    db.enqueue_jobs("hash", [item.id for item in items])
+
+    assert jobs.work(worker_config) == (3, 1)
+
+    assert db.get_job_counts() == {"failed": 1}
+    hashed = db.get_items_by_ids([item.id for item in items[:3]])
+    assert all(item.data_xxhash == calculate_xxhash(item.uri) for item in hashed)
+
+
+def test_work_renews_jobs(items, worker_config, monkeypatch):
+    db.enqueue_jobs("hash", [item.id for item in items])
+    renewed = []
+
+    def renew_jobs(worker, claimed):
+        renewed.append([job.item_id for job in claimed])
+
+    monkeypatch.setattr(jobs, "HEARTBEAT_INTERVAL", -1)
+    monkeypatch.setattr(db, "renew_jobs", renew_jobs)
+    assert jobs.work(worker_config) == (4, 0)
+
+    ids = [item.id for item in items]
+    assert renewed == [ids, ids[1:], ids[2:], ids[3:]]
@@ -0,0 +1,388 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from datetime import datetime
+import errno
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from tagorganizer import db
+from tagorganizer import mover
+from tagorganizer.helper import calculate_md5, calculate_xxhash
+from tagorganizer.models import Item, MoveJournal
+from tagorganizer.mover import (
+    Move,
+    get_part_path,
+    get_target_path,
+    journal_lock,
+    plan_moves,
+    recover_move,
+    replay_journal,
+    run_moves,
+)
+from tagorganizer.tasks import moves_files
+from tagorganizer.thumbnail_store import LEVELS, get_thumbnail_file, thumbnail_keys
+from tagorganizer.thumbnails import load_thumbnail
+
+pytestmark = pytest.mark.usefixtures("store")
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    incoming = tmp_path / "incoming"
+    incoming.mkdir()
+    return incoming, tmp_path / "photos", tmp_path / "videos"
+
+
+def add_item(path: Path, data: bytes = b"data", date=datetime(2024, 5, 17)) -> Item:
+    path.write_bytes(data)
+    db.add_images([path])
+    (item,) = db.get_items_by_uris([str(path)])
+    item.date = date
+    item.uri_md5 = calculate_md5(item.uri)
+    db.update_items_in_db([item])
+    return item
+
+
+def journal_move(item: Item, target: Path, state: str = "planned") -> Move:
+    entry = MoveJournal(
+        item_id=item.id, source=item.uri, target=str(target), state=state
+    )
+    db.add_move_journal([entry])
+    return Move(item, entry)
+
+
+def run(moves, photos, verify=False):
+    log = []
+    gen = run_moves(moves, verify, photos, log.append)
+    try:
+        while True:
+            next(gen)
+    except StopIteration as stop:
+        return stop.value, log
+
+
+def test_get_target_path(dirs):
+    _, photos, videos = dirs
+    item = Item(uri="/somewhere/IMG_1.JPG", date=datetime(2024, 5, 7))
+    assert get_target_path(item, photos, videos) == photos / "2024/05/07/IMG_1.jpg"
+    item = Item(uri="/somewhere/clip.mp4")
+    assert get_target_path(item, photos, videos) == videos / "no-date/clip.mp4"
+    with pytest.raises(ValueError):
+        get_target_path(Item(uri="/somewhere/notes.txt"), photos, videos)
+
+
+def test_plan_moves(database, dirs):
+    incoming, photos, videos = dirs
+    other = incoming / "other"
+    other.mkdir()
+    a = add_item(incoming / "a.jpg")
+    b = add_item(incoming / "b.jpg")
+    # would end up at the same place as b
+    b2 = add_item(other / "b.jpg")
+    exists = add_item(incoming / "c.jpg")
+    target = photos / "2024/05/17"
+    target.mkdir(parents=True)
+    (target / "c.jpg").write_bytes(b"other")
+    missing = Item(id=1000, uri=str(incoming / "gone.jpg"))
+    in_place = add_item(target / "d.jpg")
+
+    moves, problems = plan_moves([a, b, b2, exists, missing, in_place], photos, videos)
+
+    assert [m.item for m in moves] == [a, b]
+    assert [m.target for m in moves] == [target / "a.jpg", target / "b.jpg"]
+    assert problems == [
+        f"File already exists: {target / 'b.jpg'}",
+        f"File already exists: {target / 'c.jpg'}",
+        f"[Error] item {missing.uri} does not exist",
+    ]
+    # planning does not touch any file
+    assert (incoming / "a.jpg").is_file()
+    assert not (target / "a.jpg").exists()
+    assert b2.uri == str(other / "b.jpg")
+
+
+def test_run_moves(database, dirs):
+    incoming, photos, videos = dirs
+    items = [add_item(incoming / f"{i}.jpg", f"data {i}".encode()) for i in range(5)]
+    moves, problems = plan_moves(items, photos, videos)
+    assert not problems
+
+    moved, _ = run(moves, photos)
+
+    assert moved == 5
+    assert not db.get_move_journal()
+    for i, item in enumerate(db.get_items_by_ids([item.id for item in items])):
+        target = photos / f"2024/05/17/{i}.jpg"
+        assert item.uri == str(target)
+        assert target.read_bytes() == f"data {i}".encode()
+        assert item.data_xxhash == calculate_xxhash(target)
+        assert not (incoming / f"{i}.jpg").exists()
+
+
+def test_run_moves_across_filesystems(database, dirs, monkeypatch):
+    incoming, photos, videos = dirs
+    item = add_item(incoming / "a.jpg")
+    moves, _ = plan_moves([item], photos, videos)
+
+    rename = os.rename
+
+    def cross_device_rename(source, target):
+        if Path(source) == incoming / "a.jpg":
+            raise OSError(errno.EXDEV, "cross-device link")
+        rename(source, target)
+
+    monkeypatch.setattr(mover.os, "rename", cross_device_rename)
+    moved, _ = run(moves, photos)
+
+    target = photos / "2024/05/17/a.jpg"
+    assert moved == 1
+    assert target.read_bytes() == b"data"
+    assert not (incoming / "a.jpg").exists()
+    assert not get_part_path(target).exists()
+    (item,) = db.get_items_by_ids([item.id])
+    assert item.uri == str(target)
+
+
+def test_run_moves_target_appeared(database, dirs):
+    incoming, photos, videos = dirs
+    item = add_item(incoming / "a.jpg")
+    moves, _ = plan_moves([item], photos, videos)
+    target = photos / "2024/05/17/a.jpg"
+    target.parent.mkdir(parents=True)
+    target.write_bytes(b"other")
+
+    moved, log = run(moves, photos)
+
+    assert moved == 0
+    assert log[0].startswith("[Error] Failed to move")
+    assert target.read_bytes() == b"other"
+    assert (incoming / "a.jpg").is_file()
+    assert not db.get_move_journal()
+
+
+def test_run_moves_recover_fails(database, dirs, monkeypatch):
+    incoming, photos, videos = dirs
+    items = [add_item(incoming / f"{i}.jpg") for i in range(3)]
+    moves, _ = plan_moves(items, photos, videos)
+
+    def fail_once(move, verify, photos):
+        if move is moves[1]:
+            raise OSError("disk on fire")
+        return move_file(move, verify, photos)
+
+    def fail_recover(move, verify, photos):
+        raise OSError("still on fire")
+
+    move_file = mover.move_file
+    monkeypatch.setattr(mover, "move_file", fail_once)
+    monkeypatch.setattr(mover, "recover_move", fail_recover)
+    moved, log = run(moves, photos)
+
+    assert moved == 2
+    assert any(line.startswith("[Error] Failed to recover") for line in log)
+    # the other moves still got written to the db
+    assert [item.uri for item in db.get_items_by_ids([items[0].id, items[2].id])] == [
+        str(photos / "2024/05/17/0.jpg"),
+        str(photos / "2024/05/17/2.jpg"),
+    ]
+    # the journal entry is kept for replay_journal
+    assert [e.item_id for e in db.get_move_journal()] == [items[1].id]
+
+
+def test_run_moves_cancelled(database, dirs):
+    incoming, photos, videos = dirs
+    items = [add_item(incoming / f"{i}.jpg") for i in range(5)]
+    moves, _ = plan_moves(items, photos, videos)
+
+    gen = run_moves(moves, False, photos, lambda message: None, N=2)
+    assert next(gen) == (5, 2, {"errors": 0})
+    gen.close()
+
+    assert not db.get_move_journal()
+    assert (incoming / "4.jpg").is_file()
+
+
+def test_recover_copied(database, dirs):
+    incoming, photos, _ = dirs
+    item = add_item(incoming / "a.jpg")
+    target = photos / "a.jpg"
+    photos.mkdir()
+    get_part_path(target).write_bytes(b"data")
+    move = journal_move(item, target, "copied")
+
+    assert recover_move(move, False, photos) == "finished"
+    assert target.read_bytes() == b"data"
+    assert not (incoming / "a.jpg").exists()
+    assert not get_part_path(target).exists()
+    assert item.uri == str(target)
+
+
+def test_recover_planned(database, dirs):
+    incoming, photos, _ = dirs
+    item = add_item(incoming / "a.jpg")
+    target = photos / "a.jpg"
+    photos.mkdir()
+    # an unverified copy
+    get_part_path(target).write_bytes(b"da")
+    move = journal_move(item, target)
+
+    assert recover_move(move, False, photos) == "rolled back"
+    assert (incoming / "a.jpg").is_file()
+    assert not get_part_path(target).exists()
+    assert item.uri == str(incoming / "a.jpg")
+
+
+def test_recover_renamed(database, dirs):
+    incoming, photos, _ = dirs
+    item = add_item(incoming / "a.jpg")
+    target = photos / "a.jpg"
+    photos.mkdir()
+    os.rename(incoming / "a.jpg", target)
+    move = journal_move(item, target)
+
+    assert recover_move(move, False, photos) == "finished"
+    assert item.uri == str(target)
+
+
+def test_recover_lost(database, dirs):
+    incoming, photos, _ = dirs
+    item = add_item(incoming / "a.jpg")
+    (incoming / "a.jpg").unlink()
+    move = journal_move(item, photos / "a.jpg")
+
+    assert recover_move(move, False, photos) == "lost"
+
+
+def test_replay_journal(database, dirs):
+    incoming, photos, _ = dirs
+    photos.mkdir()
+    renamed = add_item(incoming / "a.jpg")
+    os.rename(incoming / "a.jpg", photos / "a.jpg")
+    journal_move(renamed, photos / "a.jpg")
+    planned = add_item(incoming / "b.jpg")
+    journal_move(planned, photos / "b.jpg")
+    lost = add_item(incoming / "c.jpg")
+    (incoming / "c.jpg").unlink()
+    journal_move(lost, photos / "c.jpg")
+
+    log = []
+    replay_journal(False, photos, log.append)
+
+    assert not db.get_move_journal()
+    items = db.get_items_by_ids([renamed.id, planned.id, lost.id])
+    assert [item.uri for item in items] == [
+        str(photos / "a.jpg"),
+        str(incoming / "b.jpg"),
+        str(incoming / "c.jpg"),
+    ]
+    assert log[0] == "Found 3 interrupted moves"
+    assert f"[Error] neither {incoming / 'c.jpg'} nor {photos / 'c.jpg'} exist" in log
+
+
+def test_replay_journal_keeps_failed_entries(database, dirs, monkeypatch):
+    incoming, photos, _ = dirs
+    item = add_item(incoming / "a.jpg")
+    journal_move(item, photos / "a.jpg")
+
+    def fail_recover(move, verify, photos):
+        raise OSError("still on fire")
+
+    monkeypatch.setattr(mover, "recover_move", fail_recover)
+    log = []
+    replay_journal(False, photos, log.append)
+
+    assert len(db.get_move_journal()) == 1
+    assert log[-1].startswith("[Error] Failed to recover")
+
+
+def test_journal_lock(database):
+    with journal_lock() as locked:
+        assert locked
+        # e.g. a cron job while the GUI moves files
+        with journal_lock() as other:
+            assert not other
+    with journal_lock() as locked:
+        assert locked
+
+
+def test_moves_files_needs_lock(database, dirs):
+    incoming, photos, _ = dirs
+    item = add_item(incoming / "a.jpg")
+    journal_move(item, photos / "a.jpg")
+    log = []
+    main = SimpleNamespace(
+        messages=SimpleNamespace(add=log.append),
+        config=SimpleNamespace(verify_hashes=False, photos=photos),
+    )
+
+    @moves_files
+    def task(self):
+        yield 1, 1
+
+    with journal_lock():
+        assert list(task(SimpleNamespace(main=main))) == []
+    # the entry belongs to the process holding the lock
+    assert len(db.get_move_journal()) == 1
+    assert log == ["[Error] another process is moving files, try again later"]
+
+    assert list(task(SimpleNamespace(main=main))) == [(1, 1)]
+    assert not db.get_move_journal()
+
+
+def small_jpeg() -> bytes:
+    return cv2.imencode(".jpg", np.zeros((96, 128, 3), np.uint8))[1].tobytes()
+
+
+def test_move_keeps_thumbnail(database, dirs, store):
+    incoming, photos, videos = dirs
+    # hashed after the thumbnail was created, so it is under the uri md5
+    item = add_item(incoming / "a.jpg")
+    old_md5 = item.uri_md5
+    store.put_many([(old_md5, LEVELS[0], small_jpeg())])
+
+    moves, _ = plan_moves([item], photos, videos)
+    run(moves, photos)
+
+    (item,) = db.get_items_by_ids([item.id])
+    assert item.uri_md5 != old_md5
+    assert thumbnail_keys(item) == [item.data_xxhash, item.uri_md5]
+    assert store.get(item.data_xxhash, LEVELS[0]) is not None
+    assert load_thumbnail(thumbnail_keys(item), LEVELS[0], photos) is not None
+
+
+def test_move_keeps_old_png_thumbnail(database, dirs, store):
+    incoming, photos, videos = dirs
+    item = add_item(incoming / "a.jpg")
+    png = get_thumbnail_file(item.uri_md5, photos)
+    png.parent.mkdir(parents=True)
+    cv2.imwrite(str(png), np.zeros((96, 128, 3), np.uint8))
+
+    moves, _ = plan_moves([item], photos, videos)
+    run(moves, photos)
+
+    (item,) = db.get_items_by_ids([item.id])
+    assert store.get(item.data_xxhash, LEVELS[0]) is not None
+    assert load_thumbnail(thumbnail_keys(item), LEVELS[0], photos) is not None
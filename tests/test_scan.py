@@ -0,0 +1,123 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import os
+
+from tagorganizer import db
+from tagorganizer.scan import find_files, reconcile, walk_files
+
+
+def make_tree(root):
+    for name in [
+        "a.jpg",
+        "b.JPG",
+        "notes.txt",
+        ".DS_Store",
+        "2024/05/c.mp4",
+        "2024/05/d.jpeg",
+        "thumbnails/e.jpg",
+        "2024/thumbnails/f.jpg",
+    ]:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(name.encode())
+
+
+def test_walk_files(tmp_path):
+    make_tree(tmp_path)
+    (tmp_path / "link").symlink_to(tmp_path / "2024")
+
+    skip = frozenset([str(tmp_path / "thumbnails")])
+    found = sorted(entry.path for entry in walk_files(tmp_path, skip))
+
+    # only the skipped dir itself is left out, not every 'thumbnails' dir
+    assert found == sorted(
+        str(tmp_path / name)
+        for name in [
+            "a.jpg",
+            "b.JPG",
+            "notes.txt",
+            "2024/05/c.mp4",
+            "2024/05/d.jpeg",
+            "2024/thumbnails/f.jpg",
+        ]
+    )
+
+
+def test_walk_files_unreadable_dir(tmp_path, capsys):
+    assert list(walk_files(tmp_path / "missing")) == []
+    assert "[ERROR] cannot read directory" in capsys.readouterr().out
+
+
+def test_find_files(tmp_path):
+    make_tree(tmp_path)
+
+    found = sorted(find_files(tmp_path, frozenset([".jpg", ".mp4"])))
+
+    assert found == sorted(
+        str(tmp_path / name)
+        for name in [
+            "a.jpg",
+            "b.JPG",
+            "2024/05/c.mp4",
+            "thumbnails/e.jpg",
+            "2024/thumbnails/f.jpg",
+        ]
+    )
+
+
+def test_reconcile(tmp_path):
+    make_tree(tmp_path)
+    stat = os.stat(tmp_path / "a.jpg")
+    known = {
+        str(tmp_path / "a.jpg"): (stat.st_size, stat.st_mtime_ns),
+        # not hashed yet
+        str(tmp_path / "b.JPG"): (None, None),
+        str(tmp_path / "2024/05/c.mp4"): (stat.st_size + 1, stat.st_mtime_ns),
+        str(tmp_path / "gone.jpg"): (1, 1),
+    }
+
+    result = sorted(
+        reconcile(tmp_path, known, frozenset([str(tmp_path / "thumbnails")]))
+    )
+
+    assert result == sorted(
+        [
+            ("ok", str(tmp_path / "a.jpg")),
+            ("ok", str(tmp_path / "b.JPG")),
+            ("changed", str(tmp_path / "2024/05/c.mp4")),
+            ("new", str(tmp_path / "notes.txt")),
+            ("new", str(tmp_path / "2024/05/d.jpeg")),
+            ("new", str(tmp_path / "2024/thumbnails/f.jpg")),
+            ("missing", str(tmp_path / "gone.jpg")),
+        ]
+    )
+    assert known == {str(tmp_path / "gone.jpg"): (1, 1)}
+
+
+def test_get_known_files(database, tmp_path):
+    photos = tmp_path / "photos"
+    inside = [str(photos / "a.jpg"), str(photos / "2024/b.jpg")]
+    # a sibling that shares the prefix and one that LIKE would match
+    outside = [str(tmp_path / "photos2/c.jpg"), str(tmp_path / "phot_s/d.jpg")]
+    db.add_images(inside + outside)
+
+    assert sorted(db.get_known_files(photos)) == sorted(inside)
+    assert db.get_known_files(tmp_path / "phot_s") == {outside[1]: (None, None)}
@@ -0,0 +1,171 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from tagorganizer import db
+from tagorganizer.scheduler import (
+    PRIORITY_BULK,
+    PRIORITY_INTERACTIVE,
+    Checkpoint,
+    Scheduler,
+    Task,
+    format_bytes,
+    format_duration,
+)
+
+
+def counter(name: str, n: int, steps: list):
+    for i in range(n):
+        steps.append(name)
+        yield n, i + 1, {"errors": 0}
+
+
+def run_all(scheduler: Scheduler) -> None:
+    while scheduler.step():
+        pass
+
+
+def test_format():
+    assert format_duration(3725) == "1:02:05"
+    assert format_bytes(999) == "999.0 B"
+    assert format_bytes(1_500_000) == "1.5 MB"
+
+
+def test_priorities(database):
+    steps = []
+    log = []
+    scheduler = Scheduler(log.append)
+    scheduler.submit(Task("bulk", counter("bulk", 3, steps), PRIORITY_BULK))
+    scheduler.submit(Task("cpu", counter("cpu", 2, steps), resource="cpu"))
+    scheduler.submit(
+        Task("interactive", counter("interactive", 2, steps), PRIORITY_INTERACTIVE)
+    )
+
+    run_all(scheduler)
+
+    # the interactive task takes the disk, the cpu task runs next to it
+    assert steps == [
+        "interactive",
+        "cpu",
+        "interactive",
+        "cpu",
+        "bulk",
+        "bulk",
+        "bulk",
+    ]
+    assert not scheduler.tasks
+    assert len(log) == 3
+    history = db.get_task_history()
+    assert sorted((h.name, h.status, h.items) for h in history) == [
+        ("bulk", "done", 3),
+        ("cpu", "done", 2),
+        ("interactive", "done", 2),
+    ]
+
+
+def test_paused(database):
+    steps = []
+    scheduler = Scheduler(lambda message: None)
+    first = scheduler.submit(Task("first", counter("first", 2, steps)))
+    scheduler.submit(Task("second", counter("second", 1, steps)))
+    first.paused = True
+
+    run_all(scheduler)
+    assert steps == ["second"]
+    assert scheduler.tasks == [first]
+    first.paused = False
+    run_all(scheduler)
+    assert steps == ["second", "first", "first"]
+
+
+def test_failed_task(database):
+    def failing():
+        yield 2, 1
+        raise ValueError("broken")
+
+    log = []
+    scheduler = Scheduler(log.append)
+    task = scheduler.submit(Task("failing", failing()))
+    run_all(scheduler)
+
+    assert log[0] == "[Error] Task 'failing' failed: broken"
+    assert task.errors == 1
+    (history,) = db.get_task_history()
+    assert history.status == "failed"
+
+
+def test_cancel_before_start(database):
+    scheduler = Scheduler(lambda message: None)
+    task = scheduler.submit(Task("never", counter("never", 1, [])))
+    scheduler.cancel(task)
+
+    assert not scheduler.tasks
+    assert not db.get_task_history()
+
+
+def test_suspend_keeps_checkpoint(database):
+    def resumable(checkpoint):
+        start = checkpoint.state.get("done", 0)
+        for i in range(start, 10):
+            checkpoint.save(done=i + 1)
+            yield 10, i + 1
+
+    checkpoint = Checkpoint("count", [1, "a"])
+    scheduler = Scheduler(lambda message: None)
+    scheduler.submit(Task("count", resumable(checkpoint), checkpoint=checkpoint))
+    for _ in range(3):
+        scheduler.step()
+    scheduler.suspend()
+
+    (loaded,) = Checkpoint.load_all()
+    assert (loaded.kind, loaded.args, loaded.state) == ("count", [1, "a"], {"done": 3})
+
+    scheduler.submit(Task("count", resumable(loaded), checkpoint=loaded))
+    assert scheduler.find("count", [1, "a"]) is not None
+    run_all(scheduler)
+    assert not Checkpoint.load_all()
+    statuses = [h.status for h in db.get_task_history()]
+    assert sorted(statuses) == ["done", "suspended"]
+
+
+def test_rates():
+    task = Task("task", iter([]))
+    assert task.eta() is None
+    task.samples.extend([(0.0, 0, 0), (2.0, 10, 2000)])
+    task.total = 30
+    task.current = 10
+    assert task.rates() == (5.0, 1000.0)
+    assert task.eta() == 4.0
+    assert task.status() == "5.0 items/s, 1.0 KB/s, ETA 0:00:04"
+
+
+def test_waiting_task(database):
+    def waiting():
+        yield None
+        yield 1, 1
+
+    scheduler = Scheduler(lambda message: None)
+    task = scheduler.submit(Task("waiting", waiting()))
+
+    # a waiting task gives the event loop back
+    assert not scheduler.step()
+    assert scheduler.tasks == [task]
+    assert task.current == 0
+    assert scheduler.step()
+    assert task.current == 1
@@ -0,0 +1,159 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from tagorganizer import db
+from tagorganizer.similarity import HammingIndex, cluster, to_signed
+from tagorganizer.tasks import TaskManager
+
+
+def random_hashes(n: int, seed: int = 0) -> np.ndarray:
+    """Random 64 bit hashes with groups of near duplicates."""
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, 1 << 63, n, dtype=np.uint64) * np.uint64(2)
+    hashes |= rng.integers(0, 2, n, dtype=np.uint64)
+    # copies with a few flipped bits
+    copies = hashes[: n // 4].copy()
+    for _ in range(3):
+        copies ^= np.uint64(1) << rng.integers(0, 64, len(copies), dtype=np.uint64)
+    return np.concatenate([hashes, copies]).view(np.int64)
+
+
+def brute_force_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    value = np.uint64(int(value) & ((1 << 64) - 1))
+    return np.bitwise_count(hashes.view(np.uint64) ^ value).astype(np.int64)
+
+
+@pytest.mark.parametrize("max_distance", [0, 3, 4, 8, 10])
+def test_query_matches_brute_force(max_distance):
+    hashes = random_hashes(2000)
+    ids = np.arange(len(hashes)) + 100
+    index = HammingIndex(ids, hashes)
+
+    for value in hashes[::50]:
+        found, distances = index.query(value, max_distance)
+        expected = brute_force_distances(hashes, value)
+        close = expected <= max_distance
+        assert sorted(found) == sorted(ids[close])
+        assert list(distances) == sorted(distances)
+        assert dict(zip(found, distances)) == dict(zip(ids[close], expected[close]))
+
+
+def test_query_unsigned_value():
+    value = (1 << 64) - 1
+    index = HammingIndex([1, 2], [to_signed(value), 0])
+    found, distances = index.query(value ^ 1, 1)
+    assert list(found) == [1]
+    assert list(distances) == [1]
+
+
+def test_query_empty_index():
+    found, distances = HammingIndex([], []).query(0, 8)
+    assert len(found) == 0
+    assert len(distances) == 0
+
+
+def test_candidates_batches():
+    # one large bucket of identical chunks
+    hashes = np.zeros(300, dtype=np.int64)
+    hashes[::2] = 1
+    index = HammingIndex(np.arange(len(hashes)), hashes)
+
+    def pairs(batch):
+        result = set()
+        for i, j in index.candidates(0, batch):
+            assert len(i) <= max(batch, len(hashes))
+            assert (i < j).all()
+            result.update(zip(i.tolist(), j.tolist()))
+        return result
+
+    expected = {(i, j) for i in range(300) for j in range(i + 1, 300)}
+    assert pairs(10) == expected
+    assert pairs(1 << 20) == expected
+
+
+def brute_force_cluster(ids, hashes, max_distance: int) -> dict[int, int]:
+    n = len(ids)
+    groups = list(range(n))
+
+    def find(i):
+        while groups[i] != i:
+            i = groups[i]
+        return i
+
+    for i in range(n):
+        distances = brute_force_distances(hashes, hashes[i])
+        for j in np.flatnonzero(distances <= max_distance):
+            a, b = find(i), find(int(j))
+            groups[max(a, b)] = min(a, b)
+
+    members = {}
+    for i in range(n):
+        members.setdefault(find(i), []).append(int(ids[i]))
+    result = {}
+    for group in members.values():
+        if len(group) > 1:
+            result.update((id, min(group)) for id in group)
+    return result
+
+
+@pytest.mark.parametrize("max_distance", [0, 4, 6])
+def test_cluster_matches_brute_force(max_distance):
+    hashes = random_hashes(400, seed=1)
+    # exact duplicates
+    hashes = np.concatenate([hashes, hashes[:20]])
+    ids = np.random.default_rng(2).permutation(len(hashes)) + 1
+    assert cluster(ids, hashes, max_distance) == brute_force_cluster(
+        ids, hashes, max_distance
+    )
+
+
+def test_cluster_empty():
+    assert cluster([], [], 4) == {}
+
+
+def test_failed_phash_is_not_retried(database, tmp_path):
+    good = tmp_path / "good.jpg"
+    cv2.imwrite(str(good), np.zeros((64, 64, 3), np.uint8))
+    broken = tmp_path / "broken.jpg"
+    broken.write_bytes(b"not a jpeg")
+    db.add_images([str(good), str(broken)])
+
+    log = []
+    main = SimpleNamespace(
+        messages=SimpleNamespace(add=log.append),
+        config=SimpleNamespace(similarity_threshold=4),
+    )
+    tasks = TaskManager(main)
+    tasks.pool_timeout = 0.1
+    list(tasks.task_update_similarity())
+
+    items = {item.uri: item for item in db.get_all_items()}
+    assert items[str(good)].phash is not None
+    assert not items[str(good)].phash_failed
+    assert items[str(broken)].phash is None
+    assert items[str(broken)].phash_failed
+    assert f"[Error] cannot calculate hash for {broken}" in log
+    assert db.get_items_without_phash() == []
@@ -0,0 +1,76 @@
+"""
+Copyright 2024 Arun Persaud.
+
+This file is part of TagOrganizer.
+
+TagOrganizer is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or (at
+your option) any later version.
+
+TagOrganizer is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with TagOrganizer. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from tagorganizer.helper import read_jpeg_size
+from tagorganizer.thumbnail_store import LEVELS, create_thumbnail, reduced_flag
+
+
+def write_jpeg(path, width, height, progressive=False, app1=b""):
+    image = np.zeros((height, width, 3), np.uint8)
+    _, data = cv2.imencode(
+        ".jpg", image, [cv2.IMWRITE_JPEG_PROGRESSIVE, int(progressive)]
+    )
+    data = data.tobytes()
+    if app1:
+        # e.g. EXIF data in front of the frame header
+        segment = b"\xff\xe1" + (len(app1) + 2).to_bytes(2, "big") + app1
+        data = data[:2] + segment + data[2:]
+    path.write_bytes(data)
+    return path
+
+
+@pytest.mark.parametrize("progressive", [False, True])
+def test_read_jpeg_size(tmp_path, progressive):
+    path = write_jpeg(tmp_path / "a.jpg", 1234, 567, progressive, b"Exif\0\0" * 100)
+    assert read_jpeg_size(path) == (1234, 567)
+
+
+def test_read_jpeg_size_other_files(tmp_path):
+    png = tmp_path / "a.png"
+    cv2.imwrite(str(png), np.zeros((10, 10, 3), np.uint8))
+    truncated = tmp_path / "b.jpg"
+    truncated.write_bytes(write_jpeg(tmp_path / "c.jpg", 10, 10).read_bytes()[:10])
+
+    assert read_jpeg_size(png) is None
+    assert read_jpeg_size(truncated) is None
+    assert read_jpeg_size(tmp_path / "missing.jpg") is None
+
+
+def test_reduced_flag():
+    assert reduced_flag((8 * LEVELS[-1], 100)) == cv2.IMREAD_REDUCED_COLOR_8
+    assert reduced_flag((8 * LEVELS[-1] - 8, 100)) == cv2.IMREAD_REDUCED_COLOR_4
+    assert reduced_flag((100, 2 * LEVELS[-1])) == cv2.IMREAD_REDUCED_COLOR_2
+    assert reduced_flag((LEVELS[-1], 100)) == cv2.IMREAD_COLOR
+    assert reduced_flag(None) == cv2.IMREAD_COLOR
+
+
+@pytest.mark.parametrize("size", [(4000, 3000), (900, 600), (300, 200)])
+def test_create_thumbnail(tmp_path, size):
+    path = write_jpeg(tmp_path / "a.jpg", *size)
+
+    levels = create_thumbnail(str(path), [])
+
+    assert [level for level, _ in levels] == sorted(LEVELS, reverse=True)
+    image = cv2.imdecode(np.frombuffer(levels[0][1], np.uint8), cv2.IMREAD_COLOR)
+    assert max(image.shape[:2]) == min(max(size), LEVELS[-1])